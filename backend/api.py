@@ -1,4 +1,4 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel
@@ -6,11 +6,26 @@ from typing import List, Optional
 import os
 import json
 import asyncio
+import threading
+import uuid
 from datetime import date, datetime
 
 # Import the LangGraph app and Supabase storage
-from main import app as graph_app
+from main import app as graph_app, regenerate_app, regeneration_inputs
 import supabase_storage
+import metrics
+import model_registry
+import post_renderer
+import prerouter
+import profiling
+import search_index
+import singleflight
+import static_export
+import storage_gc
+import topic_index
+import cancellation
+import coordination
+import deadline
 
 app = FastAPI(title="Blog Writing Agent API")
 
@@ -33,6 +48,15 @@ class GenerateRequest(BaseModel):
     topic: str
     as_of: Optional[str] = None
     image_model: str = "huggingface"
+    latency_budget_ms: Optional[int] = None
+    cost_budget_usd: Optional[float] = None
+    deadline_ms: Optional[int] = None # nodes cut research, section length and images to finish in time
+
+
+class RegenerateRequest(BaseModel):
+    task_ids: List[int] = [] # plan task ids to rewrite
+    refresh_research: bool = False # re-run the stored queries; tasks fresh evidence touches are rewritten
+    image_model: Optional[str] = None
     
 class BlogPost(BaseModel):
     filename: str
@@ -79,27 +103,403 @@ async def list_posts():
         return []
 
 @app.get("/posts/{filename}")
-async def get_post(filename: str):
-    """Get the content of a specific blog post from Supabase."""
+async def get_post(filename: str, request: Request):
+    """
+    Get a blog post from Supabase.
+
+    Serves markdown by default or the pre-rendered HTML when the client prefers
+    text/html, sending the stored br/gzip bytes as-is when Accept-Encoding allows.
+    """
+    media_type = post_renderer.negotiate_media_type(request.headers.get("accept"))
+    name = filename if media_type == "text/markdown" else post_renderer.post_stem(filename) + post_renderer.HTML_SUFFIX
+    headers = {"Vary": "Accept, Accept-Encoding"}
+
+    encodings = list(post_renderer.ENCODING_SUFFIXES)
+    while True:
+        encoding = post_renderer.negotiate_encoding(request.headers.get("accept-encoding"), encodings)
+        if encoding is None:
+            break
+        body = supabase_storage.get_post_file(name + post_renderer.ENCODING_SUFFIXES[encoding])
+        if body is not None:
+            metrics.incr(f"posts.served.{encoding}")
+            return Response(content=body, media_type=media_type, headers={**headers, "Content-Encoding": encoding})
+        encodings.remove(encoding)
+
+    body = supabase_storage.get_post_file(name) if media_type == "text/html" else None
+    if body is None:
+        content = supabase_storage.get_blog_post(filename)
+        if not content:
+            raise HTTPException(status_code=404, detail="Post not found")
+        body = content
+        if media_type == "text/html":
+            # Posts uploaded before pre-rendering: render on request
+            html, _ = post_renderer.render_html(content)
+            if html is None:
+                media_type, body = "text/markdown", content
+            else:
+                body = html
+                metrics.incr("posts.rendered_on_request")
+
+    metrics.incr("posts.served.identity")
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+@app.get("/posts/{filename}/toc")
+async def get_post_toc(filename: str):
+    """Table of contents ([{level, title, id}]) matching the heading ids in the post HTML."""
+    stored = supabase_storage.get_post_file(post_renderer.post_stem(filename) + post_renderer.TOC_SUFFIX)
+    if stored is not None:
+        return json.loads(stored)
+
     content = supabase_storage.get_blog_post(filename)
-    
     if not content:
         raise HTTPException(status_code=404, detail="Post not found")
+    return post_renderer.render_html(content)[1]
+
+def _bootstrap_search_index() -> None:
+    """
+    Build the search index from the bucket when this instance starts without one,
+    otherwise reconcile it with the bucket: posts published, edited or deleted
+    while this process was down (or by another writer) are re-indexed or dropped.
+    """
+    index = search_index.get_index()
+    try:
+        # Not list_blog_posts: it returns [] on errors, which would wipe the index
+        files = [f for f in supabase_storage.list_all("markdown") if f.get("name", "").endswith(".md")]
+    except Exception as e:
+        print(f"🔎 Search index not reconciled, listing posts failed: {e}")
+        return
+    if not len(index):
+        if not files:
+            return
+        print(f"🔎 Building search index from {len(files)} stored posts...")
+        posts = ((f["name"], supabase_storage.get_blog_post(f["name"]) or "") for f in files)
+        index.rebuild(posts)
+        print(f"🔎 Search index ready ({len(index)} posts)")
+        return
+
+    indexed = index.indexed()
+    stored = {f["name"] for f in files}
+    stale = []
+    for f in files:
+        indexed_at = indexed.get(f["name"])
+        updated = f.get("updated_at")
+        updated_at = datetime.fromisoformat(updated.replace("Z", "+00:00")).timestamp() if updated else 0
+        # Entries from older segments have no index time; only missing ones are re-indexed
+        if indexed_at is None or (indexed_at and updated_at > indexed_at):
+            stale.append(f["name"])
+    gone = [name for name in indexed if name not in stored]
+    for name in gone:
+        index.remove(name)
+    for name in stale:
+        markdown = supabase_storage.get_blog_post(name)
+        if markdown is not None:
+            index.add(name, markdown)
+    if stale or gone:
+        print(f"🔎 Search index reconciled: {len(stale)} posts re-indexed, {len(gone)} removed")
+
+
+@app.on_event("startup")
+async def start_search_index():
+    threading.Thread(target=_bootstrap_search_index, name="search-bootstrap", daemon=True).start()
+    storage_gc.start_periodic()
+    static_export.start_periodic()
+
+
+@app.get("/search")
+def search_posts(q: str, limit: int = 10):
+    """BM25 search over post titles, headings and body text (sync: runs in the threadpool)."""
+    with metrics.timed("search.query_ms"):
+        results = search_index.get_index().search(q, limit=max(1, min(limit, 50)))
+    return {"query": q, "results": results}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Runtime counters and latency summaries recorded by the graph and API."""
+    return {
+        **metrics.snapshot(),
+        "prerouter": prerouter.precision_report(),
+        "models": model_registry.usage_report(),
+        "generate_runs": _generate_runs.stats(),
+        "coordination": coordination.stats(),
+        "topic_matches": topic_index.hit_report(),
+    }
+
+# Admin endpoints are disabled unless a token is configured
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+class ProfilingRequest(BaseModel):
+    enabled: bool
+    duration_s: float = 300 # profiling switches itself off after this long
+    sample_interval_ms: Optional[float] = None
+    run_sample_rate: Optional[float] = None # share of runs to profile (0-1)
+
+
+def _require_admin(request: Request) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (set ADMIN_TOKEN)")
+    if request.headers.get("x-admin-token") != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@app.get("/admin/profiling")
+async def get_profiling(request: Request):
+    """Profiling status and summaries of the most recently profiled runs."""
+    _require_admin(request)
+    return {"status": profiling.status(), "runs": profiling.records()}
+
+
+@app.post("/admin/profiling")
+async def set_profiling(body: ProfilingRequest, request: Request):
+    """Start or stop CPU sampling and tracemalloc on this worker."""
+    _require_admin(request)
+    if body.enabled:
+        return profiling.start(body.duration_s, body.sample_interval_ms, body.run_sample_rate)
+    return profiling.stop()
+
+
+@app.get("/admin/profiling/runs/{run_id}")
+async def get_run_profile(run_id: str, request: Request):
+    """Full profile of one run: per-node CPU and memory, hot stacks and top allocators."""
+    _require_admin(request)
+    record = profiling.get_record(run_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="No profile recorded for this run")
+    return record
+
+
+@app.post("/admin/storage/gc")
+async def collect_storage_garbage(request: Request, dry_run: bool = True):
+    """Mark-and-sweep unreferenced images; reports reclaimed bytes and requests saved."""
+    _require_admin(request)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, storage_gc.collect, dry_run)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.post("/admin/export")
+async def run_static_export(request: Request, full: bool = False):
+    """Apply pending post changes to the static export (or rebuild it with full=true)."""
+    _require_admin(request)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, static_export.export, full)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+# Seconds of silence before an SSE heartbeat comment is sent
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+# How often a stream checks whether its client went away; bounds how long an
+# abandoned run keeps spending after the last client disconnects
+SSE_DISCONNECT_POLL_SECONDS = float(os.getenv("SSE_DISCONNECT_POLL_SECONDS", "0.25"))
+
+
+def _cancel_abandoned_run(run: singleflight.InFlightRun) -> None:
+    # Every client went away: stop spending tokens and provider calls on the run
+    print(f"🛑 All clients disconnected, cancelling run {run.context.get('run_id')}")
+    cancellation.cancel(run.context.get("run_id"))
+
+
+# Identical concurrent requests share one graph run (and one upload)
+_generate_runs = singleflight.SingleFlight("generate", on_abandoned=_cancel_abandoned_run)
+
+
+def _is_progress(event: dict) -> bool:
+    # Per-node summaries can be collapsed for slow consumers; terminal events cannot
+    return "node" in event
+
+
+def _coalesce_key(request: GenerateRequest) -> tuple:
+    topic = " ".join(request.topic.lower().split())
+    # Budgets change models and deadline cuts, so only identical budgets share a run
+    budget = (request.latency_budget_ms, request.cost_budget_usd, request.deadline_ms)
+    return (topic, request.as_of or date.today().isoformat(), request.image_model, *budget)
+
+
+def _run_graph(inputs: dict, run: singleflight.InFlightRun, graph=graph_app) -> None:
+    """
+    Run the graph to completion, publishing SSE payloads to the shared run.
+    graph.stream is synchronous, so this runs in a worker thread.
+    """
+    current_state = {}
     
-    return Response(content=content, media_type="text/markdown")
+    try:
+        for output in graph.stream(inputs, stream_mode="updates"):
+            # Check for node name
+            node_name = list(output.keys())[0] if output else "unknown"
+            
+            # Update our tracking state
+            if isinstance(output, dict):
+                if len(output) == 1 and isinstance(next(iter(output.values())), dict):
+                    inner = next(iter(output.values()))
+                    degradations = list(current_state.get("degradations", []))
+                    degradations += [d for d in inner.get("degradations") or [] if d not in degradations]
+                    current_state.update(inner)
+                    current_state["degradations"] = degradations
+                else:
+                    current_state.update(output)
+
+            # Calculate plan tasks count safely
+            plan_tasks_count = 0
+            plan_obj = current_state.get("plan")
+            if plan_obj:
+                if hasattr(plan_obj, "tasks"): # Pydantic model
+                    plan_tasks_count = len(plan_obj.tasks)
+                elif isinstance(plan_obj, dict):
+                    plan_tasks_count = len(plan_obj.get("tasks", []))
+
+            # Construct a summary for the frontend
+            run.publish({
+                "node": node_name,
+                "status": f"Finished step: {node_name}",
+                "state_summary": {
+                    "mode": current_state.get("mode"),
+                    "plan_tasks": plan_tasks_count,
+                    "evidence_count": len(current_state.get("evidence", []) or []),
+                    "images_count": len(current_state.get("image_specs", []) or []),
+                }
+            })
+
+        final_md = current_state.get("final")
+        if final_md:
+            complete = {'status': 'complete', 'final': final_md}
+            if current_state.get("matched_post"):
+                complete['matched_post'] = current_state["matched_post"]
+            complete['run_id'] = inputs["run_id"]
+            left = deadline.remaining_ms(inputs.get("budget"))
+            if left is not None:
+                complete['degradations'] = current_state.get("degradations", [])
+                complete['deadline_met'] = left >= 0
+                if left < 0:
+                    metrics.incr("deadline.missed")
+            run.publish(complete)
+        else:
+            run.publish({'status': 'complete', 'message': 'Stream ended'})
+
+    except cancellation.RunCancelled:
+        print(f"🛑 Run {inputs['run_id']} stopped after cancellation")
+    except Exception as e:
+        run.publish({'error': str(e)})
+    finally:
+        _generate_runs.complete(run)
+        cancellation.release(inputs["run_id"])
+
+
+def _run_profiled(inputs: dict, run: singleflight.InFlightRun, graph) -> None:
+    # A no-op unless profiling is on and this run is sampled
+    with profiling.run(inputs["run_id"]):
+        _run_graph(inputs, run, graph)
+
+
+def _claim_or_follow(shared_key: str, run: singleflight.InFlightRun, run_id: str) -> Optional[coordination.Lease]:
+    """
+    Claim a request for this process, or follow the identical run another
+    worker process has in flight and relay its result.
+
+    Returns:
+        The lease when this process should run the graph; None once the other
+        process's result was published to run
+    """
+    def on_lost():
+        # Our lease expired (e.g. renewals failed) and another worker now runs this
+        # request: stop duplicating it
+        print(f"🛑 Run {run_id} lost its claim to another worker, cancelling")
+        run.publish({'error': 'This request was taken over by another worker; retry to follow it'})
+        cancellation.cancel(run_id)
+
+    while True:
+        lease, owner = coordination.claim(shared_key, run_id, on_lost)
+        if lease is not None:
+            return lease
+        run.publish({'status': 'Joined in-flight generation in another worker'})
+        result = coordination.wait_for(shared_key, owner, run_id)
+        if result is not None:
+            metrics.incr("generate.remote_joined")
+            run.publish(result)
+            return None
+        # The owner finished without a result or stopped renewing its claim: claim again
+
+
+def _run_shared(key: tuple, inputs: dict, run: singleflight.InFlightRun, graph) -> None:
+    """Run the graph unless another worker process is already running the same request."""
+    shared_key = json.dumps(key)
+    try:
+        lease = _claim_or_follow(shared_key, run, inputs["run_id"])
+    except cancellation.RunCancelled:
+        lease = None
+    if lease is None:
+        _generate_runs.complete(run)
+        cancellation.release(inputs["run_id"])
+        return
+    try:
+        _run_profiled(inputs, run, graph)
+    finally:
+        # Only a finished post is handed to followers; they retry failed runs themselves
+        last = run.events[-1] if run.events else {}
+        lease.release(last if last.get("final") else None)
+
+
+def _start_run(key: tuple, inputs: dict, loop: asyncio.AbstractEventLoop, graph=graph_app):
+    def start(run: singleflight.InFlightRun):
+        run.context["run_id"] = inputs["run_id"]
+        loop.run_in_executor(None, _run_shared, key, inputs, run, graph)
+    return start
+
+
+async def _stream_run(key: tuple, inputs: dict, http_request: Request, graph=graph_app):
+    """Join or start the run for key and relay its events as SSE."""
+    loop = asyncio.get_running_loop()
+    run, started = _generate_runs.join_or_start(key, _start_run(key, inputs, loop, graph))
+    try:
+        if not started:
+            yield f"data: {json.dumps({'status': 'Joined in-flight generation for this topic'})}\n\n"
+
+        last_sent = last_polled = loop.time()
+        async for event in run.subscribe(SSE_DISCONNECT_POLL_SECONDS, _is_progress):
+            now = loop.time()
+            if now - last_polled >= SSE_DISCONNECT_POLL_SECONDS:
+                last_polled = now
+                if await http_request.is_disconnected():
+                    break
+            if event is None:
+                if now - last_sent >= SSE_HEARTBEAT_SECONDS:
+                    last_sent = now
+                    yield ": heartbeat\n\n"
+                continue
+            last_sent = now
+            yield f"data: {json.dumps(event)}\n\n"
+    finally:
+        # Also runs when Starlette cancels the stream on client disconnect
+        _generate_runs.leave(run)
+
 
 @app.post("/generate")
-async def generate_blog(request: GenerateRequest):
+async def generate_blog(request: GenerateRequest, http_request: Request):
     """
     Trigger blog generation and stream updates.
     Returns a Server-Sent Events (SSE) stream.
+
+    Requests with the same topic, as_of, image_model and budget as a run already
+    in flight attach to that run instead of starting a new one (across worker
+    processes with COORDINATION=sqlite). When every client of a run
+    disconnects, the run is cancelled.
     """
     
     async def event_generator():
         inputs = {
+            "run_id": uuid.uuid4().hex,
             "topic": request.topic,
             "as_of": request.as_of or date.today().isoformat(),
             "image_model": request.image_model,
+            "budget": {
+                # The deadline only drives deadline cuts; model tiering follows latency_budget_ms
+                "latency_ms": request.latency_budget_ms,
+                "cost_usd": request.cost_budget_usd,
+                **deadline.budget_fields(request.deadline_ms),
+            } if request.latency_budget_ms or request.cost_budget_usd or request.deadline_ms else None,
             "recency_days": 30, # Default
             # Initialize other state keys
              "mode": "",
@@ -107,88 +507,55 @@ async def generate_blog(request: GenerateRequest):
             "queries": [],
             "evidence": [],
             "plan": None,
+            "matched_post": None,
+            "existing_sections": {},
+            "prior_evidence_urls": [],
+            "prior_image_specs": [],
+            "degradations": [],
             "sections": [],
             "merged_md": "",
+            "section_index": [],
             "md_with_placeholders": "",
             "image_specs": [],
             "final": "",
         }
 
-        current_state = {}
-        
-        try:
-            # We use the sync graph_app.stream but run it in a threadpool if it blocks too much,
-            # or just iterate if it's fast enough. LangGraph sync stream yields sync.
-            # For FastAPI SSE, we need async generator.
-            
-            # Since LangGraph stream is synchronous (in this codebase), we can iterate it 
-            # but wrapping in a loop.
-            
-            # Note: If graph_app.stream is blocking, this might block the event loop.
-            # Ideally verify if 'app' is compiled with async support or runs sync.
-            # standard LangGraph 'app.stream' is usually sync or async depending on compile.
-            # The codebase uses 'app.stream' in 'try_stream' which implies it's iterable.
-            
-            # Let's assume it's sync for now and just yield.
-            
-            for output in graph_app.stream(inputs, stream_mode="updates"):
-                # yield step updates
-                # Format: match what frontend expects or just generic events
-                
-                # Check for node name
-                node_name = list(output.keys())[0] if output else "unknown"
-                
-                # Update our tracking state
-                # Note: 'extract_latest_state' helper from main.py might be useful if we import it,
-                # but simple update logic:
-                if isinstance(output, dict):
-                    if len(output) == 1 and isinstance(next(iter(output.values())), dict):
-                        inner = next(iter(output.values()))
-                        current_state.update(inner)
-                    else:
-                        current_state.update(output)
-
-                # Calculate plan tasks count safely
-                plan_tasks_count = 0
-                plan_obj = current_state.get("plan")
-                if plan_obj:
-                    if hasattr(plan_obj, "tasks"): # Pydantic model
-                        plan_tasks_count = len(plan_obj.tasks)
-                    elif isinstance(plan_obj, dict):
-                        plan_tasks_count = len(plan_obj.get("tasks", []))
-
-                # Construct a summary for the frontend
-                summary = {
-                    "node": node_name,
-                    "status": f"Finished step: {node_name}",
-                    "state_summary": {
-                        "mode": current_state.get("mode"),
-                        "plan_tasks": plan_tasks_count,
-                        "evidence_count": len(current_state.get("evidence", []) or []),
-                        "images_count": len(current_state.get("image_specs", []) or []),
-                    }
-                }
-                
-                yield f"data: {json.dumps(summary)}\n\n"
-                # Small sleep to let event loop breathe if needed
-                await asyncio.sleep(0.01)
+        async for chunk in _stream_run(_coalesce_key(request), inputs, http_request):
+            yield chunk
 
-            # Final result is in current_state.get("final") -- actually wait
-            # After stream ends, we might want to send a "complete" event ?
-            # Or reliance on the client seeing the stream close.
-            
-            # Optionally check if 'final' is in current_state, if not, it might be in the last update
-            
-            final_md = current_state.get("final")
-            if final_md:
-                 yield f"data: {json.dumps({'status': 'complete', 'final': final_md})}\n\n"
-            else:
-                 yield f"data: {json.dumps({'status': 'complete', 'message': 'Stream ended'})}\n\n"
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
 
-        except Exception as e:
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+@app.post("/posts/{filename}/regenerate")
+async def regenerate_post(filename: str, request: RegenerateRequest, http_request: Request):
+    """
+    Regenerate selected sections of a published post and stream updates (SSE).
+
+    Only the requested task ids are rewritten (plus, with refresh_research, the
+    tasks that fresh evidence touches); every other section is reused from the
+    run artifacts stored with the post, then the post is re-merged and re-uploaded.
+    """
+    if not request.task_ids and not request.refresh_research:
+        raise HTTPException(status_code=400, detail="Nothing to regenerate: pass task_ids and/or refresh_research")
+
+    artifacts = supabase_storage.get_artifacts(filename)
+    if artifacts is None:
+        raise HTTPException(status_code=404, detail="No run artifacts stored for this post")
+    if request.refresh_research and not artifacts.get("queries"):
+        raise HTTPException(status_code=400, detail="This post was written without research")
+
+    try:
+        inputs = regeneration_inputs(
+            filename, artifacts, request.task_ids, request.refresh_research, request.image_model
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    metrics.incr("regenerate.requests")
+    key = ("regenerate", filename, tuple(sorted(set(request.task_ids))), request.refresh_research)
+    return StreamingResponse(
+        _stream_run(key, inputs, http_request, regenerate_app), media_type="text/event-stream"
+    )
 
 if __name__ == "__main__":
     import uvicorn
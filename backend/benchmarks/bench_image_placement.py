@@ -0,0 +1,89 @@
+"""
+Benchmark: image placement on large posts.
+
+Compares the old approach (split/scan/join the markdown once per image, then one
+full-string replace per spec) with the section index built in merge_content
+(one linear pass for placement + substitution).
+
+Usage (from backend/):
+    python benchmarks/bench_image_placement.py [--sections 200] [--images 50]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from markdown_sections import merge_sections, place_blocks  # noqa: E402
+
+
+def legacy_place_and_substitute(merged_md: str, specs: list) -> str:
+    md = merged_md
+    for spec in specs:
+        lines = md.split("\n")
+        insert_idx = None
+        for i, line in enumerate(lines):
+            if line.startswith("## ") and insert_idx is None:
+                for j in range(i + 1, len(lines)):
+                    if lines[j].startswith("## ") or j == len(lines) - 1:
+                        insert_idx = j
+                        break
+                break
+        if insert_idx:
+            lines.insert(insert_idx, f"\n{spec['placeholder']}\n")
+            md = "\n".join(lines)
+    for spec in specs:
+        md = md.replace(spec["placeholder"], spec["block"])
+    return md
+
+
+def indexed_place_and_substitute(merged_md: str, section_index: list, specs: list) -> str:
+    return place_blocks(merged_md, section_index, [(s["section_id"], s["block"]) for s in specs])
+
+
+def make_post(n_sections: int, words_per_section: int):
+    para = " ".join(f"word{i}" for i in range(words_per_section))
+    sections = [(i, f"## Section {i}\n\n{para}\n\n{para}") for i in range(1, n_sections + 1)]
+    return merge_sections("Benchmark Post", sections)
+
+
+def bench(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sections", type=int, default=200)
+    parser.add_argument("--words", type=int, default=300)
+    parser.add_argument("--images", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    merged_md, section_index = make_post(args.sections, args.words)
+    specs = [
+        {
+            "placeholder": f"[[IMAGE_{i}]]",
+            "section_id": (i % args.sections) + 1,
+            "block": f"![alt {i}](https://example.com/image_{i}.png)\n*caption {i}*",
+        }
+        for i in range(1, args.images + 1)
+    ]
+
+    legacy_ms = bench(lambda: legacy_place_and_substitute(merged_md, specs), args.repeat)
+    indexed_ms = bench(lambda: indexed_place_and_substitute(merged_md, section_index, specs), args.repeat)
+
+    print(f"post: {len(merged_md):,} chars, {args.sections} sections, {args.images} images")
+    print(f"legacy  (split/join + replace per image): {legacy_ms:8.2f} ms")
+    print(f"indexed (single pass):                    {indexed_ms:8.2f} ms")
+    print(f"speedup: {legacy_ms / max(indexed_ms, 1e-6):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark: packed multi-section workers vs. one request per section.
+
+Builds the real worker prompts for a few plan shapes (no LLM calls) and reports
+estimated input tokens and requests per post for the current fan-out and for
+packed mode, plus how the packed-response parser handles well-formed and
+malformed responses (the malformed ones fall back to per-task requests).
+
+Usage (from backend/):
+    python benchmarks/bench_packed_workers.py [--evidence 20] [--max-output-tokens 2400]
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# main.py builds the Supabase client at import; no requests are made here
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "benchmark")
+
+import main  # noqa: E402
+import section_packing  # noqa: E402
+
+SHAPES = {
+    "3 x 300 words (default plan)": [300, 300, 300],
+    "3 x 150 words (short post)": [150, 150, 150],
+    "3 sections, one long": [250, 250, 900],
+    "3 x 600 words (long post)": [600, 600, 600],
+}
+
+
+def make_plan(word_targets):
+    tasks = [
+        main.Task(
+            id=i,
+            title=f"Section {i}: How the B-tree keeps lookups logarithmic",
+            goal="Explain how node fan-out bounds tree height and disk reads.",
+            bullets=["Node layout and fan-out", "Splits and merges on insert/delete", "Why range scans stay cheap"],
+            target_words=words,
+            requires_research=True,
+            requires_citations=True,
+        )
+        for i, words in enumerate(word_targets, start=1)
+    ]
+    return main.Plan(blog_title="How B-Trees Keep Databases Fast", tasks=tasks)
+
+
+def make_payload(plan, evidence_count):
+    evidence = [
+        {"title": f"Storage engine internals, part {i}", "url": f"https://example.com/{i}", "published_at": "2026-09-01"}
+        for i in range(evidence_count)
+    ]
+    return {
+        "topic": "B-tree indexes", "mode": "hybrid", "as_of": "2026-10-19", "recency_days": 45,
+        "plan": plan.model_dump(), "evidence": evidence,
+    }
+
+
+def response(ids, drop=None, bad_heading=None):
+    parts = []
+    for i in ids:
+        if i == drop:
+            continue
+        heading = f"Section {i}" if i == bad_heading else f"## Section {i}"
+        parts.append(f"{section_packing.DELIMITER.format(id=i)}\n{heading}\n\nBody of section {i}.")
+    return "\n\n".join(parts)
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--evidence", type=int, default=20)
+    parser.add_argument("--max-output-tokens", type=int, default=section_packing.PACK_MAX_OUTPUT_TOKENS)
+    args = parser.parse_args()
+
+    print(f"{'plan':<30} {'fan-out req':>11} {'tokens':>8} {'packed req':>11} {'tokens':>8} {'saved':>7}")
+    for label, targets in SHAPES.items():
+        plan = make_plan(targets)
+        payload = make_payload(plan, args.evidence)
+        fanout_tokens = sum(main._estimate_messages(main._worker_messages(payload, plan, t)) for t in plan.tasks)
+        groups = section_packing.plan_packs(plan.tasks, args.max_output_tokens)
+        packed_tokens = sum(
+            main._estimate_messages(
+                main._packed_messages(payload, plan, g) if len(g) > 1 else main._worker_messages(payload, plan, g[0])
+            )
+            for g in groups
+        )
+        saved = 1 - packed_tokens / fanout_tokens
+        print(f"{label:<30} {len(plan.tasks):>11} {fanout_tokens:>8,} {len(groups):>11} {packed_tokens:>8,} {saved:>6.0%}")
+
+    ids = [1, 2, 3]
+    cases = {
+        "well-formed": response(ids),
+        "preamble before first delimiter": "Sure! Here are the sections.\n\n" + response(ids),
+        "missing section": response(ids, drop=2),
+        "heading without ##": response(ids, bad_heading=3),
+        "no delimiters": "## Section 1\n\nBody.",
+    }
+    print("\nparser")
+    for label, text in cases.items():
+        parsed = section_packing.parse_packed(text, ids)
+        outcome = "split into 3 sections" if parsed else "fallback to per-task requests"
+        print(f"  {label:<34} {outcome}")
+
+
+if __name__ == "__main__":
+    main_()
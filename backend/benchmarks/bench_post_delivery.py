@@ -0,0 +1,145 @@
+"""
+Benchmark: pre-rendered, precompressed post delivery vs. raw markdown.
+
+Serves one synthetic post through the /posts/{filename} handler with storage
+replaced by an in-memory dict, and reports response bytes and server CPU per
+request for each Accept / Accept-Encoding combination, next to the previous
+behaviour (raw markdown, optionally gzip-compressed per request the way a
+compression middleware would).
+
+Usage (from backend/):
+    python benchmarks/bench_post_delivery.py [--requests 2000] [--sections 8]
+"""
+
+import argparse
+import asyncio
+import gzip
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# api.py builds the Supabase client at import; no requests are made here
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "benchmark")
+
+from fastapi.responses import Response  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+
+import api  # noqa: E402
+import post_renderer  # noqa: E402
+import supabase_storage  # noqa: E402
+
+FILENAME = "benchmark-post.md"
+
+
+WORDS = (
+    "btree node page key split merge leaf fanout cache disk latency range scan index insert delete "
+    "balance height pointer sibling buffer pool write ahead log lock latch concurrent read sorted "
+    "database storage engine query planner cost block sequential random access memory"
+).split()
+
+
+def paragraph(rng: random.Random, sentences: int = 12) -> str:
+    return " ".join(
+        " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 18))).capitalize() + "."
+        for _ in range(sentences)
+    )
+
+
+def sample_post(sections: int) -> str:
+    rng = random.Random(0)
+    parts = ["# Benchmark Post: How B-Trees Keep Databases Fast"]
+    for i in range(1, sections + 1):
+        parts.append(
+            f"## Section {i}: Node Layout and Fan-Out\n\n"
+            + paragraph(rng)
+            + "\n\n- Wide nodes reduce tree height\n- Splits propagate upward\n- Leaves are linked for range scans\n\n"
+            + "```python\ndef search(node, key):\n    while not node.leaf:\n        node = node.child_for(key)\n"
+            + "    return node.find(key)\n```\n\n"
+            + f"[![Diagram {i}](https://example.supabase.co/images/image_{i}-w768.webp)]"
+            + f"(https://example.supabase.co/images/image_{i}-w1024.webp)\n*Figure {i}*"
+        )
+    return "\n\n".join(parts)
+
+
+def make_request(accept: str, accept_encoding: str) -> Request:
+    headers = [(b"accept", accept.encode()), (b"accept-encoding", accept_encoding.encode())]
+    return Request({"type": "http", "method": "GET", "path": f"/posts/{FILENAME}", "headers": headers})
+
+
+async def legacy_get_post(filename: str, compress: bool) -> Response:
+    """The handler before pre-rendering, optionally with per-request gzip."""
+    content = supabase_storage.get_blog_post(filename)
+    if not compress:
+        return Response(content=content, media_type="text/markdown")
+    return Response(
+        content=gzip.compress(content.encode("utf-8"), compresslevel=9),
+        media_type="text/markdown",
+        headers={"Content-Encoding": "gzip"},
+    )
+
+
+def measure(handler, n: int):
+    loop = asyncio.new_event_loop()
+    response = loop.run_until_complete(handler())
+    start = time.process_time()
+    for _ in range(n):
+        loop.run_until_complete(handler())
+    cpu_us = (time.process_time() - start) / n * 1e6
+    loop.close()
+    return len(response.body), response.headers.get("content-encoding", "identity"), cpu_us
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--sections", type=int, default=8)
+    args = parser.parse_args()
+
+    markdown = sample_post(args.sections)
+    store = {FILENAME: markdown.encode("utf-8")}
+    start = time.process_time()
+    for name, (data, _) in post_renderer.build_renditions(markdown, FILENAME).items():
+        store[name] = data
+    upload_ms = (time.process_time() - start) * 1000
+
+    supabase_storage.get_post_file = store.get
+    supabase_storage.get_blog_post = lambda name: store[name].decode("utf-8") if name in store else None
+
+    cases = [
+        ("before: markdown", lambda: legacy_get_post(FILENAME, compress=False)),
+        ("before: markdown + per-request gzip", lambda: legacy_get_post(FILENAME, compress=True)),
+        ("markdown, identity", lambda: api.get_post(FILENAME, make_request("*/*", "identity"))),
+        ("markdown, precompressed", lambda: api.get_post(FILENAME, make_request("*/*", "gzip, deflate, br"))),
+        ("html, precompressed", lambda: api.get_post(FILENAME, make_request("text/html", "gzip, deflate, br"))),
+    ]
+
+    # Posts stored before pre-rendering: HTML is rendered on every request
+    legacy_store = {FILENAME: store[FILENAME]}
+
+    async def html_on_request():
+        supabase_storage.get_post_file = legacy_store.get
+        try:
+            return await api.get_post(FILENAME, make_request("text/html", "gzip, br"))
+        finally:
+            supabase_storage.get_post_file = store.get
+
+    cases.append(("html, rendered per request (old posts)", html_on_request))
+
+    print(f"post: {len(markdown):,} chars of markdown, renditions built once at upload in {upload_ms:.1f} ms CPU")
+    print(f"{'case':<42} {'bytes':>8} {'encoding':>9} {'cpu/request':>12}")
+    for label, handler in cases:
+        size, encoding, cpu_us = measure(handler, args.requests)
+        print(f"{label:<42} {size:>8,} {encoding:>9} {cpu_us:>9.1f} us")
+
+    start = time.process_time()
+    for _ in range(200):
+        post_renderer.render_html(markdown)
+    print(f"\nmarkdown -> HTML render (markdown-it): {(time.process_time() - start) / 200 * 1000:.2f} ms CPU per post")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,103 @@
+"""
+Benchmark: BM25 post search on a synthetic 10k-post corpus.
+
+Generates posts with a Zipf-distributed vocabulary, builds the on-disk segment,
+reopens it through mmap (as a restart would), journals a batch of incremental
+updates on top, and reports query latency percentiles for 1-3 term queries.
+
+Usage (from backend/):
+    python benchmarks/bench_search.py [--posts 10000] [--queries 2000] [--delta 200]
+"""
+
+import argparse
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import search_index  # noqa: E402
+
+VOCAB_SIZE = 30000
+
+
+def make_vocab(rng: random.Random) -> list:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < VOCAB_SIZE:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(3, 10))))
+    return sorted(words)
+
+
+def make_post(rng: random.Random, vocab: list, cum_weights: list, i: int) -> str:
+    def words(n):
+        return " ".join(rng.choices(vocab, cum_weights=cum_weights, k=n))
+
+    parts = [f"# {words(6).title()} {i}"]
+    for _ in range(rng.randint(4, 7)):
+        parts.append(f"## {words(4).title()}")
+        parts.append(". ".join(words(rng.randint(8, 20)) for _ in range(rng.randint(8, 16))) + ".")
+    return "\n\n".join(parts)
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--delta", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    vocab = make_vocab(rng)
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocab))))  # Zipf
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Keep the journal below the compaction threshold so the delta path is measured
+        search_index.SEARCH_INDEX_COMPACT_AFTER = args.delta + 1
+        index = search_index.SearchIndex(tmp)
+
+        start = time.perf_counter()
+        index.rebuild((f"post-{i}.md", make_post(rng, vocab, cum_weights, i)) for i in range(args.posts))
+        build_s = time.perf_counter() - start
+        seg_mb = os.path.getsize(index.segment_path) / 1e6
+
+        for i in range(args.delta):
+            name = f"post-{rng.randrange(args.posts)}.md" if i % 2 else f"new-{i}.md"
+            index.add(name, make_post(rng, vocab, cum_weights, args.posts + i))
+
+        start = time.perf_counter()
+        index = search_index.SearchIndex(tmp)  # restart: mmap the segment, replay the journal
+        load_ms = (time.perf_counter() - start) * 1000
+
+        # Queries mix frequent (head) and rarer (tail) terms
+        queries = [
+            " ".join(rng.choices(vocab[:200] if rng.random() < 0.5 else vocab[:5000], k=rng.randint(1, 3)))
+            for _ in range(args.queries)
+        ]
+        latencies = []
+        for q in queries:
+            start = time.perf_counter()
+            index.search(q, limit=10)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        print(f"posts:          {len(index):,} ({args.delta} journaled updates on top of the segment)")
+        print(f"build:          {build_s:.1f} s, segment {seg_mb:.1f} MB")
+        print(f"load (mmap):    {load_ms:.1f} ms")
+        print(f"query latency:  p50 {percentile(latencies, 50):.2f} ms, p95 {percentile(latencies, 95):.2f} ms, "
+              f"p99 {percentile(latencies, 99):.2f} ms, max {max(latencies):.2f} ms")
+
+        start = time.perf_counter()
+        index.compact()
+        print(f"compaction:     {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
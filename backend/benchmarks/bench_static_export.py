@@ -0,0 +1,180 @@
+"""
+Benchmark: full vs. incremental static export.
+
+Publishes a synthetic archive (10k posts by default) into an in-memory
+bucket, builds the static export once from scratch, then times incremental
+runs for single changes (publish, edit, delete) and a small batch. Each row
+reports wall time and the number of files written and removed. Finally a
+fresh full rebuild is compared with the incrementally maintained export:
+both must list the same posts in the same order with identical content.
+
+Usage (from backend/):
+    python benchmarks/bench_static_export.py [--posts 10000] [--sections 3]
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# supabase_storage builds the client at import; no requests are made here
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "benchmark")
+
+import static_export  # noqa: E402
+import supabase_storage  # noqa: E402
+
+WORDS = (
+    "btree node page key split merge leaf fanout cache disk latency range scan index insert delete "
+    "balance height pointer sibling buffer pool write ahead log lock latch concurrent read sorted"
+).split()
+
+STORE = {}  # bucket path -> (bytes, created_at, updated_at)
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def list_all(folder: str):
+    prefix = folder.rstrip("/") + "/"
+    return [
+        {"name": path[len(prefix):], "id": path, "created_at": _iso(c), "updated_at": _iso(u)}
+        for path, (_, c, u) in sorted(STORE.items())
+        if path.startswith(prefix) and "/" not in path[len(prefix):]
+    ]
+
+
+def upload(path, data, content_type):
+    now = time.time()
+    created = STORE[path][1] if path in STORE else now
+    STORE[path] = (data, created, now)
+    return path
+
+
+def remove_many(paths):
+    for path in paths:
+        STORE.pop(path, None)
+    return 1
+
+
+supabase_storage.list_all = list_all
+supabase_storage._upload = upload
+supabase_storage.remove_many = remove_many
+supabase_storage.get_blog_post = lambda name: (
+    STORE[f"markdown/{name}"][0].decode("utf-8") if f"markdown/{name}" in STORE else None
+)
+
+
+def sample_post(rng: random.Random, title: str, sections: int) -> str:
+    parts = [f"# {title}"]
+    for i in range(1, sections + 1):
+        text = " ".join(
+            " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 18))).capitalize() + "." for _ in range(10)
+        )
+        parts.append(f"## Section {i}\n\n{text}\n\n- Wide nodes reduce tree height\n- Leaves are linked")
+    return "\n\n".join(parts)
+
+
+def publish(filename: str, markdown: str) -> None:
+    upload(f"markdown/{filename}", markdown.encode("utf-8"), "text/markdown")
+    supabase_storage.log_change("put", filename)
+
+
+def delete(filename: str) -> None:
+    STORE.pop(f"markdown/{filename}", None)
+    supabase_storage.log_change("delete", filename)
+
+
+def timed_export(target, full=False):
+    start = time.perf_counter()
+    report = static_export.export(full=full, target=target)
+    return (time.perf_counter() - start) * 1000, report
+
+
+def archive_view(root: str):
+    """Posts in page order with their content, ignoring page boundaries and timestamps."""
+    target = static_export.DirectoryTarget(root)
+    index = json.loads(target.read("index.json"))
+    posts = []
+    for page in range(index["pages"]):
+        data = target.read(f"pages/{page}.json")
+        posts += [e["filename"] for e in json.loads(data)["posts"]] if data else []
+    records = {
+        name: (json.loads(target.read(f"posts/{name[:-3]}.json"))["markdown"], target.read(f"posts/{name[:-3]}.html"))
+        for name in posts
+    }
+    feed = [item["id"] for item in json.loads(target.read("feed.json"))["items"]]
+    return index["total"], posts, records, feed
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--sections", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    start = time.perf_counter()
+    for i in range(args.posts):
+        publish(f"post_{i:05d}.md", sample_post(rng, f"Post {i}: B-Tree Notes", args.sections))
+    print(f"archive: {args.posts:,} posts published in {time.perf_counter() - start:.1f}s\n")
+
+    root = tempfile.mkdtemp()
+    target = static_export.DirectoryTarget(root)
+    print(f"{'run':<36} {'time':>10} {'written':>8} {'removed':>8}")
+
+    def row(label, ms, report):
+        print(f"{label:<36} {ms:>8,.0f}ms {report['files_written']:>8,} {report['files_removed']:>8,}")
+
+    ms, report = timed_export(target, full=True)
+    full_ms = ms
+    row("full rebuild", ms, report)
+
+    incremental = []
+    publish("new_post.md", sample_post(rng, "A New Post", args.sections))
+    ms, report = timed_export(target)
+    incremental.append(ms)
+    row("incremental: publish 1 post", ms, report)
+
+    publish("post_00042.md", sample_post(rng, "Post 42: Edited", args.sections))
+    ms, report = timed_export(target)
+    incremental.append(ms)
+    row("incremental: edit 1 old post", ms, report)
+
+    delete(f"post_{args.posts // 2:05d}.md")
+    ms, report = timed_export(target)
+    incremental.append(ms)
+    row("incremental: delete 1 post", ms, report)
+
+    for i in range(10):
+        publish(f"batch_{i}.md", sample_post(rng, f"Batch {i}", args.sections))
+    ms, report = timed_export(target)
+    row("incremental: batch of 10 publishes", ms, report)
+
+    ms, report = timed_export(target)
+    row("incremental: nothing pending", ms, report)
+
+    single = sum(incremental) / len(incremental)
+    print(f"\nsingle change: {single:,.0f} ms vs {full_ms:,.0f} ms full rebuild ({full_ms / single:,.0f}x faster)")
+
+    # A fresh full rebuild must describe the same archive (pages may be packed
+    # tighter: the incremental export keeps the hole a deleted post leaves)
+    fresh = tempfile.mkdtemp()
+    static_export.export(full=True, target=static_export.DirectoryTarget(fresh))
+    same = archive_view(root) == archive_view(fresh)
+    print(f"incremental export matches a fresh full rebuild: {'yes' if same else 'NO'}")
+    shutil.rmtree(root)
+    shutil.rmtree(fresh)
+    sys.exit(0 if same else 1)
+
+
+if __name__ == "__main__":
+    main_()
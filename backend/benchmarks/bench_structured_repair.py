@@ -0,0 +1,98 @@
+"""
+Benchmark: local repair of near-miss structured outputs.
+
+Replays near-miss outputs through the same repair path main.py uses and
+reports how many would have needed a re-ask, the repair cost, and the latency
+saved versus re-asking every one.
+
+The bundled corpus (benchmarks/near_miss_outputs.json) is synthetic: hand-written
+outputs covering the failure modes seen with the 8B planner, not captured
+provider payloads. Its repair rate says which misses the repair path handles,
+not how often they occur. Pass --corpus with real Groq failed_generation
+arguments ({"source", "outputs": [{"schema", "note", "output"}]}) for that.
+
+Usage (from backend/):
+    python benchmarks/bench_structured_repair.py [--reask-ms 1500]
+
+--reask-ms is the latency of one structured LLM call; use the avg_ms reported
+for the node under "models" in /metrics for real numbers.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# main.py builds the Supabase client at import; no requests are made here
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault("SUPABASE_SERVICE_KEY", "benchmark")
+
+from pydantic import ValidationError  # noqa: E402
+
+import main  # noqa: E402
+import structured_repair  # noqa: E402
+
+SCHEMAS = {
+    "Plan": (main.Plan, main._repair_plan),
+    "GlobalImagePlan": (main.GlobalImagePlan, main._repair_image_plan),
+    "RouterDecision": (main.RouterDecision, None),
+}
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default=os.path.join(os.path.dirname(__file__), "near_miss_outputs.json"))
+    parser.add_argument("--reask-ms", type=float, default=1500.0)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    with open(args.corpus, "r", encoding="utf-8") as f:
+        corpus = json.load(f)
+    print(f"corpus: {os.path.basename(args.corpus)} ({corpus.get('source', 'unknown')}, "
+          f"{len(corpus['outputs'])} outputs)\n")
+
+    repaired = reasked = already_valid = 0
+    repair_s = 0.0
+    for item in corpus["outputs"]:
+        model_cls, post = SCHEMAS[item["schema"]]
+        try:
+            model_cls.model_validate(item["output"])
+            already_valid += 1
+            normalized = post is not None and post(json.loads(json.dumps(item["output"]))) != item["output"]
+            print(f"  {'normalized' if normalized else 'valid':<10} {item['schema']:<16} {item['note']}")
+            continue
+        except ValidationError:
+            pass
+
+        ok = True
+        t0 = time.perf_counter()
+        for _ in range(args.repeat):
+            try:
+                structured_repair.repair_and_validate(model_cls, json.loads(json.dumps(item["output"])), post)
+            except ValidationError:
+                ok = False
+                break
+        elapsed = (time.perf_counter() - t0) / (args.repeat if ok else 1)
+
+        print(f"  {'repaired' if ok else 're-ask':<10} {item['schema']:<16} {item['note']}")
+        if ok:
+            repaired += 1
+            repair_s += elapsed
+        else:
+            reasked += 1
+
+    misses = repaired + reasked
+    avg_repair_ms = (repair_s / repaired * 1000) if repaired else 0.0
+    saved_ms = repaired * (args.reask_ms - avg_repair_ms)
+    print()
+    print(f"near misses:      {misses} ({already_valid} already valid)")
+    print(f"repaired locally: {repaired} ({repaired / max(misses, 1):.0%}), avg {avg_repair_ms:.3f} ms each")
+    print(f"still re-asked:   {reasked}")
+    print(f"saved vs re-asking all: {saved_ms:,.0f} ms ({args.reask_ms:.0f} ms per re-ask)")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,268 @@
+"""
+Stress test: runs stop spending once every client has disconnected.
+
+Drives /generate's single-flight path (api._generate_runs with the real graph)
+against fake providers: a streaming LLM that emits a chunk every few ms and an
+image provider whose response body trickles in. Each scenario leaves the run
+at a chosen point the way a disconnecting SSE stream does
+(SingleFlight.leave -> cancellation.cancel) and checks that no LLM chunk, image
+chunk or new provider request happens more than --bound-ms after the last
+client left:
+
+- cancel while the workers stream their sections
+- cancel while an image body is downloading
+- two clients on one run: the first leaving must not stop it, the second must
+- an SSE client disconnects mid-run: api._stream_run must notice and stop the
+  run within SSE_DISCONNECT_POLL_SECONDS + --bound-ms
+
+Exits non-zero when any scenario misses its bound.
+
+Usage (from backend/):
+    python benchmarks/stress_cancellation.py [--bound-ms 200] [--chunk-ms 5]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+_tmp = tempfile.mkdtemp()
+# Set before the graph modules are imported (they read settings at import)
+os.environ.update({
+    "SUPABASE_URL": "https://example.supabase.co",
+    "SUPABASE_SERVICE_KEY": "benchmark",
+    "GROQ_API_KEY": "benchmark",
+    "HF_API_KEY": "benchmark",
+    "ENABLE_IMAGE_GENERATION": "true",
+    "PREROUTER_SHADOW_RATE": "0",
+    "PREROUTER_CACHE_PATH": os.path.join(_tmp, "prerouter.json"),
+    "TOPIC_MATCH_POLICY": "off",
+    "TOPIC_INDEX_PATH": os.path.join(_tmp, "topics.json"),
+})
+os.environ.pop("TAVILY_API_KEY", None)
+
+from langchain_core.messages import AIMessageChunk  # noqa: E402
+
+import api  # noqa: E402
+import main  # noqa: E402
+import model_registry  # noqa: E402
+import supabase_storage  # noqa: E402
+
+_events_lock = threading.Lock()
+EVENTS = []  # (time, kind): "llm_request", "llm_chunk", "image_request", "image_chunk"
+SETTINGS = {"chunk_s": 0.005, "llm_chunks": 400, "image_chunks": 400}
+
+
+def record(kind: str) -> None:
+    with _events_lock:
+        EVENTS.append((time.perf_counter(), kind))
+
+
+class _Structured:
+    def __init__(self, schema):
+        self.schema = schema
+
+    def invoke(self, messages, *args, **kwargs):
+        name = self.schema.__name__
+        if name == "RouterDecision":
+            parsed = main.RouterDecision(needs_research=False, mode="closed_book", reason="stress", queries=[])
+        elif name == "Plan":
+            parsed = main.Plan(blog_title="Cancellation Stress", tasks=[
+                main.Task(id=i, title=f"Section {i}", goal="g", bullets=["a", "b", "c"]) for i in (1, 2, 3)
+            ])
+        elif name == "GlobalImagePlan":
+            parsed = main.GlobalImagePlan(images=[
+                main.ImageSpec(placeholder=f"[[IMAGE_{i}]]", filename=f"image_{i}.png", alt="a", caption="c",
+                               prompt="p", section_id=i)
+                for i in (1, 2)
+            ])
+        else:
+            raise ValueError(name)
+        return {"raw": None, "parsed": parsed, "parsing_error": None}
+
+
+class FakeLLM:
+    """Streams a section one small chunk at a time."""
+
+    def with_structured_output(self, schema, include_raw=False, **kwargs):
+        return _Structured(schema)
+
+    def stream(self, messages, *args, **kwargs):
+        record("llm_request")
+        title = next(
+            line.split(":", 1)[1].strip() for line in messages[-1].content.splitlines()
+            if line.startswith("Section title:")
+        )
+        yield AIMessageChunk(content=f"## {title}\n\n")
+        for _ in range(SETTINGS["llm_chunks"]):
+            time.sleep(SETTINGS["chunk_s"])
+            record("llm_chunk")
+            yield AIMessageChunk(content="lorem ipsum ")
+
+
+class FakeImageResponse:
+    """A provider response whose body arrives slowly."""
+
+    status_code = 200
+    text = ""
+
+    def iter_content(self, chunk_size=None):
+        for _ in range(SETTINGS["image_chunks"]):
+            time.sleep(SETTINGS["chunk_s"])
+            record("image_chunk")
+            yield b"\0" * 1024
+
+    def close(self):
+        pass
+
+
+def fake_post(*args, **kwargs):
+    record("image_request")
+    return FakeImageResponse()
+
+
+model_registry.get_llm = lambda *args, **kwargs: FakeLLM()
+main.requests.post = fake_post
+supabase_storage._upload = lambda path, data, content_type: supabase_storage.public_url(path)
+supabase_storage.log_change = lambda op, filename: None
+
+
+def inputs() -> dict:
+    return {
+        "run_id": uuid.uuid4().hex, "topic": "What is a B-tree", "as_of": "2026-10-19",
+        "image_model": "huggingface", "budget": None, "recency_days": 30, "mode": "", "needs_research": False,
+        "queries": [], "evidence": [], "plan": None, "matched_post": None, "existing_sections": {},
+        "prior_evidence_urls": [], "prior_image_specs": [], "degradations": [], "sections": [],
+        "merged_md": "", "section_index": [], "md_with_placeholders": "", "image_specs": [], "final": "",
+    }
+
+
+async def wait_for_event(kind: str, timeout_s: float = 30) -> None:
+    end = time.perf_counter() + timeout_s
+    while time.perf_counter() < end:
+        with _events_lock:
+            if any(k == kind for _, k in EVENTS):
+                return
+        await asyncio.sleep(0.005)
+    raise TimeoutError(f"no {kind} event within {timeout_s}s")
+
+
+async def scenario(label: str, cancel_after: str, clients: int, bound_s: float) -> bool:
+    """Start a run, let `clients` requests join it, and leave once cancel_after happens."""
+    with _events_lock:
+        EVENTS.clear()
+    key = ("stress", label)
+    run_inputs = inputs()
+    loop = asyncio.get_running_loop()
+    runs = [api._generate_runs.join_or_start(key, api._start_run(key, run_inputs, loop))[0] for _ in range(clients)]
+    await wait_for_event(cancel_after)
+
+    ok = True
+    if clients > 1:
+        # One client leaving must not stop a run others still follow
+        api._generate_runs.leave(runs.pop())
+        left_at = time.perf_counter()
+        await asyncio.sleep(bound_s * 2)
+        with _events_lock:
+            still_running = any(t > left_at + bound_s for t, _ in EVENTS)
+        ok &= still_running
+        print(f"  first of {clients} clients left: run {'kept going' if still_running else 'STOPPED'}")
+
+    for run in runs:
+        api._generate_runs.leave(run)
+    cancelled_at = time.perf_counter()
+    await asyncio.sleep(max(1.0, bound_s * 5))
+
+    with _events_lock:
+        after = [(t - cancelled_at, k) for t, k in EVENTS if t > cancelled_at]
+    late = [(dt, k) for dt, k in after if dt > bound_s]
+    new_requests = [k for dt, k in after if k.endswith("_request")]
+    stop_ms = max((dt for dt, _ in after), default=0.0) * 1000
+    passed = not late and not new_requests
+    ok &= passed
+    print(f"  last client left: {len(after)} chunk(s) after cancel, last at {stop_ms:.1f} ms, "
+          f"{len(new_requests)} new request(s) -> {'ok' if passed else 'FAIL'}")
+    return ok
+
+
+class FakeRequest:
+    """The bits of starlette's Request that _stream_run uses."""
+
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self) -> bool:
+        return self.disconnected
+
+
+async def sse_scenario(bound_s: float) -> bool:
+    """Follow a run through _stream_run and drop the client mid-run."""
+    with _events_lock:
+        EVENTS.clear()
+    request = FakeRequest()
+    received = []
+
+    async def client():
+        async for chunk in api._stream_run(("stress", "sse"), inputs(), request):
+            received.append(chunk)
+
+    task = asyncio.create_task(client())
+    await wait_for_event("llm_chunk")
+    request.disconnected = True
+    disconnected_at = time.perf_counter()
+    await asyncio.wait_for(task, timeout=30)
+    closed_ms = (time.perf_counter() - disconnected_at) * 1000
+    await asyncio.sleep(max(1.0, bound_s * 5))
+
+    limit_s = api.SSE_DISCONNECT_POLL_SECONDS + bound_s
+    with _events_lock:
+        after = [(t - disconnected_at, k) for t, k in EVENTS if t > disconnected_at]
+    late = [(dt, k) for dt, k in after if dt > limit_s]
+    new_requests = [k for dt, k in after if k.endswith("_request")]
+    stop_ms = max((dt for dt, _ in after), default=0.0) * 1000
+    passed = not late and not new_requests and closed_ms <= limit_s * 1000
+    print(f"  stream closed {closed_ms:.1f} ms after disconnect, last chunk at {stop_ms:.1f} ms "
+          f"(limit {limit_s * 1000:.0f} ms), {len(new_requests)} new request(s) -> {'ok' if passed else 'FAIL'}")
+    return passed
+
+
+async def run_all(bound_ms: float) -> bool:
+    bound_s = bound_ms / 1000
+    ok = True
+    print("cancel while workers stream sections")
+    ok &= await scenario("workers", "llm_chunk", 1, bound_s)
+
+    print("cancel while an image downloads")
+    SETTINGS["llm_chunks"] = 3  # workers finish quickly so the image stage starts
+    ok &= await scenario("images", "image_chunk", 1, bound_s)
+
+    print("two clients on one run")
+    SETTINGS["llm_chunks"] = 400
+    ok &= await scenario("shared", "llm_chunk", 2, bound_s)
+
+    print("SSE client disconnects")
+    ok &= await sse_scenario(bound_s)
+    return ok
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bound-ms", type=float, default=200)
+    parser.add_argument("--chunk-ms", type=float, default=5)
+    args = parser.parse_args()
+    SETTINGS["chunk_s"] = args.chunk_ms / 1000
+
+    print(f"provider chunks every {args.chunk_ms:.0f} ms; nothing may happen {args.bound_ms:.0f} ms after cancel\n")
+    ok = asyncio.run(run_all(args.bound_ms))
+    print(f"\n{'all scenarios passed' if ok else 'FAILED'}")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,220 @@
+"""
+Stress test: cross-process coordination (COORDINATION=sqlite).
+
+Runs several worker processes against one fresh coordination database and
+checks the invariants the API relies on:
+
+- token bucket: across all processes, no window of grants exceeds the burst
+  plus the refill over that window
+- shared cache: every hit returns exactly the value written for its key
+- in-flight registry: at most one live owner per key at any time, followers
+  receive the owner's result, and a claim whose owner dies without releasing
+  it is taken over once its lease expires
+
+Usage (from backend/):
+    python benchmarks/stress_coordination.py [--processes 8] [--seconds 5] [--rpm 600]
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import queue
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+LEASE_S = 1.0
+
+
+def _setup(path: str, rpm: float, burst: float):
+    # Set before coordination is imported (it reads its settings at import)
+    os.environ.update({
+        "COORDINATION": "sqlite",
+        "COORDINATION_PATH": path,
+        "RATE_LIMIT_GROQ_RPM": str(rpm),
+        "RATE_LIMIT_BURST": str(burst),
+        "INFLIGHT_LEASE_S": str(LEASE_S),
+        "INFLIGHT_POLL_S": "0.02",
+    })
+    import coordination
+    import metrics
+    return coordination, metrics
+
+
+def _lock_wait(metrics):
+    return metrics.snapshot()["timings"].get("coordination.lock_wait_ms", {})
+
+
+def bucket_worker(path, rpm, burst, seconds, out):
+    coordination, metrics = _setup(path, rpm, burst)
+    grants = []
+    end = time.time() + seconds
+    while time.time() < end:
+        coordination.acquire("groq:stress")
+        grants.append(time.time())
+    out.put(("bucket", grants, _lock_wait(metrics)))
+
+
+def cache_worker(path, rpm, burst, seconds, out):
+    coordination, metrics = _setup(path, rpm, burst)
+    ops = hits = bad = 0
+    end = time.time() + seconds
+    while time.time() < end:
+        key = str(random.randrange(200))
+        value = {"key": key, "payload": [key] * 20}
+        if random.random() < 0.3:
+            coordination.cache_set("stress", key, value, ttl_s=60)
+        else:
+            got = coordination.cache_get("stress", key)
+            if got is not None:
+                hits += 1
+                bad += got != value
+        ops += 1
+    out.put(("cache", (ops, hits, bad), _lock_wait(metrics)))
+
+
+def inflight_worker(path, rpm, burst, seconds, out, crash):
+    coordination, metrics = _setup(path, rpm, burst)
+    holds, follows, empty = [], 0, 0
+    end = time.time() + seconds
+    pid = os.getpid()
+    while time.time() < end:
+        key = f"run-{random.randrange(4)}"
+        owner = f"{pid}-{random.getrandbits(32):08x}"
+        lease, holder = coordination.claim(key, owner)
+        if lease is None:
+            result = coordination.wait_for(key, holder)
+            if result is None:
+                empty += 1
+            elif result.get("owner") != holder:
+                out.put(("error", f"follower of {holder} got a result from {result.get('owner')}", None))
+            follows += 1
+            continue
+        start = time.time()
+        if crash and random.random() < 0.05:
+            # Die holding the claim: another process must take over after the lease expires
+            out.put(("crash", (key, start), None))
+            out.close()
+            out.join_thread()  # flush the report; os._exit skips the queue's feeder thread
+            os._exit(0)
+        time.sleep(random.uniform(0.01, 0.05))
+        holds.append((key, start, time.time()))
+        lease.release({"owner": owner} if random.random() < 0.9 else None)
+    out.put(("inflight", (holds, follows, empty), _lock_wait(metrics)))
+
+
+def check_bucket(grants, rate, burst):
+    grants.sort()
+    worst = 0.0
+    for i in range(len(grants)):
+        for j in range(i, len(grants)):
+            allowed = burst + (grants[j] - grants[i]) * rate
+            worst = max(worst, (j - i + 1) - allowed)
+    # One token of slack for clock reads taken after the transaction commits
+    return worst <= 1.0, worst
+
+
+def check_holds(holds):
+    by_key = {}
+    for key, start, end in holds:
+        by_key.setdefault(key, []).append((start, end))
+    overlaps = 0
+    for spans in by_key.values():
+        spans.sort()
+        for (_, end_a), (start_b, _) in zip(spans, spans[1:]):
+            overlaps += start_b < end_a
+    return overlaps
+
+
+def run_phase(target, args, processes, crash_one=False):
+    out = mp.Queue()
+    procs = []
+    for i in range(processes):
+        extra = (crash_one and i == 0,) if target is inflight_worker else ()
+        p = mp.Process(target=target, args=(*args, out, *extra))
+        p.start()
+        procs.append(p)
+    # Every process sends exactly one report ("error" items come on top)
+    results = []
+    reported = 0
+    deadline = time.time() + args[-1] + 30
+    while reported < processes and time.time() < deadline:
+        try:
+            item = out.get(timeout=1)
+        except queue.Empty:
+            continue
+        results.append(item)
+        reported += item[0] != "error"
+    for p in procs:
+        p.join(timeout=5)
+    return results
+
+
+def pct(timing):
+    return f"avg {timing.get('avg_ms', 0):.2f} ms, max {timing.get('max_ms', 0):.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--rpm", type=float, default=600)
+    parser.add_argument("--burst", type=float, default=5)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "coordination.sqlite3")
+    common = (path, args.rpm, args.burst, args.seconds)
+    failed = False
+
+    print(f"{args.processes} processes, {args.seconds:.0f}s per phase, database {path}\n")
+
+    results = run_phase(bucket_worker, common, args.processes)
+    grants = [t for kind, g, _ in results if kind == "bucket" for t in g]
+    ok, excess = check_bucket(grants, args.rpm / 60, args.burst)
+    allowed = args.burst + args.rpm / 60 * (max(grants) - min(grants))
+    failed |= not ok
+    print(f"token bucket   {len(grants)} grants (limit {allowed:.0f}), worst window excess {excess:.2f} "
+          f"-> {'ok' if ok else 'FAIL'}")
+    print(f"               lock wait per transaction: {pct(results[0][2])}")
+
+    results = run_phase(cache_worker, common, args.processes)
+    ops = sum(r[1][0] for r in results)
+    hits = sum(r[1][1] for r in results)
+    bad = sum(r[1][2] for r in results)
+    failed |= bad > 0 or len(results) != args.processes
+    print(f"shared cache   {ops / args.seconds:,.0f} ops/s, {hits} hits, {bad} wrong values "
+          f"-> {'ok' if not bad else 'FAIL'}")
+    print(f"               lock wait per transaction: {pct(results[0][2])}")
+
+    results = run_phase(inflight_worker, common, args.processes, crash_one=True)
+    errors = [r[1] for r in results if r[0] == "error"]
+    crashes = [r[1] for r in results if r[0] == "crash"]
+    reports = [r[1] for r in results if r[0] == "inflight"]
+    holds = [h for r in reports for h in r[0]]
+    follows = sum(r[1] for r in reports)
+    empty = sum(r[2] for r in reports)
+    overlaps = check_holds(holds)
+    # A crashed claim blocks its key until the lease expires, and only until then
+    taken_over = all(
+        any(key == k and start > crashed_at for k, start, _ in holds) for key, crashed_at in crashes
+    )
+    early = sum(
+        1 for key, crashed_at in crashes for k, start, _ in holds
+        if key == k and crashed_at < start < crashed_at + LEASE_S * 0.9
+    )
+    ok = not overlaps and not errors and taken_over and not early
+    failed |= not ok
+    print(f"in-flight      {len(holds)} runs owned, {follows} followed ({empty} without a result), "
+          f"{overlaps} overlapping owners, {len(crashes)} owner crash(es) "
+          f"{'taken over' if taken_over and not early else 'NOT taken over correctly'} -> {'ok' if ok else 'FAIL'}")
+    for e in errors[:5]:
+        print(f"               {e}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Run Cancellation
+
+Cooperative cancellation for graph runs. The API cancels a run_id when its
+last SSE client disconnects; graph nodes call check() before every outbound
+call (LLM, search, image provider, storage upload) and while streaming
+responses, so a cancelled run stops spending within one chunk / call.
+
+Code that is not handed a run_id (the rate limiter inside a LangChain client)
+checks the run bound to the current context with bind().
+"""
+
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+import metrics
+
+
+class RunCancelled(Exception):
+    """Raised inside a graph run once its run_id has been cancelled."""
+
+
+_lock = threading.Lock()
+_cancelled: Dict[str, float] = {}  # run_id -> monotonic time of cancellation
+_TTL_SECONDS = 3600
+_current_run: ContextVar[Optional[str]] = ContextVar("current_run", default=None)
+
+
+def cancel(run_id: Optional[str]) -> None:
+    """Mark a run as cancelled."""
+    if not run_id:
+        return
+    now = time.monotonic()
+    with _lock:
+        for rid, at in list(_cancelled.items()):
+            if now - at > _TTL_SECONDS:
+                del _cancelled[rid]
+        _cancelled.setdefault(run_id, now)
+    metrics.incr("cancellation.runs_cancelled")
+
+
+def is_cancelled(run_id: Optional[str]) -> bool:
+    if not run_id:
+        return False
+    with _lock:
+        return run_id in _cancelled
+
+
+def check(run_id: Optional[str]) -> None:
+    """Raise RunCancelled if the run has been cancelled."""
+    if is_cancelled(run_id):
+        with _lock:
+            at = _cancelled.get(run_id)
+        if at is not None:
+            # Time from disconnect to the run noticing it
+            metrics.observe_ms("cancellation.stop_latency_ms", (time.monotonic() - at) * 1000)
+        raise RunCancelled(f"Run {run_id} was cancelled")
+
+
+def release(run_id: Optional[str]) -> None:
+    """Forget a finished run."""
+    if not run_id:
+        return
+    with _lock:
+        _cancelled.pop(run_id, None)
+
+
+def bind(run_id: Optional[str]) -> None:
+    """Make run_id the current context's run (each graph node runs in its own context)."""
+    _current_run.set(run_id)
+
+
+def current_run() -> Optional[str]:
+    return _current_run.get()
@@ -0,0 +1,400 @@
+"""
+Cross-Process Coordination
+
+With several uvicorn/gunicorn workers every process has its own rate-limit
+view, caches and single-flight registry. With COORDINATION=sqlite they share
+one SQLite database in WAL mode on the local disk (no broker):
+
+- Token buckets: one per provider (per model for Groq), refilled at the
+  provider's requests-per-minute limit. Every write runs in a BEGIN IMMEDIATE
+  transaction, so the read-refill-take sequence is atomic across processes.
+- Result cache: JSON values with an optional TTL (search results, pre-router
+  decisions, finished runs for followers in other processes).
+- In-flight registry: a lease per run key. The owning process renews it in
+  the background; a process that finds the key taken follows the owner's run
+  and receives its result from the cache, or takes over once the lease
+  expires (owner crashed or was killed).
+
+With COORDINATION=off (the default) every call is a no-op: no rate limiting,
+no shared cache hits and every claim succeeds, as with a single worker.
+
+File locks are the exception: files every worker rewrites (topic index,
+search journal and segment) are always updated under file_lock, whatever
+COORDINATION is set to.
+"""
+
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from langchain_core.rate_limiters import BaseRateLimiter
+
+try:
+    import fcntl
+except ImportError:  # Windows: file locks are no-ops (single-process development)
+    fcntl = None
+
+import cancellation
+import metrics
+
+# off: each process coordinates only with itself | sqlite: share state through COORDINATION_PATH
+COORDINATION = os.getenv("COORDINATION", "off").lower()
+COORDINATION_PATH = os.getenv("COORDINATION_PATH", ".coordination.sqlite3")
+# Requests per minute across all processes (0 = unlimited); Groq limits apply per model
+RATE_LIMITS_RPM: Dict[str, float] = {
+    "groq": float(os.getenv("RATE_LIMIT_GROQ_RPM", "30")),
+    "tavily": float(os.getenv("RATE_LIMIT_TAVILY_RPM", "100")),
+    "huggingface": float(os.getenv("RATE_LIMIT_HUGGINGFACE_RPM", "0")),
+    "pollinations": float(os.getenv("RATE_LIMIT_POLLINATIONS_RPM", "0")),
+    "nvidia": float(os.getenv("RATE_LIMIT_NVIDIA_RPM", "40")),
+}
+# Requests a bucket can serve at once after being idle
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "5"))
+# A claim expires when its owner stops renewing it for this long
+INFLIGHT_LEASE_S = float(os.getenv("INFLIGHT_LEASE_S", "30"))
+INFLIGHT_POLL_S = float(os.getenv("INFLIGHT_POLL_S", "0.5"))
+# How long a finished run's result stays available to followers
+RESULT_TTL_S = int(os.getenv("INFLIGHT_RESULT_TTL_S", "300"))
+
+_BUSY_TIMEOUT_S = 10.0
+_MAX_WAIT_STEP_S = 1.0  # waiters re-check cancellation at least this often
+_PURGE_PROBABILITY = 0.01
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires REAL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE TABLE IF NOT EXISTS inflight (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    started REAL NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+_local = threading.local()
+
+
+def enabled() -> bool:
+    return COORDINATION == "sqlite"
+
+
+def _connect() -> sqlite3.Connection:
+    """This thread's connection (a forked child opens its own)."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+    conn = sqlite3.connect(COORDINATION_PATH, timeout=_BUSY_TIMEOUT_S, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+
+@contextmanager
+def _transaction():
+    """Write transaction holding the database write lock from the first statement."""
+    conn = _connect()
+    start = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    metrics.observe_ms("coordination.lock_wait_ms", (time.perf_counter() - start) * 1000)
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+@contextmanager
+def file_lock(path: str, shared: bool = False):
+    """
+    Advisory lock on `path` + ".lock", held across processes on this host.
+
+    Args:
+        path: File the lock protects
+        shared: Take a shared (read) lock instead of an exclusive one
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(f"{path}.lock", "a") as f:
+        start = time.perf_counter()
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        metrics.observe_ms("coordination.file_lock_wait_ms", (time.perf_counter() - start) * 1000)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# -----------------------------
+# Token buckets
+# -----------------------------
+def _rate_limit(bucket: str) -> float:
+    return RATE_LIMITS_RPM.get(bucket.split(":", 1)[0], 0.0)
+
+
+def _take(bucket: str, cost: float, rate: float, capacity: float) -> float:
+    """Take cost tokens if available; otherwise return the seconds until they will be."""
+    with _transaction() as conn:
+        row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (bucket,)).fetchone()
+        now = time.time()
+        tokens = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+        conn.execute(
+            "INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)", (bucket, tokens, now)
+        )
+    return wait
+
+
+def acquire(bucket: str, run_id: Optional[str] = None, cost: float = 1, blocking: bool = True) -> bool:
+    """
+    Take a request slot from a provider's shared token bucket, waiting if needed.
+
+    Args:
+        bucket: Provider name, optionally qualified (e.g. 'groq:llama-3.1-8b-instant')
+        run_id: Run to check for cancellation while waiting
+        cost: Tokens to take
+        blocking: Return False instead of waiting when no slot is free
+
+    Returns:
+        True once the slot is taken
+    """
+    rpm = _rate_limit(bucket)
+    if not enabled() or rpm <= 0:
+        return True
+    rate = rpm / 60
+    capacity = max(RATE_LIMIT_BURST, cost)
+    provider = bucket.split(":", 1)[0]
+    waited = 0.0
+    while True:
+        wait = _take(bucket, cost, rate, capacity)
+        if wait == 0:
+            break
+        if not blocking:
+            metrics.incr(f"ratelimit.{provider}.rejected")
+            return False
+        cancellation.check(run_id)
+        # Jitter keeps waiters in different processes from retrying in lockstep
+        step = min(wait, _MAX_WAIT_STEP_S) * random.uniform(1.0, 1.2)
+        time.sleep(step)
+        waited += step
+    metrics.incr(f"ratelimit.{provider}.acquired")
+    if waited:
+        metrics.incr(f"ratelimit.{provider}.waits")
+        metrics.observe_ms(f"ratelimit.{provider}.wait_ms", waited * 1000)
+    return True
+
+
+class RateLimiter(BaseRateLimiter):
+    """
+    Chat model rate limiter backed by a shared token bucket.
+
+    Clients are shared between runs, so the run to check for cancellation
+    while waiting is the one bound to the calling context (cancellation.bind).
+    """
+
+    def __init__(self, bucket: str):
+        self.bucket = bucket
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        return acquire(self.bucket, cancellation.current_run(), blocking=blocking)
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        # to_thread copies the context, so the bound run is still visible there
+        return await asyncio.to_thread(acquire, self.bucket, cancellation.current_run(), 1, blocking)
+
+
+# -----------------------------
+# Shared cache
+# -----------------------------
+def cache_get(namespace: str, key: str) -> Optional[Any]:
+    """A cached value, or None when missing, expired or coordination is off."""
+    if not enabled():
+        return None
+    row = _connect().execute(
+        "SELECT value, expires FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+    ).fetchone()
+    if row is None or (row[1] is not None and row[1] < time.time()):
+        metrics.incr(f"cache.{namespace}.misses")
+        return None
+    metrics.incr(f"cache.{namespace}.hits")
+    return json.loads(row[0])
+
+
+def cache_set(namespace: str, key: str, value: Any, ttl_s: Optional[float] = None) -> None:
+    """
+    Store a JSON-serializable value for every process.
+
+    Args:
+        namespace: Cache name (e.g. 'search')
+        key: Entry key within the namespace
+        value: Value to store
+        ttl_s: Seconds until the entry expires (None = never)
+    """
+    if not enabled():
+        return
+    now = time.time()
+    with _transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value), now + ttl_s if ttl_s is not None else None),
+        )
+        if random.random() < _PURGE_PROBABILITY:
+            conn.execute("DELETE FROM cache WHERE expires IS NOT NULL AND expires < ?", (now,))
+
+
+# -----------------------------
+# In-flight registry
+# -----------------------------
+class Lease:
+    """A run key claimed by this process; renewed in the background until released."""
+
+    def __init__(self, key: str, owner: str, on_lost: Optional[Callable[[], None]] = None):
+        self.key = key
+        self.owner = owner
+        self.lost = False  # the lease expired and another process took the key
+        self._on_lost = on_lost
+        self._released = threading.Event()
+        if enabled():
+            threading.Thread(target=self._renew, name="lease-renew", daemon=True).start()
+
+    def _renew(self) -> None:
+        interval = INFLIGHT_LEASE_S / 3
+        delay = interval
+        while not self._released.wait(delay):
+            try:
+                with _transaction() as conn:
+                    renewed = conn.execute(
+                        "UPDATE inflight SET expires = ? WHERE key = ? AND owner = ?",
+                        (time.time() + INFLIGHT_LEASE_S, self.key, self.owner),
+                    ).rowcount
+            except sqlite3.Error as e:
+                # e.g. "database is locked" past the busy timeout: retry soon, the
+                # lease is still ours until it expires
+                metrics.incr("coordination.renew_errors")
+                print(f"⚠️ Could not renew lease on {self.key}: {e}")
+                delay = min(interval, _MAX_WAIT_STEP_S)
+                continue
+            delay = interval
+            if not renewed:
+                self.lost = True
+                metrics.incr("coordination.leases_lost")
+                if self._on_lost is not None:
+                    self._on_lost()
+                return
+
+    def release(self, result: Optional[dict] = None) -> None:
+        """
+        Give up the claim, publishing the run's result to followers.
+
+        Args:
+            result: Terminal event of the run; None when it failed or was cancelled,
+                in which case a follower starts the run itself
+        """
+        self._released.set()
+        if not enabled():
+            return
+        if result is not None:
+            cache_set("runs", f"{self.key}|{self.owner}", result, RESULT_TTL_S)
+        with _transaction() as conn:
+            conn.execute("DELETE FROM inflight WHERE key = ? AND owner = ?", (self.key, self.owner))
+
+
+def claim(
+    key: str, owner: str, on_lost: Optional[Callable[[], None]] = None
+) -> Tuple[Optional[Lease], Optional[str]]:
+    """
+    Claim a run key for this process unless a live claim from another owner exists.
+
+    Args:
+        key: Run key shared by identical requests
+        owner: Id of the claiming run
+        on_lost: Called (from the renewal thread) if the lease expires and another
+            process takes the key, so the owner can stop its now-duplicate work
+
+    Returns:
+        (lease, None) when claimed, (None, current_owner) otherwise
+    """
+    if not enabled():
+        return Lease(key, owner, on_lost), None
+    now = time.time()
+    with _transaction() as conn:
+        row = conn.execute("SELECT owner, expires FROM inflight WHERE key = ?", (key,)).fetchone()
+        if row is not None and row[0] != owner and row[1] >= now:
+            return None, row[0]
+        if row is not None and row[0] != owner:
+            metrics.incr("coordination.takeovers")  # previous owner stopped renewing
+        conn.execute(
+            "INSERT OR REPLACE INTO inflight (key, owner, pid, started, expires) VALUES (?, ?, ?, ?, ?)",
+            (key, owner, os.getpid(), now, now + INFLIGHT_LEASE_S),
+        )
+    metrics.incr("coordination.claims")
+    return Lease(key, owner, on_lost), None
+
+
+def wait_for(key: str, owner: str, run_id: Optional[str] = None) -> Optional[dict]:
+    """
+    Follow another process's claim until it is released or expires.
+
+    Args:
+        key: Claimed run key
+        owner: Owner returned by claim()
+        run_id: The follower's run, checked for cancellation while polling
+
+    Returns:
+        The owner's published result, or None when it finished without one or
+        stopped renewing its lease (the caller should claim the key again)
+    """
+    metrics.incr("coordination.follows")
+    conn = _connect()
+    while True:
+        cancellation.check(run_id)
+        row = conn.execute("SELECT owner, expires FROM inflight WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] != owner:
+            return cache_get("runs", f"{key}|{owner}")
+        if row[1] < time.time():
+            return None
+        time.sleep(INFLIGHT_POLL_S)
+
+
+def stats() -> Dict[str, Any]:
+    if not enabled():
+        return {"mode": COORDINATION}
+    conn = _connect()
+    now = time.time()
+    return {
+        "mode": COORDINATION,
+        "path": COORDINATION_PATH,
+        "in_flight": conn.execute("SELECT COUNT(*) FROM inflight WHERE expires >= ?", (now,)).fetchone()[0],
+        "cache_entries": conn.execute(
+            "SELECT COUNT(*) FROM cache WHERE expires IS NULL OR expires >= ?", (now,)
+        ).fetchone()[0],
+        "buckets": {
+            name: round(tokens, 2)
+            for name, tokens in conn.execute("SELECT name, tokens FROM buckets").fetchall()
+        },
+    }
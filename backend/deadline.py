@@ -0,0 +1,114 @@
+"""
+Run Deadlines
+
+An optional per-request deadline (GenerateRequest.deadline_ms) travels with the
+run budget as an absolute `deadline_at`. Nodes ask how much time is left and
+degrade instead of overrunning: research trims its queries, workers write
+shorter sections, and the image stages skip planning or fall back to captions.
+
+Stage durations are estimated from moving averages of observed timings, seeded
+with conservative defaults, so the cuts track how fast providers actually are.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import metrics
+
+# Per-unit stage estimates (ms) used until timings are observed
+DEFAULT_ESTIMATES_MS: Dict[str, float] = {
+    "search": 1500,  # one Tavily query
+    "evidence": 2500,  # evidence-pack LLM call
+    "word": 6,  # one word of section output
+    "image_plan": 1000,  # decide_images LLM call
+    "image": 10000,  # generate + optimize + upload one image
+    "finalize": 1500,  # render + upload the markdown
+}
+
+# Share of the remaining time research may spend
+RESEARCH_SHARE = float(os.getenv("DEADLINE_RESEARCH_SHARE", "0.25"))
+MIN_SECTION_WORDS = int(os.getenv("DEADLINE_MIN_SECTION_WORDS", "120"))
+
+_EWMA_ALPHA = 0.2
+_lock = threading.Lock()
+_estimates: Dict[str, float] = {}
+
+
+def budget_fields(deadline_ms: Optional[int]) -> dict:
+    """Budget entries for a request deadline (empty when there is none)."""
+    if not deadline_ms:
+        return {}
+    return {"deadline_ms": deadline_ms, "deadline_at": time.time() + deadline_ms / 1000}
+
+
+def remaining_ms(budget: Optional[dict]) -> Optional[float]:
+    """Milliseconds left before the deadline (negative once passed), or None."""
+    deadline_at = (budget or {}).get("deadline_at")
+    if deadline_at is None:
+        return None
+    return (deadline_at - time.time()) * 1000
+
+
+def observe(kind: str, ms: float) -> None:
+    """Fold one observed per-unit duration into the estimate for kind."""
+    with _lock:
+        current = _estimates.get(kind)
+        _estimates[kind] = ms if current is None else current + _EWMA_ALPHA * (ms - current)
+
+
+def estimate(kind: str) -> float:
+    with _lock:
+        return _estimates.get(kind, DEFAULT_ESTIMATES_MS[kind])
+
+
+def _degraded(kind: str) -> None:
+    metrics.incr(f"deadline.degraded.{kind}")
+
+
+def research_queries(budget: Optional[dict], planned: int) -> int:
+    """How many of the planned search queries fit in research's share of the time left."""
+    left = remaining_ms(budget)
+    if left is None or planned <= 1:
+        return planned
+    allowed = (left * RESEARCH_SHARE - estimate("evidence")) / estimate("search")
+    fit = max(1, min(planned, int(allowed)))
+    if fit < planned:
+        _degraded("research_queries")
+    return fit
+
+
+def section_words(budget: Optional[dict], target: int) -> int:
+    """Target words for a section so the writers finish with time left for the reducer."""
+    left = remaining_ms(budget)
+    if left is None:
+        return target
+    allowed = left - estimate("image_plan") - estimate("finalize")
+    words = max(MIN_SECTION_WORDS, int(allowed / estimate("word")))
+    if words < target:
+        _degraded("section_words")
+        return words
+    return target
+
+
+def can_plan_images(budget: Optional[dict]) -> bool:
+    """False when not even one image would fit, so the planning call is pointless."""
+    left = remaining_ms(budget)
+    if left is None:
+        return True
+    ok = left - estimate("image_plan") - estimate("finalize") >= estimate("image")
+    if not ok:
+        _degraded("image_planning")
+    return ok
+
+
+def images_that_fit(budget: Optional[dict], planned: int) -> int:
+    """How many of the planned images can be generated before the deadline."""
+    left = remaining_ms(budget)
+    if left is None:
+        return planned
+    fit = max(0, min(planned, int((left - estimate("finalize")) / estimate("image"))))
+    if fit < planned:
+        _degraded("images")
+    return fit
@@ -0,0 +1,195 @@
+"""
+Image Optimization
+
+Image providers return full-size PNG/JPEG bytes (Pollinations 1024x768, NVIDIA
+base64-decoded PNG), which used to be uploaded as-is. This module decodes each
+image once and encodes web-friendly variants: every configured format (WebP by
+default, AVIF when Pillow supports it) at a few widths. No thumbnail is
+encoded: nothing renders one, and every extra variant is another upload.
+
+Encoding is CPU-bound, so it runs in a process pool and never holds the GIL of
+the API process. A worker that dies or hangs takes the pool down with it, so
+optimize() replaces the pool and retries once. Pillow is optional: without it,
+optimize() returns no variants and callers upload the original bytes.
+"""
+
+import io
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+
+try:
+    from PIL import Image, features
+except ImportError:  # optional dependency
+    Image = None
+    features = None
+
+IMAGE_OPTIMIZATION = os.getenv("IMAGE_OPTIMIZATION", "true").lower() == "true"
+# First format is the one referenced from markdown; the rest are uploaded alongside
+IMAGE_FORMATS = [f.strip().lower() for f in os.getenv("IMAGE_FORMATS", "webp").split(",") if f.strip()]
+IMAGE_WIDTHS = sorted(int(w) for w in os.getenv("IMAGE_WIDTHS", "480,768,1024").split(",") if w.strip())
+IMAGE_DISPLAY_WIDTH = int(os.getenv("IMAGE_DISPLAY_WIDTH", "768"))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "80"))
+IMAGE_OPTIMIZER_WORKERS = int(os.getenv("IMAGE_OPTIMIZER_WORKERS", "2"))
+
+CONTENT_TYPES = {"webp": "image/webp", "avif": "image/avif", "jpeg": "image/jpeg", "png": "image/png"}
+_PIL_FORMATS = {"webp": "WEBP", "avif": "AVIF", "jpeg": "JPEG", "png": "PNG"}
+_FEATURES = {"webp": "webp", "avif": "avif"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+@dataclass
+class Variant:
+    """One encoded rendition of a source image."""
+
+    label: str  # "w480", "w768", ...
+    format: str  # "webp", "avif", ...
+    width: int
+    height: int
+    data: bytes
+
+    @property
+    def content_type(self) -> str:
+        return CONTENT_TYPES[self.format]
+
+    def filename(self, source_filename: str) -> str:
+        """Storage filename next to the source, e.g. image_1.png -> image_1-w768.webp."""
+        stem = os.path.splitext(source_filename)[0]
+        return f"{stem}-{self.label}.{self.format}"
+
+
+# "thumb" still matches so the GC groups thumbnails uploaded by older builds
+_VARIANT_RE = re.compile(r"^(.*)-(?:w\d+|thumb)\.[a-z0-9]+$")
+
+
+def source_stem(path: str) -> str:
+    """The source image a stored file belongs to: 'x/image_1-w768.webp' and 'x/image_1.png' -> 'x/image_1'."""
+    match = _VARIANT_RE.match(path)
+    return match.group(1) if match else os.path.splitext(path)[0]
+
+
+def supported_formats() -> List[str]:
+    """Configured formats this Pillow build can encode, in configured order."""
+    if Image is None:
+        return []
+    return [
+        f for f in IMAGE_FORMATS
+        if f in _PIL_FORMATS and (f not in _FEATURES or features.check(_FEATURES[f]))
+    ]
+
+
+def _encode_variants(
+    img_bytes: bytes,
+    widths: List[int],
+    formats: List[str],
+    quality: int,
+) -> List[Tuple[str, str, int, int, bytes]]:
+    """Decode once and encode every (width, format) pair. Runs in a worker process."""
+    with Image.open(io.BytesIO(img_bytes)) as src:
+        src.load()
+        img = src.convert("RGBA" if "A" in src.getbands() else "RGB")
+
+    # Never upscale; the source width itself is the largest rendition
+    targets = [w for w in widths if w < img.width] + [img.width]
+    renditions = [(f"w{w}", w) for w in sorted(set(targets))]
+
+    out = []
+    for label, width in renditions:
+        height = max(1, round(img.height * width / img.width))
+        resized = img if width == img.width else img.resize((width, height), Image.LANCZOS)
+        for fmt in formats:
+            frame = resized
+            if fmt == "jpeg" and frame.mode != "RGB":
+                frame = frame.convert("RGB")
+            buf = io.BytesIO()
+            frame.save(buf, format=_PIL_FORMATS[fmt], quality=quality)
+            out.append((label, fmt, width, height, buf.getvalue()))
+    return out
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: the API process is multi-threaded, forking it is unsafe
+            _pool = ProcessPoolExecutor(
+                max_workers=IMAGE_OPTIMIZER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _reset_pool(broken: ProcessPoolExecutor) -> None:
+    """Drop a pool whose worker died or hung so the next submit starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    # A hung worker never frees its slot; kill the processes instead of waiting on them
+    for proc in list((getattr(broken, "_processes", None) or {}).values()):
+        proc.kill()
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def optimize(img_bytes: bytes, timeout: Optional[float] = 60) -> List[Variant]:
+    """
+    Encode responsive variants of an image in the process pool.
+
+    Args:
+        img_bytes: Original image bytes from the provider
+        timeout: Seconds to wait for the worker (per attempt)
+
+    Returns:
+        List of Variants (empty when Pillow is unavailable or optimization is off)
+
+    Raises:
+        BrokenProcessPool / TimeoutError: when the retry on a fresh pool fails too
+    """
+    formats = supported_formats()
+    if not IMAGE_OPTIMIZATION or not formats:
+        return []
+
+    with metrics.timed("images.optimize_ms"):
+        for attempt in (1, 2):
+            pool = _get_pool()
+            try:
+                encoded = pool.submit(
+                    _encode_variants, img_bytes, IMAGE_WIDTHS, formats, IMAGE_QUALITY
+                ).result(timeout=timeout)
+                break
+            except (BrokenProcessPool, FutureTimeout) as e:
+                _reset_pool(pool)
+                metrics.incr("images.pool_resets")
+                if attempt == 2:
+                    raise
+                reason = "timed out" if isinstance(e, FutureTimeout) else "broke"
+                print(f"  ⚠️  Image optimizer pool {reason}, retrying on a fresh pool")
+
+    variants = [Variant(*row) for row in encoded]
+    metrics.incr("images.optimized")
+    metrics.incr("images.bytes_in", len(img_bytes))
+    metrics.incr("images.bytes_out", sum(len(v.data) for v in variants))
+    return variants
+
+
+def pick(variants: List[Variant]) -> Dict[str, Variant]:
+    """
+    Choose the renditions markdown should reference.
+
+    Returns:
+        {"display": largest width <= IMAGE_DISPLAY_WIDTH, "full": largest width},
+        both in the primary format
+    """
+    primary = variants[0].format
+    sized = sorted((v for v in variants if v.format == primary), key=lambda v: v.width)
+    display = [v for v in sized if v.width <= IMAGE_DISPLAY_WIDTH] or sized[:1]
+    return {"display": display[-1], "full": sized[-1]}
@@ -1,27 +1,43 @@
-
 from __future__ import annotations
 
 import operator
 import os
 import re
-from datetime import date, timedelta
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 from pathlib import Path
-from typing import TypedDict, List, Optional, Literal, Annotated
+from typing import TypedDict, Dict, List, Optional, Literal, Annotated
 
 from pydantic import BaseModel, Field, ConfigDict
 
 from langgraph.graph import StateGraph, START, END
 from langgraph.types import Send
 
-from langchain_groq import ChatGroq
 from langchain_core.messages import SystemMessage, HumanMessage
 from dotenv import load_dotenv
 
 import requests
 import base64
+import json
 
 # Import Supabase storage helper
 import supabase_storage
+import cancellation
+import coordination
+import deadline
+import image_optimizer
+import metrics
+import model_registry
+import post_renderer
+import profiling
+import prerouter
+import section_packing
+import structured_repair
+import topic_index
+from markdown_sections import merge_sections, place_blocks, resolve_section, split_sections, substitute_placeholders
 
 load_dotenv()
 
@@ -92,7 +108,8 @@ class ImageSpec(BaseModel):
     alt: str = Field(..., max_length=50, description="Short alt text, max 50 chars")
     caption: str = Field(..., max_length=80, description="Short caption, max 80 chars")
     prompt: str = Field(..., max_length=200, description="Image generation prompt, max 200 chars")
-    
+    section_id: Optional[int] = Field(default=None, description="Id of the section the image belongs after (default: first section)")
+
 class GlobalImagePlan(BaseModel):
     """Image plan - Returns only image specs, not full markdown to avoid payload bloat"""
     model_config = ConfigDict(extra='forbid', strict=True)
@@ -100,9 +117,52 @@ class GlobalImagePlan(BaseModel):
     images: List[ImageSpec] = Field(default_factory=list, max_length=2, description="0-2 image specs")
 
 
+# --- Model-specific repairs for near-miss structured outputs (see structured_repair) ---
+def _repair_plan(data: dict) -> dict:
+    tasks = data.get("tasks")
+    if not isinstance(tasks, list):
+        return data
+    for i, task in enumerate(tasks, start=1):
+        if not isinstance(task, dict):
+            continue
+        # Workers and merge order rely on ids 1..n
+        task["id"] = i
+        bullets = task.get("bullets")
+        if isinstance(bullets, list) and 0 < len(bullets) < 3:
+            # Pad from compound bullets first, then from the goal/title
+            split = [p.strip() for b in bullets for p in str(b).split(";") if p.strip()]
+            for extra in (task.get("goal"), task.get("title")):
+                if extra and len(split) < 3:
+                    split.append(str(extra))
+            task["bullets"] = split[:3]
+    return data
+
+
+def _repair_image_plan(data: dict) -> dict:
+    images = data.get("images")
+    if not isinstance(images, list):
+        return data
+    for i, img in enumerate(images, start=1):
+        if not isinstance(img, dict):
+            continue
+        img["placeholder"] = f"[[IMAGE_{i}]]"
+        img.setdefault("filename", f"image_{i}.png")
+        if not img.get("alt") and img.get("caption"):
+            img["alt"] = str(img["caption"])[:50]
+        if not img.get("caption") and img.get("alt"):
+            img["caption"] = str(img["alt"])[:80]
+    return data
+
+
 # --- Define state ---
+def _add_new(left: List[str], right: List[str]) -> List[str]:
+    # The reducer subgraph returns its whole state, so skip entries already recorded
+    return left + [item for item in right if item not in left]
+
+
 class State(TypedDict):
     topic: str
+    run_id: str
 
     # Routing / Research
     mode: str
@@ -111,6 +171,13 @@ class State(TypedDict):
     evidence: List[EvidenceItem]
     plan: Optional[Plan]
     image_model: Optional[str]
+    budget: Optional[dict] # {"latency_ms", "cost_usd", "deadline_at"}: model tiers and deadline cuts
+
+    # Archive match (reuse / refresh of a similar published post)
+    matched_post: Optional[str] # filename of the archived post being reused or refreshed
+    existing_sections: Dict[int, str] # task_id -> published section_md (refresh)
+    prior_evidence_urls: List[str] # evidence the archived post was written from
+    prior_image_specs: List[dict] # images the reused sections already carry (regeneration)
 
     # Recency
     as_of: str
@@ -121,10 +188,12 @@ class State(TypedDict):
 
     # Reducer/Image
     merged_md:str
+    section_index: List[dict] # {task_id, title, start, end} offsets into merged_md
     md_with_placeholders: str
     image_specs: List[dict]
 
     final: str
+    degradations: Annotated[List[str], _add_new] # cuts made to meet the request deadline
 
 
 
@@ -132,7 +201,81 @@ class State(TypedDict):
 # -----------------------------
 # 2) LLM
 # -----------------------------
-llm = ChatGroq(model="llama-3.1-8b-instant")
+# Each node gets its model chain from the registry (fast tier for routing and image
+# planning, strong tier for planning and writing), narrowed by any request budget.
+def _llm(node: str, state: dict):
+    # The clients' shared rate limiter checks the run bound here while it waits
+    cancellation.bind(state.get("run_id"))
+    return model_registry.get_llm(node, state.get("budget"))
+
+# -----------------------------
+# 3a) Archive match
+#     Reworded topics often match a published post. Depending on TOPIC_MATCH_POLICY
+#     the post is returned as-is (reuse) or its plan is kept and only the sections
+#     new research affects are regenerated (refresh).
+# -----------------------------
+def match_node(state: State) -> dict:
+    run_id = state.get("run_id") or uuid.uuid4().hex
+    match = topic_index.find_match(state["topic"], state["as_of"])
+    if match is None or match.action == "report":
+        if match is not None:
+            print(f"🔁 Similar post exists: {match.entry['filename']} (similarity={match.similarity})")
+        return {"run_id": run_id}
+
+    filename = match.entry["filename"]
+    existing_md = supabase_storage.get_blog_post(filename)
+    if not existing_md:
+        topic_index.remove(filename)
+        return {"run_id": run_id}
+
+    plan = Plan(**match.entry["plan"])
+    if match.action == "reuse":
+        print(f"♻️  Reusing {filename} (similarity={match.similarity})")
+        return {"run_id": run_id, "matched_post": filename, "plan": plan, "final": existing_md}
+
+    # Refresh: sections map back to tasks in id order (merge_sections wrote them that way)
+    published = split_sections(existing_md)
+    tasks = sorted(plan.tasks, key=lambda t: t.id)
+    existing = {t.id: md for t, md in zip(tasks, published)} if len(published) == len(tasks) else {}
+    print(f"🔄 Refreshing {filename} (similarity={match.similarity}, {len(existing)} sections reusable)")
+    return {
+        "run_id": run_id,
+        "matched_post": filename,
+        "plan": plan,
+        "existing_sections": existing,
+        "prior_evidence_urls": match.entry.get("evidence_urls", []),
+    }
+
+
+def route_after_match(state: State) -> str:
+    return END if state.get("final") else "router"
+
+
+def _stale_task_ids(state: State) -> set:
+    """
+    Tasks a refresh must regenerate: those without a reusable section, and those
+    that depend on research and overlap evidence the archived post didn't have.
+    """
+    plan = state["plan"]
+    existing = state.get("existing_sections") or {}
+    prior = set(state.get("prior_evidence_urls") or [])
+    fresh_terms = [
+        _terms(f"{e.title} {e.snippet or ''}")
+        for e in state.get("evidence", []) or []
+        if e.url not in prior
+    ]
+    stale = set()
+    for task in plan.tasks:
+        if task.id not in existing:
+            stale.add(task.id)
+            continue
+        if not (task.requires_research or task.requires_citations or plan.blog_kind == "news_roundup"):
+            continue
+        task_terms = _terms(" ".join([task.title, task.goal, *task.bullets]))
+        if any(task_terms & terms for terms in fresh_terms):
+            stale.add(task.id)
+    return stale
+
 
 # -----------------------------
 # 3) Router
@@ -151,14 +294,35 @@ If needs_research=true:
 - For open_book weekly roundup, include queries reflecting last 7 days.
 """
 
+def _fast_route(state: State, guess: prerouter.Guess) -> Optional[RouterDecision]:
+    """Answer from the decision cache or confident local rules, if possible."""
+    cached = prerouter.cached_decision(state["topic"], state["as_of"])
+    if cached is not None:
+        metrics.incr("prerouter.cache_hits")
+        return RouterDecision(**cached)
+    if guess.confident and not prerouter.should_shadow():
+        metrics.incr("prerouter.rule_hits")
+        return RouterDecision(**prerouter.rule_decision(state["topic"], state["as_of"], guess))
+    return None
+
+
 def router_node(state: State) -> dict:
-    decider = llm.with_structured_output(RouterDecision)
-    decision = decider.invoke(
-        [
-            SystemMessage(content=ROUTER_SYSTEM),
-            HumanMessage(content=f"Topic: {state['topic']}\nAs-of Date:{state['as_of']}"),
-        ]
-    )
+    cancellation.check(state.get("run_id"))
+    guess = prerouter.classify(state["topic"])
+    decision = _fast_route(state, guess)
+
+    if decision is None:
+        metrics.incr("prerouter.llm_calls")
+        decision = structured_repair.invoke(
+            _llm("router_node", state),
+            RouterDecision,
+            [
+                SystemMessage(content=ROUTER_SYSTEM),
+                HumanMessage(content=f"Topic: {state['topic']}\nAs-of Date:{state['as_of']}"),
+            ]
+        )
+        prerouter.record_llm_decision(guess, decision.mode)
+        prerouter.store_decision(state["topic"], state["as_of"], decision.model_dump())
 
     if decision.mode == "open_book":
         recency_days = 7
@@ -168,14 +332,20 @@ def router_node(state: State) -> dict:
         recency_days = 3650
 
     return {
+        "run_id": state.get("run_id") or uuid.uuid4().hex,
         "needs_research": decision.needs_research,
         "mode": decision.mode,
         "queries": decision.queries,
         "recency_days": recency_days,
     }
 
-def route_next(state: State) -> str:
-    return "research" if state["needs_research"] else "orchestrator"
+def route_next(state: State):
+    if state["needs_research"]:
+        return "research"
+    # A refreshed post keeps its archived plan
+    if state.get("plan") is not None:
+        return "dispatch"
+    return "orchestrator"
 
 # -----------------------------
 # 4) Research (Tavily)
@@ -201,13 +371,22 @@ def route_next(state: State) -> str:
 #         return out
 #     except Exception:
 #         return []
-def _tavily_search(query: str, max_results: int = 3) -> List[dict]:
+# Search results are shared by every worker process for this long (COORDINATION=sqlite)
+SEARCH_CACHE_TTL_S = int(os.getenv("SEARCH_CACHE_TTL_S", "3600"))
+
+
+def _tavily_search(query: str, max_results: int = 3, run_id: Optional[str] = None) -> List[dict]:
     if not os.getenv("TAVILY_API_KEY"):
         return []
+    cache_key = f"{max_results}:{' '.join(query.lower().split())}"
+    cached = coordination.cache_get("search", cache_key)
+    if cached is not None:
+        return cached
     try:
         #  import - use TavilySearch
         from langchain_tavily import TavilySearch
         
+        coordination.acquire("tavily", run_id)
         tool = TavilySearch(max_results=max_results)
         results = tool.invoke({"query": query})
         
@@ -222,7 +401,11 @@ def _tavily_search(query: str, max_results: int = 3) -> List[dict]:
                     "source": r.get("source"),
                 }
             )
+        if out:
+            coordination.cache_set("search", cache_key, out, SEARCH_CACHE_TTL_S)
         return out
+    except cancellation.RunCancelled:
+        raise
     except Exception:
         return []
 
@@ -247,17 +430,23 @@ Rules:
 - Deduplicate by URL.
 """
 
-def research_node(state: State) -> dict:
+def _gather_evidence(state: State) -> List[EvidenceItem]:
     queries = (state.get("queries") or [])[:10]
     raw: List[dict] = []   
     for q in queries:
-        raw.extend(_tavily_search(q, max_results=5))
+        cancellation.check(state.get("run_id"))
+        start = time.perf_counter()
+        raw.extend(_tavily_search(q, max_results=5, run_id=state.get("run_id")))
+        deadline.observe("search", (time.perf_counter() - start) * 1000)
     
     if not raw:
-        return {"evidence":[]}
+        return []
 
-    extractor = llm.with_structured_output(EvidencePack)
-    pack = extractor.invoke(
+    cancellation.check(state.get("run_id"))
+    start = time.perf_counter()
+    pack = structured_repair.invoke(
+        _llm("research_node", state),
+        EvidencePack,
         [
             SystemMessage(content=RESEARCH_SYSTEM),
             HumanMessage(
@@ -269,6 +458,7 @@ def research_node(state: State) -> dict:
             ),
         ]
     )
+    deadline.observe("evidence", (time.perf_counter() - start) * 1000)
 
     dedup = {}
     for e in pack.evidence:
@@ -281,7 +471,56 @@ def research_node(state: State) -> dict:
         cutoff = as_of - timedelta(days=int(state["recency_days"]))
         evidence = [e for e in evidence if (d:= _iso_to_date(e.published_at)) and d >= cutoff]
 
-    return {"evidence": evidence}
+    return evidence
+
+
+def research_node(state: State) -> dict:
+    # Hybrid topics are mostly evergreen, so draft the plan from the topic alone
+    # while research runs and only re-plan if the evidence invalidates it
+    draft_future = None
+    if SPECULATIVE_PLANNING and state.get("mode") == "hybrid" and state.get("plan") is None:
+        draft_future = _SPECULATION_EXECUTOR.submit(_timed_draft_plan, state)
+
+    # Under a deadline, only run as many searches as research's share of the time allows
+    queries = (state.get("queries") or [])[:10]
+    kept = deadline.research_queries(state.get("budget"), len(queries))
+    degradations = [f"research: queries {len(queries)}->{kept}"] if kept < len(queries) else []
+
+    start = time.perf_counter()
+    try:
+        evidence = _gather_evidence({**state, "queries": queries[:kept]})
+    except BaseException:
+        # Don't leave the draft holding a speculation slot for a failed or cancelled run
+        if draft_future is not None:
+            draft_future.cancel()
+        raise
+    research_ms = (time.perf_counter() - start) * 1000
+
+    if draft_future is None:
+        return {"evidence": evidence, "degradations": degradations}
+
+    try:
+        draft, draft_ms = draft_future.result()
+    except cancellation.RunCancelled:
+        raise
+    except Exception as e:
+        # Research already succeeded; let route_after_research send this to the orchestrator
+        metrics.incr("speculative_plan.failed")
+        print(f"↩️  Speculative plan failed ({e}), planning with evidence")
+        return {"evidence": evidence, "degradations": degradations, "plan": None}
+    return {
+        "evidence": evidence,
+        "degradations": degradations,
+        **_reconcile_draft(draft, evidence, research_ms, draft_ms),
+    }
+
+
+def route_after_research(state: State):
+    # A speculative plan that survived reconciliation (or a refreshed post's archived
+    # plan) goes straight to the workers
+    if state.get("plan") is not None:
+        return "dispatch"
+    return "orchestrator"
 
 # -----------------------------
 # 5) Orchestrator (Plan)
@@ -301,14 +540,15 @@ Modes:
 """
 
 
-def orchestrator_node(state: State) -> dict:
-    planner = llm.with_structured_output(Plan)
+def _make_plan(state: State, evidence: List[EvidenceItem]) -> Plan:
+    cancellation.check(state.get("run_id"))
     mode = state.get("mode", "closed_book")
-    evidence = state.get("evidence", [])
 
     forced_kind = "news_roundup" if mode == "open_book" else None
 
-    plan = planner.invoke(
+    plan = structured_repair.invoke(
+        _llm("orchestrator_node", state),
+        Plan,
         [
             SystemMessage(content= ORCH_SYSTEM),
             HumanMessage(
@@ -320,34 +560,171 @@ def orchestrator_node(state: State) -> dict:
                     f"Evidence:\n{[e.model_dump() for e in evidence][:16]}"
                 )
             ),
-        ]
+        ],
+        post=_repair_plan,
     )
     if forced_kind:
         plan.blog_kind = "news_roundup"
+    return plan
 
-    return {"plan": plan}
+
+def orchestrator_node(state: State) -> dict:
+    return {"plan": _make_plan(state, state.get("evidence", []))}
 
 
 # -----------------------------
-# 6) Fanout (Condition of conditional EDGE)
+# 5b) Speculative planning (hybrid mode)
 # -----------------------------
+SPECULATIVE_PLANNING = os.getenv("SPECULATIVE_PLANNING", "false").lower() == "true"
+# Share of the dominant evidence terms the draft must already cover to be kept
+SPECULATIVE_PLAN_MIN_COVERAGE = float(os.getenv("SPECULATIVE_PLAN_MIN_COVERAGE", "0.2"))
+_SPECULATION_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculative-plan")
+
+_STOPWORDS = {
+    "about", "after", "also", "and", "are", "from", "have", "into", "more", "most",
+    "that", "than", "their", "there", "these", "this", "what", "when", "where",
+    "which", "while", "with", "will", "your", "for", "the", "how", "why", "new",
+}
+
+
+def _terms(text: str) -> set:
+    return {w for w in re.findall(r"[a-z0-9][a-z0-9.+-]{2,}", text.lower()) if w not in _STOPWORDS}
+
+
+def _timed_draft_plan(state: State) -> tuple:
+    start = time.perf_counter()
+    draft = _make_plan(state, [])
+    return draft, (time.perf_counter() - start) * 1000
+
+
+def _reconcile_draft(draft: Plan, evidence: List[EvidenceItem], research_ms: float, draft_ms: float) -> dict:
+    """
+    Cheap, LLM-free check of a topic-only draft against the gathered evidence.
+
+    The draft is kept when it already covers enough of the terms that recur across
+    evidence titles/snippets; otherwise the plan is dropped and the orchestrator re-plans.
+    Returns the state update ({"plan": draft} or {"plan": None}).
+    """
+    start = time.perf_counter()
+
+    plan_terms = _terms(draft.blog_title)
+    for task in draft.tasks:
+        plan_terms |= _terms(" ".join([task.title, task.goal, *task.bullets]))
+
+    doc_freq: Dict[str, int] = {}
+    evidence_terms = []
+    for e in evidence:
+        terms = _terms(f"{e.title} {e.snippet or ''}")
+        evidence_terms.append(terms)
+        for t in terms:
+            doc_freq[t] = doc_freq.get(t, 0) + 1
+
+    dominant = sorted(doc_freq, key=lambda t: (-doc_freq[t], t))[:20]
+    coverage = (sum(1 for t in dominant if t in plan_terms) / len(dominant)) if dominant else 1.0
+    keep = coverage >= SPECULATIVE_PLAN_MIN_COVERAGE
+
+    if keep:
+        # Tasks touching the evidence should cite it, as the evidence-aware planner would
+        for task in draft.tasks:
+            task_terms = _terms(" ".join([task.title, task.goal, *task.bullets]))
+            if any(task_terms & terms for terms in evidence_terms):
+                task.requires_citations = True
+
+    reconcile_ms = (time.perf_counter() - start) * 1000
+    metrics.observe_ms("speculative_plan.reconcile_ms", reconcile_ms)
+    if keep:
+        # Sequential: research + plan. Speculative: max(research, draft) + reconcile
+        saved_ms = research_ms + draft_ms - max(research_ms, draft_ms) - reconcile_ms
+        metrics.incr("speculative_plan.kept")
+        metrics.observe_ms("speculative_plan.saved_ms", saved_ms)
+        print(f"⚡ Speculative plan kept (coverage={coverage:.2f}, saved≈{saved_ms:.0f}ms)")
+        return {"plan": draft}
+
+    # The re-plan still waits on research, plus whatever the draft ran past it
+    lost_ms = max(0.0, draft_ms - research_ms) + reconcile_ms
+    metrics.incr("speculative_plan.replanned")
+    metrics.observe_ms("speculative_plan.lost_ms", lost_ms)
+    print(f"↩️  Speculative plan discarded (coverage={coverage:.2f}), re-planning with evidence")
+    return {"plan": None}
+
+
+# -----------------------------
+# 6) Dispatch + Fanout (Condition of conditional EDGE)
+#    Routing functions may be re-evaluated, so everything with side effects
+#    (image pipeline, metrics) happens in the dispatch node and fanout only
+#    returns the Sends.
+# -----------------------------
+def _reused_sections(state: State) -> Dict[int, str]:
+    # Refresh: unaffected sections are passed through instead of rewritten
+    existing = state.get("existing_sections") or {}
+    if not existing:
+        return {}
+    stale = _stale_task_ids(state)
+    return {tid: md for tid, md in existing.items() if tid not in stale}
+
+
+def _worker_groups(tasks: List[Task]) -> List[List[Task]]:
+    if section_packing.WORKER_PACKING == "auto":
+        return section_packing.plan_packs(tasks)
+    return [[task] for task in tasks]
+
+
+def _worker_base(state: State) -> dict:
+    return {
+        "run_id": state["run_id"],
+        "budget": state.get("budget"),
+        "topic": state["topic"],
+        "mode": state["mode"],
+        "as_of": state["as_of"],
+        "recency_days": state["recency_days"],
+        "plan": state["plan"].model_dump(),
+        "evidence": [e.model_dump() for e in state.get("evidence", [])],
+    }
+
+
+def dispatch_node(state: State) -> dict:
+    assert state['plan'] is not None
+    existing = _reused_sections(state)
+    if state.get("existing_sections"):
+        metrics.incr("topic_match.sections_reused", len(existing))
+        metrics.incr("topic_match.sections_regenerated", len(state["plan"].tasks) - len(existing))
+    elif PIPELINE_IMAGE_STAGE:
+        _start_image_pipeline(state)
+
+    if section_packing.WORKER_PACKING == "auto":
+        to_write = [task for task in state['plan'].tasks if task.id not in existing]
+        _record_packing(_worker_base(state), to_write, _worker_groups(to_write))
+    return {}
+
+
 def fanout(state:State):
     assert state['plan'] is not None
-    return [
-        Send(
-            "worker",
-            {
-                "task": task.model_dump(),
-                "topic": state["topic"],
-                "mode": state["mode"],
-                "as_of": state["as_of"],
-                "recency_days": state["recency_days"],
-                "plan": state["plan"].model_dump(),
-                "evidence": [e.model_dump() for e in state.get("evidence", [])],
-            },
-        )
-        for task in state['plan'].tasks
+    existing = _reused_sections(state)
+    base = _worker_base(state)
+    sends = [
+        Send("worker", {**base, "task": task.model_dump(), "existing_md": existing[task.id]})
+        for task in state['plan'].tasks if task.id in existing
     ]
+    to_write = [task for task in state['plan'].tasks if task.id not in existing]
+    for group in _worker_groups(to_write):
+        if len(group) == 1:
+            sends.append(Send("worker", {**base, "task": group[0].model_dump()}))
+        else:
+            sends.append(Send("worker", {**base, "tasks": [task.model_dump() for task in group]}))
+    return sends
+
+
+def _record_packing(payload: dict, tasks: List[Task], groups: List[List[Task]]) -> None:
+    """Estimated input tokens and requests saved by packing, against one request per task."""
+    plan = Plan(**payload["plan"])
+    fanout_tokens = sum(_estimate_messages(_worker_messages(payload, plan, task)) for task in tasks)
+    packed_tokens = sum(
+        _estimate_messages(_packed_messages(payload, plan, group) if len(group) > 1 else _worker_messages(payload, plan, group[0]))
+        for group in groups
+    )
+    metrics.incr("workers.packed_requests", sum(1 for group in groups if len(group) > 1))
+    metrics.incr("workers.requests_saved", len(tasks) - len(groups))
+    metrics.incr("workers.input_tokens_saved_est", fanout_tokens - packed_tokens)
 
 
 
@@ -376,42 +753,137 @@ Code:
 - If requires_code==true, include at least one minimal snippet.
 """
 
-def worker_node(payload: dict) -> dict:
-    task = Task(**payload["task"])
-    plan = Plan(**payload['plan'])
-    evidence = [EvidenceItem(**e) for e in payload.get("evidence", [])]
+def _worker_header(payload: dict, plan: Plan) -> str:
+    return (
+        f"Blog title: {plan.blog_title}\n"
+        f"Audience: {plan.audience}\n"
+        f"Tone: {plan.tone}\n"
+        f"Blog kind: {plan.blog_kind}\n"
+        f"Topic: {payload['topic']}\n"
+        f"Mode: {payload.get('mode')}\n"
+        f"As-of: {payload.get('as_of')} (recency_days={payload.get('recency_days')})\n\n"
+    )
 
+
+def _task_brief(task: Task) -> str:
     bullets_text = "\n- " + "\n- ".join(task.bullets)
-    evidence_text = "\n".join(
+    return (
+        f"Section title: {task.title}\n"
+        f"Goal: {task.goal}\n"
+        f"Target words: {task.target_words}\n"
+        f"requires_research: {task.requires_research}\n"
+        f"requires_citations: {task.requires_citations}\n"
+        f"requires_code: {task.requires_code}\n"
+        f"Bullets:{bullets_text}\n\n"
+    )
+
+
+def _evidence_text(payload: dict) -> str:
+    evidence = [EvidenceItem(**e) for e in payload.get("evidence", [])]
+    return "\n".join(
         f"- {e.title} | {e.published_at or 'date:Unknown'}" for e in evidence[:20]
     )
 
-    section_md = llm.invoke(
-        [
-            SystemMessage(content=WORKER_SYSTEM),
-            HumanMessage(
-                content=(
-                    f"Blog title: {plan.blog_title}\n"
-                    f"Audience: {plan.audience}\n"
-                    f"Tone: {plan.tone}\n"
-                    f"Blog kind: {plan.blog_kind}\n"
-                    f"Topic: {payload['topic']}\n"
-                    f"Mode: {payload.get('mode')}\n"
-                    f"As-of: {payload.get('as_of')} (recency_days={payload.get('recency_days')})\n\n"
-                    f"Section title: {task.title}\n"
-                    f"Goal: {task.goal}\n"
-                    f"Target words: {task.target_words}\n"
-                    f"requires_research: {task.requires_research}\n"
-                    f"requires_citations: {task.requires_citations}\n"
-                    f"requires_code: {task.requires_code}\n"
-                    f"Bullets:{bullets_text}\n\n"
-                    f"Evidence (ONLY cite these URLs):\n{evidence_text}\n"
-                )
-            ),
-        ]
-    ).content.strip()
 
-    return {"sections": [(task.id, section_md)]}
+def _worker_messages(payload: dict, plan: Plan, task: Task) -> list:
+    return [
+        SystemMessage(content=WORKER_SYSTEM),
+        HumanMessage(
+            content=(
+                _worker_header(payload, plan)
+                + _task_brief(task)
+                + f"Evidence (ONLY cite these URLs):\n{_evidence_text(payload)}\n"
+            )
+        ),
+    ]
+
+
+def _packed_messages(payload: dict, plan: Plan, tasks: List[Task]) -> list:
+    briefs = "".join(
+        section_packing.DELIMITER.format(id=task.id) + "\n" + _task_brief(task) for task in tasks
+    )
+    return [
+        SystemMessage(content=WORKER_SYSTEM + "\n" + section_packing.PACKED_INSTRUCTIONS),
+        HumanMessage(
+            content=(
+                _worker_header(payload, plan)
+                + briefs
+                + f"Evidence (ONLY cite these URLs):\n{_evidence_text(payload)}\n"
+            )
+        ),
+    ]
+
+
+def _estimate_messages(messages: list) -> int:
+    return sum(section_packing.estimate_tokens(m.content) for m in messages)
+
+
+def _stream_text(payload: dict, messages: list) -> str:
+    """Stream one worker request, so a cancelled run aborts it mid-generation."""
+    metrics.incr("workers.requests")
+    metrics.incr("workers.input_tokens_est", _estimate_messages(messages))
+    start = time.perf_counter()
+    chunks = []
+    for chunk in _llm("worker_node", payload).stream(messages):
+        cancellation.check(payload.get("run_id"))
+        chunks.append(chunk.content)
+    text = "".join(chunks).strip()
+    words = len(text.split())
+    if words:
+        deadline.observe("word", (time.perf_counter() - start) * 1000 / words)
+    return text
+
+
+def _fit_deadline(payload: dict, task: Task, degradations: List[str]) -> Task:
+    # Under a deadline, write shorter sections rather than overrun it
+    target_words = deadline.section_words(payload.get("budget"), task.target_words)
+    if target_words < task.target_words:
+        degradations.append(f"worker {task.id}: target_words {task.target_words}->{target_words}")
+        task = task.model_copy(update={"target_words": target_words})
+    return task
+
+
+_PACK_FALLBACK_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="pack-fallback")
+
+
+def _write_packed(payload: dict, plan: Plan, tasks: List[Task]) -> Dict[int, str]:
+    """Write several sections in one request, falling back to one request per task."""
+    ids = [task.id for task in tasks]
+    text = _stream_text(payload, _packed_messages(payload, plan, tasks))
+    sections = section_packing.parse_packed(text, ids)
+    if sections is not None:
+        metrics.incr("workers.packed_sections", len(sections))
+        return sections
+
+    print(f"⚠️  Packed sections {ids} did not split cleanly, writing them one by one")
+    metrics.incr("workers.pack_fallbacks")
+    texts = _PACK_FALLBACK_EXECUTOR.map(
+        lambda task: _stream_text(payload, _worker_messages(payload, plan, task)), tasks
+    )
+    return dict(zip(ids, texts))
+
+
+def worker_node(payload: dict) -> dict:
+    """Write one section ("task"), or several packed into one request ("tasks")."""
+    cancellation.check(payload.get("run_id"))
+    if payload.get("existing_md"):
+        return {"sections": [(payload["task"]["id"], payload["existing_md"])]}
+
+    degradations: List[str] = []
+    plan = Plan(**payload['plan'])
+    if "tasks" in payload:
+        tasks = [_fit_deadline(payload, Task(**t), degradations) for t in payload["tasks"]]
+        sections = _write_packed(payload, plan, tasks)
+    else:
+        task = _fit_deadline(payload, Task(**payload["task"]), degradations)
+        sections = {task.id: _stream_text(payload, _worker_messages(payload, plan, task))}
+
+    pipeline = _IMAGE_PIPELINES.get(payload.get("run_id"))
+    if pipeline is not None:
+        for task_id, section_md in sections.items():
+            pipeline.add_section(task_id, section_md)
+
+    return {"sections": sorted(sections.items()), "degradations": degradations}
 
 
 
@@ -420,13 +892,13 @@ def worker_node(payload: dict) -> dict:
 #    merge_content -> decide_images -> generate_and_place_images
 # ============================================================
 def merge_content(state: State) -> dict:
+    cancellation.check(state.get("run_id"))
     plan = state["plan"]
     if plan is None:
         raise ValueError("merge_content called without plan.")
-    ordered_sections = [md for _, md in sorted(state["sections"], key=lambda x: x[0])]
-    body = "\n\n".join(ordered_sections).strip()
-    merged_md = f"# {plan.blog_title}\n\n{body}\n"
-    return {"merged_md": merged_md}
+    # Index section offsets while joining so later stages never re-scan the markdown
+    merged_md, section_index = merge_sections(plan.blog_title, state["sections"])
+    return {"merged_md": merged_md, "section_index": section_index}
 
 
 DECIDE_IMAGES_SYSTEM = """Expert technical editor: Decide which images to add to blog.
@@ -435,69 +907,124 @@ STRICT RULES:
 - Return 0-2 image specs (prefer 0 if blog is clear without images)
 - Only add images if they materially improve understanding
 - For each image: placeholder=[[IMAGE_1]] or [[IMAGE_2]], filename=image_1.png or image_2.png
+- Set section_id to the id of the section the image illustrates (from the Sections list)
 - Keep all text fields SHORT (alt<50 chars, caption<80 chars, prompt<200 chars)
 - Focus on technical diagrams, flows, or charts - NOT decorative images
 
 DO NOT return the full markdown - only return the image specs array.
 """
 
-def decide_images(state: State) -> dict:
-    planner = llm.with_structured_output(GlobalImagePlan)
-    merged_md = state["merged_md"]
-    plan = state["plan"]
-    assert plan is not None
-
+def _image_preview(merged_md: str) -> str:
     # Truncate markdown for LLM to avoid huge payloads
-    preview_md = merged_md[:2000] + ("..." if len(merged_md) > 2000 else "")
-
-    image_plan = planner.invoke(
+    return merged_md[:2000] + ("..." if len(merged_md) > 2000 else "")
+
+
+def _plan_images(
+    topic: str,
+    plan: Plan,
+    preview_md: str,
+    sections_text: str,
+    budget: Optional[dict] = None,
+    run_id: Optional[str] = None,
+) -> GlobalImagePlan:
+    cancellation.check(run_id)
+    cancellation.bind(run_id)
+    start = time.perf_counter()
+    image_plan = structured_repair.invoke(
+        model_registry.get_llm("decide_images", budget),
+        GlobalImagePlan,
         [
             SystemMessage(content=DECIDE_IMAGES_SYSTEM),
             HumanMessage(
                 content=(
                     f"Blog kind: {plan.blog_kind}\n"
-                    f"Topic: {state['topic']}\n\n"
+                    f"Topic: {topic}\n\n"
+                    f"Sections (id: title):\n{sections_text}\n\n"
                     f"Blog preview (first 2000 chars):\n{preview_md}\n\n"
                     "Return image specs array. Output ONLY the image specs, NOT the markdown."
                 )
             ),
-        ]
+        ],
+        post=_repair_image_plan,
     )
+    deadline.observe("image_plan", (time.perf_counter() - start) * 1000)
+    return image_plan
 
-    # Manually insert placeholders into markdown
-    md_with_placeholders = merged_md
-    for img in image_plan.images:
-        # Insert placeholder at the end of the first section after the title
-        # Simple heuristic: after first "##" heading
-        lines = md_with_placeholders.split('\n')
-        insert_idx = None
-        for i, line in enumerate(lines):
-            if line.startswith('## ') and insert_idx is None:
-                # Find end of this section (next ## or end)
-                for j in range(i+1, len(lines)):
-                    if lines[j].startswith('## ') or j == len(lines) - 1:
-                        insert_idx = j
-                        break
-                break
-        
-        if insert_idx:
-            lines.insert(insert_idx, f"\n{img.placeholder}\n")
-            md_with_placeholders = '\n'.join(lines)
+
+def decide_images(state: State) -> dict:
+    merged_md = state["merged_md"]
+    plan = state["plan"]
+    assert plan is not None
+    section_index = state.get("section_index") or []
+
+    # Refresh: reused sections still carry their published images
+    stale = _stale_task_ids(state) if state.get("existing_sections") else None
+
+    pipeline = _IMAGE_PIPELINES.get(state.get("run_id"))
+    degradations = []
+    if stale is not None and not stale:
+        images = []
+    elif pipeline is not None and pipeline.future is not None:
+        # Pipelined mode: images were planned while the remaining workers ran
+        try:
+            image_specs, _ = pipeline.future.result()
+        except Exception:
+            _IMAGE_PIPELINES.pop(state.get("run_id"), None)
+            raise
+        images = [ImageSpec(**spec) for spec in image_specs]
+    elif not deadline.can_plan_images(state.get("budget")):
+        images = []
+        degradations.append("decide_images: skipped, no time left for images")
+    else:
+        sections_text = "\n".join(f"- {s['task_id']}: {s['title']}" for s in section_index)
+        images = _plan_images(
+            state["topic"], plan, _image_preview(merged_md), sections_text,
+            state.get("budget"), state.get("run_id"),
+        ).images
+
+    if stale is not None:
+        # Reused sections still link their images, so new ones must not overwrite them
+        prefix = state["run_id"][:8]
+        images = [
+            img.model_copy(update={"filename": f"{prefix}_{img.filename}"})
+            for img in images if _image_task_id(section_index, img.section_id) in stale
+        ]
+
+    # Place every placeholder after its target section in one pass over the index
+    md_with_placeholders = place_blocks(
+        merged_md,
+        section_index,
+        [(img.section_id, img.placeholder) for img in images],
+    )
 
     return {
         "md_with_placeholders": md_with_placeholders,
-        "image_specs": [img.model_dump() for img in image_plan.images],
+        "image_specs": [img.model_dump() for img in images],
+        "degradations": degradations,
     }
 
 
 
-def _pollinations_generate_image_bytes(prompt: str) -> bytes:
+def _read_body(response: requests.Response, run_id: Optional[str]) -> bytes:
+    """Read a streamed response body, aborting the download if the run is cancelled."""
+    chunks = []
+    try:
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            cancellation.check(run_id)
+            chunks.append(chunk)
+    finally:
+        response.close()
+    return b"".join(chunks)
+
+
+def _pollinations_generate_image_bytes(prompt: str, run_id: Optional[str] = None) -> bytes:
     """
     Generate image using Pollinations.ai (FREE, no API key needed!)
     Uses FLUX Pro model via their free API.
     """
     import urllib.parse
     
+    coordination.acquire("pollinations", run_id)
     # URL encode the prompt
     encoded_prompt = urllib.parse.quote(prompt)
     
@@ -515,15 +1042,16 @@ def _pollinations_generate_image_bytes(prompt: str) -> bytes:
     param_str = "&".join([f"{k}={v}" for k, v in params.items()])
     full_url = f"{url}?{param_str}"
     
-    response = requests.get(full_url, timeout=60)
+    response = requests.get(full_url, timeout=60, stream=True)
     
     if response.status_code != 200:
+        response.close()
         raise RuntimeError(f"Pollinations API error {response.status_code}")
     
-    return response.content
+    return _read_body(response, run_id)
 
 
-def _huggingface_generate_image_bytes(prompt: str) -> bytes:
+def _huggingface_generate_image_bytes(prompt: str, run_id: Optional[str] = None) -> bytes:
     """
     Generate image using Hugging Face Inference API (FREE with API key)
     Get your free API key at: https://huggingface.co/settings/tokens
@@ -540,12 +1068,13 @@ def _huggingface_generate_image_bytes(prompt: str) -> bytes:
     
     payload = {"inputs": prompt}
     
-    response = requests.post(API_URL, headers=headers, json=payload, timeout=60)
+    coordination.acquire("huggingface", run_id)
+    response = requests.post(API_URL, headers=headers, json=payload, timeout=60, stream=True)
     
     if response.status_code != 200:
         raise RuntimeError(f"HuggingFace API error {response.status_code}: {response.text}")
     
-    return response.content
+    return _read_body(response, run_id)
 # --------------------------------------------------------------------
 # def _huggingface_generate_image_bytes(prompt: str) -> bytes:
 #     """
@@ -572,7 +1101,7 @@ def _huggingface_generate_image_bytes(prompt: str) -> bytes:
 #     return response.content
 
 
-def _nvidia_generate_image_bytes(prompt: str) -> bytes:
+def _nvidia_generate_image_bytes(prompt: str, run_id: Optional[str] = None) -> bytes:
     """
     Returns raw image bytes generated by NVIDIA Stable Diffusion 3.
     Env var required: NVIDIA_API_KEY
@@ -600,14 +1129,15 @@ def _nvidia_generate_image_bytes(prompt: str) -> bytes:
         "negative_prompt": "",
     }
 
-    response = requests.post(invoke_url, headers=headers, json=payload)
+    coordination.acquire("nvidia", run_id)
+    response = requests.post(invoke_url, headers=headers, json=payload, stream=True)
     
     # Better error handling
     if response.status_code != 200:
         error_msg = f"NVIDIA API error {response.status_code}: {response.text}"
         raise RuntimeError(error_msg)
 
-    data = response.json()
+    data = json.loads(_read_body(response, run_id))
     
     # Debug: print the response structure if artifacts are missing
     if "artifacts" not in data:
@@ -631,92 +1161,340 @@ def _safe_slug(title: str) -> str:
     return s or "blog"
 
 
-def generate_and_place_images(state: State) -> dict:
-    plan = state["plan"]
-    assert plan is not None
+def _post_filename(state: State) -> str:
+    # A refreshed or regenerated post keeps its filename
+    return state.get("matched_post") or f"{_safe_slug(state['plan'].blog_title)}.md"
 
-    md = state.get("md_with_placeholders") or state["merged_md"]
-    image_specs = state.get("image_specs", []) or []
-    
-    # OPTION: Set to False to disable image generation entirely
-    ENABLE_IMAGE_GENERATION = os.getenv("ENABLE_IMAGE_GENERATION", "true").lower() == "true"
-    
+
+def _render_final_md(state: State, replacements: dict) -> str:
+    """
+    Produce the final markdown in one linear pass.
+
+    With a section index, image blocks are placed straight into merged_md at their
+    section ends (placement and substitution together); otherwise the placeholders
+    already in md_with_placeholders are substituted with a single regex pass.
+    """
+    section_index = state.get("section_index") or []
+    merged_md = state.get("merged_md") or ""
+    if section_index and merged_md:
+        blocks = [
+            (spec.get("section_id"), replacements[spec["placeholder"]])
+            for spec in state.get("image_specs", []) or []
+            if spec["placeholder"] in replacements
+        ]
+        return place_blocks(merged_md, section_index, blocks)
+    md = state.get("md_with_placeholders") or merged_md
+    return substitute_placeholders(md, replacements)
+
+
+def _published_sections(state: State, replacements: dict) -> Dict[int, str]:
+    """Each task's section as it appears in the final markdown, image blocks included."""
+    section_index = state.get("section_index") or []
+    merged_md = state.get("merged_md") or ""
+    if not (section_index and merged_md):
+        return {task_id: md for task_id, md in state.get("sections", [])}
+    blocks: Dict[int, List[str]] = {}
+    for spec in state.get("image_specs", []) or []:
+        if spec["placeholder"] in replacements:
+            section = resolve_section(section_index, spec.get("section_id"))
+            blocks.setdefault(section["task_id"], []).append(replacements[spec["placeholder"]])
+    return {
+        s["task_id"]: merged_md[s["start"]:s["end"]] + "".join(f"\n\n{b}" for b in blocks.get(s["task_id"], []))
+        for s in section_index
+    }
+
+
+def _image_task_id(section_index: List[dict], section_id: Optional[int]) -> Optional[int]:
+    """Task whose section an image is placed after (images without a section go after the first)."""
+    section = resolve_section(section_index, section_id)
+    return section["task_id"] if section else section_id
+
+
+def _reused_image_specs(state: State) -> tuple:
+    """Split a regeneration's prior image specs into (kept with a reused section, superseded)."""
+    existing = state.get("existing_sections") or {}
+    reused = set(existing) - _stale_task_ids(state) if existing else set()
+    section_index = state.get("section_index") or []
+    kept, superseded = [], []
+    for spec in state.get("prior_image_specs", []) or []:
+        in_reused = _image_task_id(section_index, spec.get("section_id")) in reused
+        (kept if in_reused else superseded).append(spec)
+    return kept, superseded
+
+
+def _run_artifacts(state: State, replacements: dict) -> dict:
+    """Everything needed to regenerate single sections of the post later."""
+    kept, _ = _reused_image_specs(state)
+    image_specs = kept + list(state.get("image_specs", []) or [])
+    return {
+        "topic": state["topic"],
+        "as_of": state["as_of"],
+        "mode": state.get("mode"),
+        "recency_days": state.get("recency_days"),
+        "queries": state.get("queries", []) or [],
+        "image_model": state.get("image_model"),
+        "plan": state["plan"].model_dump(),
+        "evidence": [e.model_dump() for e in state.get("evidence", []) or []],
+        "sections": {str(task_id): md for task_id, md in _published_sections(state, replacements).items()},
+        "image_specs": [spec for spec in image_specs if spec.get("section_id") is not None],
+        # Placed after the first section; kept apart so a regeneration knows where they live
+        "unsectioned_image_specs": [spec for spec in image_specs if spec.get("section_id") is None],
+        "updated_at": datetime.now().isoformat(),
+    }
+
+
+def _upload_image_block(
+    img_bytes: bytes, spec: dict, run_id: Optional[str] = None, folder: Optional[str] = None
+) -> str:
+    """
+    Optimize and upload one generated image, returning its markdown block.
+
+    The display-width variant is shown inline and links to the full-width one.
+    Falls back to uploading the provider bytes when Pillow is unavailable or
+    the image can't be decoded. Images go under the post's folder so posts
+    never overwrite each other's images.
+    """
+    filename = f"{folder}/{spec['filename']}" if folder else spec["filename"]
+    try:
+        variants = image_optimizer.optimize(img_bytes)
+    except Exception as e:
+        print(f"  ⚠️  Image optimization failed for {filename}, uploading original: {e}")
+        variants = []
+
+    if not variants:
+        public_url = supabase_storage.upload_image(img_bytes, filename)
+        return f"![{spec['alt']}]({public_url})\n*{spec['caption']}*"
+
+    cancellation.check(run_id)
+    urls = supabase_storage.upload_images([(v.filename(filename), v.data, v.content_type) for v in variants])
+    if None in urls.values():
+        raise RuntimeError(f"Upload of {filename} variants failed")
+    chosen = image_optimizer.pick(variants)
+    display_url = urls[chosen["display"].filename(filename)]
+    full_url = urls[chosen["full"].filename(filename)]
+    # Plain markdown (the frontend renders no raw HTML, so no <picture>/srcset)
+    if display_url == full_url:
+        return f"![{spec['alt']}]({display_url})\n*{spec['caption']}*"
+    return f"[![{spec['alt']}]({display_url})]({full_url})\n*{spec['caption']}*"
+
+
+def _caption_block(spec: dict) -> str:
+    return f"*[Image: {spec.get('caption', 'Illustration')}]*"
+
+
+# OPTION: Set to False to disable image generation entirely (placeholders become captions)
+ENABLE_IMAGE_GENERATION = os.getenv("ENABLE_IMAGE_GENERATION", "true").lower() == "true"
+
+
+def _image_replacements(
+    image_specs: List[dict],
+    image_model: Optional[str],
+    run_id: Optional[str] = None,
+    max_images: Optional[int] = None,
+    folder: Optional[str] = None,
+) -> dict:
+    """
+    Generate and upload images under folder, returning {placeholder: markdown block}.
+
+    Specs past max_images (the ones that won't fit before the deadline) get captions.
+    """
     # Priority: State > Env Var > Default
-    IMAGE_PROVIDER = state.get("image_model") or os.getenv("IMAGE_PROVIDER", "huggingface").lower()
+    IMAGE_PROVIDER = image_model or os.getenv("IMAGE_PROVIDER", "huggingface").lower()
 
-    # If no images requested or image generation disabled, just write merged markdown
+    # Replace image placeholders with captions if generation is disabled
     if not image_specs or not ENABLE_IMAGE_GENERATION:
-        if image_specs and not ENABLE_IMAGE_GENERATION:
-            # Remove image placeholders if generation is disabled
-            for spec in image_specs:
-                placeholder = spec["placeholder"]
-                md = md.replace(placeholder, f"*[Image: {spec.get('caption', 'Illustration')}]*")
-        
-        filename = f"{_safe_slug(plan.blog_title)}.md"
-        # Upload markdown to Supabase
-        supabase_storage.upload_markdown(md, filename)
-        return {"final": md}
+        return {spec["placeholder"]: _caption_block(spec) for spec in image_specs}
 
     print(f"🖼️  Generating images using: {IMAGE_PROVIDER}")
 
-    for spec in image_specs:
+    replacements = {}
+    for i, spec in enumerate(image_specs):
         placeholder = spec["placeholder"]
         filename = spec["filename"]
+        if max_images is not None and i >= max_images:
+            replacements[placeholder] = _caption_block(spec)
+            continue
 
+        start = time.perf_counter()
         try:
+            cancellation.check(run_id)
             # Select provider based on IMAGE_PROVIDER env variable
             if IMAGE_PROVIDER == "huggingface":
-                img_bytes = _huggingface_generate_image_bytes(spec["prompt"])
+                img_bytes = _huggingface_generate_image_bytes(spec["prompt"], run_id)
             elif IMAGE_PROVIDER == "pollinations":
-                img_bytes = _pollinations_generate_image_bytes(spec["prompt"])
+                img_bytes = _pollinations_generate_image_bytes(spec["prompt"], run_id)
             elif IMAGE_PROVIDER == "nvidia":
-                img_bytes = _nvidia_generate_image_bytes(spec["prompt"])
+                img_bytes = _nvidia_generate_image_bytes(spec["prompt"], run_id)
             else:
                 # Default to HuggingFace with Pollinations fallback
                 try:
-                    img_bytes = _huggingface_generate_image_bytes(spec["prompt"])
+                    img_bytes = _huggingface_generate_image_bytes(spec["prompt"], run_id)
                 except RuntimeError as e:
                     if "HF_API_KEY" in str(e):
                         print(f"⚠️  HF_API_KEY not set, falling back to Pollinations.ai...")
-                        img_bytes = _pollinations_generate_image_bytes(spec["prompt"])
+                        img_bytes = _pollinations_generate_image_bytes(spec["prompt"], run_id)
                     else:
                         raise
             
             # Upload image to Supabase and get public URL
-            public_url = supabase_storage.upload_image(img_bytes, filename)
+            cancellation.check(run_id)
+            replacements[placeholder] = _upload_image_block(img_bytes, spec, run_id, folder)
             print(f"  ✅ Generated and uploaded: {filename}")
+            deadline.observe("image", (time.perf_counter() - start) * 1000)
             
-            # Use Supabase public URL in markdown
-            img_md = f"![{spec['alt']}]({public_url})\n*{spec['caption']}*"
-            md = md.replace(placeholder, img_md)
-            
+        except cancellation.RunCancelled:
+            raise
         except Exception as e:
             # graceful fallback: keep doc usable
-            prompt_block = (
+            replacements[placeholder] = (
                 f"> **[IMAGE GENERATION FAILED]** {spec.get('caption','')}\n>\n"
                 f"> **Alt:** {spec.get('alt','')}\n>\n"
                 f"> **Prompt:** {spec.get('prompt','')}\n>\n"
                 f"> **Error:** {e}\n"
             )
-            md = md.replace(placeholder, prompt_block)
             continue
 
-    # Upload final markdown to Supabase
-    filename = f"{_safe_slug(plan.blog_title)}.md"
-    supabase_storage.upload_markdown(md, filename)
+    return replacements
+
+
+def _images_within_deadline(budget: Optional[dict], image_specs: List[dict], degradations: List[str]) -> int:
+    """How many images to generate before the deadline; the rest fall back to captions."""
+    max_images = deadline.images_that_fit(budget, len(image_specs))
+    if max_images < len(image_specs) and ENABLE_IMAGE_GENERATION:
+        degradations.append(f"images: {len(image_specs) - max_images} of {len(image_specs)} captioned")
+    return max_images
+
+
+def _remove_superseded_images(state: State, filename: str) -> None:
+    """Delete the images of regenerated sections; the published post no longer links them."""
+    kept, superseded = _reused_image_specs(state)
+    still_linked = {spec["filename"] for spec in kept}
+    names = [spec["filename"] for spec in superseded if spec["filename"] not in still_linked]
+    if not names:
+        return
+    try:
+        removed = supabase_storage.remove_images(post_renderer.post_stem(filename), names)
+        print(f"🧹 Removed {removed} superseded image file(s) of {filename}")
+    except Exception as e:
+        # Harmless: the storage GC sweeps unreferenced images later
+        print(f"⚠️  Could not remove superseded images of {filename}: {e}")
+
+
+def generate_and_place_images(state: State) -> dict:
+    plan = state["plan"]
+    assert plan is not None
+
+    degradations: List[str] = []
+    pipeline = _IMAGE_PIPELINES.pop(state.get("run_id"), None)
+    if pipeline is not None and pipeline.future is not None:
+        # Pipelined mode: images are already generated and uploaded
+        _, replacements = pipeline.future.result()
+        degradations.extend(pipeline.degradations)
+    else:
+        image_specs = state.get("image_specs", []) or []
+        max_images = _images_within_deadline(state.get("budget"), image_specs, degradations)
+        replacements = _image_replacements(
+            image_specs, state.get("image_model"), state.get("run_id"), max_images,
+            post_renderer.post_stem(_post_filename(state)),
+        )
+
+    start = time.perf_counter()
+    md = _render_final_md(state, replacements)
+    cancellation.check(state.get("run_id"))
+
+    # Upload final markdown to Supabase, with its renditions, artifacts and manifest
+    filename = _post_filename(state)
+    supabase_storage.upload_markdown(md, filename, artifacts=_run_artifacts(state, replacements))
     print(f"📝 Uploaded markdown to Supabase: {filename}")
-    return {"final": md}
+    if state.get("existing_sections"):
+        _remove_superseded_images(state, filename)
+    deadline.observe("finalize", (time.perf_counter() - start) * 1000)
+    topic_index.record(
+        state["topic"], plan.blog_title, filename, state["as_of"],
+        plan.model_dump(), [e.url for e in state.get("evidence", []) or []],
+    )
+    return {"final": md, "degradations": degradations}
+
+
+# -----------------------------
+# 8b) Pipelined image stage
+#     Image planning only needs the first 2000 chars, so in pipelined mode it starts
+#     as soon as the leading sections arrive and runs alongside the remaining workers.
+# -----------------------------
+PIPELINE_IMAGE_STAGE = os.getenv("PIPELINE_IMAGE_STAGE", "false").lower() == "true"
+_PIPELINE_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="image-pipeline")
+_IMAGE_PIPELINES: Dict[str, "_ImagePipeline"] = {}
+_PIPELINE_TTL_SECONDS = 3600
+
+
+class _ImagePipeline:
+    """Collects worker sections for one run and kicks off the image stage early."""
+
+    def __init__(self, state: State):
+        plan = state["plan"]
+        self.topic = state["topic"]
+        self.plan = plan
+        self.image_model = state.get("image_model")
+        self.budget = state.get("budget")
+        self.folder = post_renderer.post_stem(_post_filename(state))
+        self.run_id = state["run_id"]
+        self.task_ids = sorted(task.id for task in plan.tasks)
+        self.sections: Dict[int, str] = {}
+        self.future: Optional[Future] = None
+        self.degradations: List[str] = []
+        self.created_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add_section(self, task_id: int, section_md: str) -> None:
+        with self._lock:
+            self.sections[task_id] = section_md
+            if self.future is not None:
+                return
+            preview_md = self._ready_preview()
+            if preview_md is None:
+                return
+            self.future = _PIPELINE_EXECUTOR.submit(self._run, preview_md)
+
+    def _ready_preview(self) -> Optional[str]:
+        # Only the contiguous leading sections form a stable prefix of merged_md
+        prefix = []
+        for task_id in self.task_ids:
+            if task_id not in self.sections:
+                break
+            prefix.append((task_id, self.sections[task_id]))
+        prefix_md, _ = merge_sections(self.plan.blog_title, prefix)
+        complete = len(prefix) == len(self.task_ids)
+        # merged_md only differs from prefix_md past its trailing newline
+        if complete or len(prefix_md) > 2001:
+            return _image_preview(prefix_md)
+        return None
+
+    def _run(self, preview_md: str):
+        sections_text = "\n".join(f"- {task.id}: {task.title}" for task in self.plan.tasks)
+        image_plan = _plan_images(self.topic, self.plan, preview_md, sections_text, self.budget, self.run_id)
+        image_specs = [img.model_dump() for img in image_plan.images]
+        max_images = _images_within_deadline(self.budget, image_specs, self.degradations)
+        return image_specs, _image_replacements(
+            image_specs, self.image_model, self.run_id, max_images, self.folder
+        )
 
 
+def _start_image_pipeline(state: State) -> None:
+    now = time.monotonic()
+    for run_id, pipeline in list(_IMAGE_PIPELINES.items()):
+        # Drop pipelines left behind by runs that failed before the reducer
+        if now - pipeline.created_at > _PIPELINE_TTL_SECONDS:
+            _IMAGE_PIPELINES.pop(run_id, None)
+    _IMAGE_PIPELINES[state["run_id"]] = _ImagePipeline(state)
 
 
 # -----------------------------
 # 9) Build Reducer sub-graph
 # -----------------------------
 reducer_graph = StateGraph(State)
-reducer_graph.add_node("merge_content", merge_content)
-reducer_graph.add_node("decide_images", decide_images)
-reducer_graph.add_node("generate_and_place_images", generate_and_place_images)
+reducer_graph.add_node("merge_content", profiling.node("merge_content", merge_content))
+reducer_graph.add_node("decide_images", profiling.node("decide_images", decide_images))
+reducer_graph.add_node("generate_and_place_images", profiling.node("generate_and_place_images", generate_and_place_images))
 reducer_graph.add_edge(START, "merge_content")
 reducer_graph.add_edge("merge_content", "decide_images")
 reducer_graph.add_edge("decide_images", "generate_and_place_images")
@@ -729,23 +1507,112 @@ reducer_subgraph = reducer_graph.compile()
 # 10) Build main graph
 # -----------------------------
 g = StateGraph(State)
-g.add_node("router", router_node)
-g.add_node("research", research_node)
-g.add_node("orchestrator", orchestrator_node)
-g.add_node("worker", worker_node)
+g.add_node("match", profiling.node("match", match_node))
+g.add_node("router", profiling.node("router", router_node))
+g.add_node("research", profiling.node("research", research_node))
+g.add_node("orchestrator", profiling.node("orchestrator", orchestrator_node))
+g.add_node("dispatch", profiling.node("dispatch", dispatch_node))
+g.add_node("worker", profiling.node("worker", worker_node))
 g.add_node("reducer", reducer_subgraph)
 
-g.add_edge(START, "router")
-g.add_conditional_edges("router", route_next, {"research": "research", "orchestrator": "orchestrator"})
-g.add_edge("research", "orchestrator")
+g.add_edge(START, "match")
+g.add_conditional_edges("match", route_after_match, ["router", END])
+g.add_conditional_edges("router", route_next, ["research", "orchestrator", "dispatch"])
+g.add_conditional_edges("research", route_after_research, ["orchestrator", "dispatch"])
 
-g.add_conditional_edges("orchestrator", fanout, ["worker"])
+g.add_edge("orchestrator", "dispatch")
+g.add_conditional_edges("dispatch", fanout, ["worker"])
 g.add_edge("worker", "reducer")
 g.add_edge("reducer", END)
 
 app = g.compile()
 app
 
+
+# -----------------------------
+# 11) Section regeneration
+#     Rebuilds a published post from its stored run artifacts: only the selected
+#     tasks (and, after a research refresh, the tasks new evidence affects) are
+#     rewritten; every other section and its images are reused as published.
+# -----------------------------
+def regeneration_inputs(
+    filename: str,
+    artifacts: dict,
+    task_ids: Optional[List[int]] = None,
+    refresh_research: bool = False,
+    image_model: Optional[str] = None,
+) -> dict:
+    """
+    Build the regeneration graph's input state for a post.
+
+    Args:
+        filename: Published post to overwrite
+        artifacts: Run artifacts stored with the post
+        task_ids: Tasks to rewrite regardless of research
+        refresh_research: Re-run the stored queries and rewrite the tasks fresh evidence touches
+        image_model: Image provider for new images (defaults to the one the post used)
+
+    Returns:
+        Input state for regenerate_app
+
+    Raises:
+        ValueError: If a task id is not in the post's plan
+    """
+    plan = Plan(**artifacts["plan"])
+    task_ids = set(task_ids or [])
+    unknown = task_ids - {task.id for task in plan.tasks}
+    if unknown:
+        raise ValueError(f"Unknown task ids for {filename}: {sorted(unknown)}")
+
+    evidence = [EvidenceItem(**e) for e in artifacts.get("evidence", [])]
+    sections = {int(task_id): md for task_id, md in artifacts.get("sections", {}).items()}
+    return {
+        "run_id": uuid.uuid4().hex,
+        "topic": artifacts["topic"],
+        # Refreshed research is dated today; otherwise the post keeps its as-of date
+        "as_of": date.today().isoformat() if refresh_research else artifacts["as_of"],
+        "image_model": image_model or artifacts.get("image_model"),
+        "budget": None,
+        "mode": artifacts.get("mode") or "closed_book",
+        "needs_research": refresh_research,
+        "queries": artifacts.get("queries", []),
+        "recency_days": artifacts.get("recency_days") or 30,
+        "evidence": evidence,
+        "plan": plan,
+        "matched_post": filename,
+        "existing_sections": {tid: md for tid, md in sections.items() if tid not in task_ids},
+        "prior_evidence_urls": [e.url for e in evidence],
+        "prior_image_specs": artifacts.get("image_specs", []) + artifacts.get("unsectioned_image_specs", []),
+        "degradations": [],
+        "sections": [],
+        "merged_md": "",
+        "section_index": [],
+        "md_with_placeholders": "",
+        "image_specs": [],
+        "final": "",
+    }
+
+
+def route_regeneration(state: State):
+    if state["needs_research"]:
+        return "research"
+    return "dispatch"
+
+
+rg = StateGraph(State)
+rg.add_node("research", profiling.node("research", research_node))
+rg.add_node("dispatch", profiling.node("dispatch", dispatch_node))
+rg.add_node("worker", profiling.node("worker", worker_node))
+rg.add_node("reducer", reducer_subgraph)
+
+rg.add_conditional_edges(START, route_regeneration, ["research", "dispatch"])
+rg.add_conditional_edges("research", route_after_research, ["dispatch"])
+rg.add_conditional_edges("dispatch", fanout, ["worker"])
+rg.add_edge("worker", "reducer")
+rg.add_edge("reducer", END)
+
+regenerate_app = rg.compile()
+
 if __name__ == "__main__":
     # 1. Prepare the initial state
     initial_state = {
@@ -0,0 +1,122 @@
+"""
+Markdown Section Index
+
+Helpers for working with the merged blog markdown by section. The index is
+built once in `merge_content` (it already knows where every worker section
+starts and ends), and image placement / placeholder substitution then run as
+a single linear pass over the document instead of re-splitting it per image.
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+PLACEHOLDER_RE = re.compile(r"\[\[IMAGE_\d+\]\]")
+
+
+def merge_sections(title: str, sections: List[Tuple[int, str]]) -> Tuple[str, List[dict]]:
+    """
+    Join worker sections into the final markdown and index them.
+
+    Args:
+        title: Blog title (rendered as the H1)
+        sections: (task_id, section_md) tuples, in any order
+
+    Returns:
+        (merged_md, section_index) where each index entry is
+        {"task_id", "title", "start", "end"} with character offsets into merged_md
+    """
+    ordered = sorted(sections, key=lambda x: x[0])
+    parts: List[str] = []
+    index: List[dict] = []
+
+    header = f"# {title}\n\n"
+    offset = len(header)
+    for task_id, md in ordered:
+        md = md.strip()
+        if not md:
+            continue
+        if parts:
+            offset += 2  # "\n\n" separator
+        heading = md.split("\n", 1)[0]
+        index.append({
+            "task_id": task_id,
+            "title": heading.lstrip("#").strip(),
+            "start": offset,
+            "end": offset + len(md),
+        })
+        parts.append(md)
+        offset += len(md)
+
+    body = "\n\n".join(parts)
+    merged_md = f"{header}{body}\n"
+    return merged_md, index
+
+
+def resolve_section(section_index: List[dict], section_id: Optional[int]) -> Optional[dict]:
+    """Return the indexed section for a task id, defaulting to the first section."""
+    if not section_index:
+        return None
+    if section_id is not None:
+        for section in section_index:
+            if section["task_id"] == section_id:
+                return section
+    return section_index[0]
+
+
+def place_blocks(md: str, section_index: List[dict], blocks: List[Tuple[Optional[int], str]]) -> str:
+    """
+    Insert blocks at the end of their target sections in one pass.
+
+    Args:
+        md: Merged markdown that section_index was built from
+        section_index: Output of merge_sections
+        blocks: (section_id, block_md) tuples; blocks for the same section keep their order
+
+    Returns:
+        Markdown with every block placed after its section
+    """
+    by_offset: Dict[int, List[str]] = {}
+    for section_id, block in blocks:
+        section = resolve_section(section_index, section_id)
+        if section is None:
+            continue
+        by_offset.setdefault(section["end"], []).append(block)
+
+    if not by_offset:
+        return md
+
+    out: List[str] = []
+    cursor = 0
+    for offset in sorted(by_offset):
+        out.append(md[cursor:offset])
+        for block in by_offset[offset]:
+            out.append(f"\n\n{block}")
+        cursor = offset
+    out.append(md[cursor:])
+    return "".join(out)
+
+
+def substitute_placeholders(md: str, replacements: Dict[str, str]) -> str:
+    """Replace every [[IMAGE_N]] placeholder in a single regex pass."""
+    if not replacements:
+        return md
+    return PLACEHOLDER_RE.sub(lambda m: replacements.get(m.group(0), m.group(0)), md)
+
+
+def split_sections(md: str) -> List[str]:
+    """
+    Split published markdown back into its "## " sections (code fences respected).
+
+    Everything before the first section (the H1) is dropped; each section keeps
+    whatever follows it up to the next one, including placed image blocks.
+    """
+    sections: List[List[str]] = []
+    in_fence = False
+    for line in md.splitlines():
+        if line.lstrip().startswith("```"):
+            in_fence = not in_fence
+        if not in_fence and line.startswith("## "):
+            sections.append([line])
+        elif sections:
+            sections[-1].append(line)
+    return ["\n".join(lines).strip() for lines in sections]
@@ -0,0 +1,74 @@
+"""
+Runtime Metrics
+
+Thread-safe, in-process counters and latency summaries recorded by the graph
+nodes and the API. A snapshot is served from the /metrics endpoint.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = {}
+_timings: Dict[str, Dict[str, float]] = {}
+
+
+def incr(name: str, value: float = 1) -> None:
+    """Increment a counter."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_max(name: str, value: float) -> None:
+    """Raise a counter to value if it is currently lower (high-water mark)."""
+    with _lock:
+        _counters[name] = max(_counters.get(name, value), value)
+
+
+def observe_ms(name: str, ms: float) -> None:
+    """Record one latency sample (milliseconds)."""
+    with _lock:
+        t = _timings.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        t["count"] += 1
+        t["total_ms"] += ms
+        t["max_ms"] = max(t["max_ms"], ms)
+
+
+@contextmanager
+def timed(name: str):
+    """Context manager that records the elapsed time of its block."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_ms(name, (time.perf_counter() - start) * 1000)
+
+
+def snapshot() -> Dict[str, dict]:
+    """
+    Get a copy of all metrics.
+
+    Returns:
+        {"counters": {name: value}, "timings": {name: {count, total_ms, avg_ms, max_ms}}}
+    """
+    with _lock:
+        counters = dict(_counters)
+        timings = {
+            name: {
+                "count": t["count"],
+                "total_ms": round(t["total_ms"], 2),
+                "avg_ms": round(t["total_ms"] / t["count"], 2) if t["count"] else 0.0,
+                "max_ms": round(t["max_ms"], 2),
+            }
+            for name, t in _timings.items()
+        }
+    return {"counters": counters, "timings": timings}
+
+
+def reset() -> None:
+    """Clear all metrics."""
+    with _lock:
+        _counters.clear()
+        _timings.clear()
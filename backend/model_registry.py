@@ -0,0 +1,235 @@
+"""
+Model Registry
+
+Assigns a Groq model chain to every graph node (a fast tier for routing and
+image planning, a stronger tier for planning and writing), wires fallbacks for
+slow or failing models, and narrows the chain when a request carries a latency
+or cost budget. Latency and token usage per node and model are recorded in
+metrics and summarized by usage_report().
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_groq import ChatGroq
+
+import coordination
+import metrics
+
+# Model chains, best first; later entries are fallbacks
+TIERS: Dict[str, List[str]] = {
+    "fast": os.getenv("MODEL_TIER_FAST", "llama-3.1-8b-instant").split(","),
+    "strong": os.getenv("MODEL_TIER_STRONG", "llama-3.3-70b-versatile,llama-3.1-8b-instant").split(","),
+}
+
+NODE_TIERS: Dict[str, str] = {
+    "router_node": "fast",
+    "research_node": "fast",
+    "orchestrator_node": "strong",
+    "worker_node": "strong",
+    "decide_images": "fast",
+}
+
+# USD per 1M tokens (input, output) and a typical call latency used before we have samples
+MODELS: Dict[str, dict] = {
+    "llama-3.1-8b-instant": {"input_per_m": 0.05, "output_per_m": 0.08, "typical_ms": 900},
+    "llama-3.3-70b-versatile": {"input_per_m": 0.59, "output_per_m": 0.79, "typical_ms": 3000},
+}
+
+# Share of the request budget one call from each node may use (workers run in parallel)
+NODE_BUDGET_SHARE: Dict[str, float] = {
+    "router_node": 0.05,
+    "research_node": 0.15,
+    "orchestrator_node": 0.15,
+    "worker_node": 0.2,
+    "decide_images": 0.05,
+}
+
+# (input, output) tokens per call, used for cost estimates before we have samples
+DEFAULT_TOKENS: Dict[str, Tuple[int, int]] = {
+    "router_node": (400, 150),
+    "research_node": (3000, 800),
+    "orchestrator_node": (1500, 600),
+    "worker_node": (900, 500),
+    "decide_images": (900, 200),
+}
+
+# Requests slower than this fail over to the next model in the chain
+MODEL_TIMEOUT_SECONDS = float(os.getenv("MODEL_TIMEOUT_SECONDS", "60"))
+
+_EWMA_ALPHA = 0.2
+_lock = threading.Lock()
+_observed: Dict[Tuple[str, str], dict] = {}  # (node, model) -> {"ms", "input", "output"} EWMAs
+_clients: Dict[Tuple[str, str], ChatGroq] = {}
+
+
+class _UsageCallback(BaseCallbackHandler):
+    """Records latency, tokens and errors for every chat model call."""
+
+    def __init__(self):
+        self._starts: Dict[str, tuple] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        metadata = metadata or {}
+        self._starts[str(run_id)] = (
+            time.perf_counter(),
+            metadata.get("node", "unknown"),
+            metadata.get("ls_model_name", "unknown"),
+        )
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        start = self._starts.pop(str(run_id), None)
+        if start is None:
+            return
+        t0, node, model = start
+        ms = (time.perf_counter() - t0) * 1000
+
+        input_tokens = output_tokens = 0
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            input_tokens = usage.get("prompt_tokens", 0)
+            output_tokens = usage.get("completion_tokens", 0)
+        elif response.generations and response.generations[0]:
+            message = getattr(response.generations[0][0], "message", None)
+            usage_metadata = getattr(message, "usage_metadata", None) or {}
+            input_tokens = usage_metadata.get("input_tokens", 0)
+            output_tokens = usage_metadata.get("output_tokens", 0)
+
+        record_usage(node, model, ms, input_tokens, output_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        start = self._starts.pop(str(run_id), None)
+        if start is None:
+            return
+        _, node, model = start
+        metrics.incr(f"llm.{node}.{model}.errors")
+
+
+_USAGE = _UsageCallback()
+
+
+def estimate_cost(model: str, input_tokens: float, output_tokens: float) -> float:
+    price = MODELS.get(model, {"input_per_m": 0.0, "output_per_m": 0.0})
+    return (input_tokens * price["input_per_m"] + output_tokens * price["output_per_m"]) / 1_000_000
+
+
+def record_usage(node: str, model: str, ms: float, input_tokens: int, output_tokens: int) -> None:
+    prefix = f"llm.{node}.{model}"
+    metrics.observe_ms(f"{prefix}.latency_ms", ms)
+    metrics.incr(f"{prefix}.calls")
+    metrics.incr(f"{prefix}.input_tokens", input_tokens)
+    metrics.incr(f"{prefix}.output_tokens", output_tokens)
+    metrics.incr(f"{prefix}.cost_usd", estimate_cost(model, input_tokens, output_tokens))
+
+    with _lock:
+        obs = _observed.get((node, model))
+        if obs is None:
+            _observed[(node, model)] = {"ms": ms, "input": input_tokens, "output": output_tokens}
+        else:
+            obs["ms"] += _EWMA_ALPHA * (ms - obs["ms"])
+            obs["input"] += _EWMA_ALPHA * (input_tokens - obs["input"])
+            obs["output"] += _EWMA_ALPHA * (output_tokens - obs["output"])
+
+
+def _expected(node: str, model: str) -> Tuple[float, float, float]:
+    """Expected (latency_ms, input_tokens, output_tokens) for one call."""
+    with _lock:
+        obs = _observed.get((node, model))
+        if obs is not None:
+            return obs["ms"], obs["input"], obs["output"]
+    input_tokens, output_tokens = DEFAULT_TOKENS.get(node, (1000, 500))
+    return MODELS.get(model, {}).get("typical_ms", 1000), input_tokens, output_tokens
+
+
+def select_models(node: str, budget: Optional[dict] = None) -> List[str]:
+    """
+    Pick the model chain for a node under an optional request budget.
+
+    Args:
+        node: Graph node name (e.g. 'worker_node')
+        budget: {"latency_ms": int | None, "cost_usd": float | None} for the whole request
+
+    Returns:
+        Models to try in order; never empty
+    """
+    chain = TIERS[NODE_TIERS.get(node, "fast")]
+    if not budget:
+        return chain
+
+    share = NODE_BUDGET_SHARE.get(node, 0.1)
+    latency_ms = budget.get("latency_ms")
+    cost_usd = budget.get("cost_usd")
+
+    fitting = []
+    for model in chain:
+        expected_ms, input_tokens, output_tokens = _expected(node, model)
+        if latency_ms and expected_ms > latency_ms * share:
+            continue
+        if cost_usd and estimate_cost(model, input_tokens, output_tokens) > cost_usd * share:
+            continue
+        fitting.append(model)
+
+    if not fitting:
+        # Nothing fits: take the cheapest, fastest end of the chain
+        metrics.incr(f"llm.{node}.budget_exhausted")
+        return chain[-1:]
+    if fitting[0] != chain[0]:
+        metrics.incr(f"llm.{node}.downgraded")
+    return fitting
+
+
+def _client(node: str, model: str) -> ChatGroq:
+    key = (node, model)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = ChatGroq(
+                model=model,
+                timeout=MODEL_TIMEOUT_SECONDS,
+                max_retries=1,
+                # Groq's limits are per model and shared by every worker process
+                rate_limiter=coordination.RateLimiter(f"groq:{model}"),
+                callbacks=[_USAGE],
+                metadata={"node": node},
+            )
+            _clients[key] = client
+    return client
+
+
+def get_llm(node: str, budget: Optional[dict] = None):
+    """Chat model for a node: the first selected model with the rest as fallbacks."""
+    models = select_models(node, budget)
+    primary = _client(node, models[0])
+    if len(models) == 1:
+        return primary
+    return primary.with_fallbacks([_client(node, m) for m in models[1:]])
+
+
+def usage_report() -> Dict[str, dict]:
+    """
+    Per-node, per-model usage from metrics.
+
+    Returns:
+        {node: {model: {calls, errors, avg_ms, max_ms, input_tokens, output_tokens, cost_usd}}}
+    """
+    snap = metrics.snapshot()
+    counters, timings = snap["counters"], snap["timings"]
+    report: Dict[str, dict] = {}
+    for name, t in timings.items():
+        if not (name.startswith("llm.") and name.endswith(".latency_ms")):
+            continue
+        node, model = name[len("llm."):-len(".latency_ms")].split(".", 1)
+        prefix = f"llm.{node}.{model}"
+        report.setdefault(node, {})[model] = {
+            "calls": counters.get(f"{prefix}.calls", 0),
+            "errors": counters.get(f"{prefix}.errors", 0),
+            "avg_ms": t["avg_ms"],
+            "max_ms": t["max_ms"],
+            "input_tokens": counters.get(f"{prefix}.input_tokens", 0),
+            "output_tokens": counters.get(f"{prefix}.output_tokens", 0),
+            "cost_usd": round(counters.get(f"{prefix}.cost_usd", 0), 6),
+        }
+    return report
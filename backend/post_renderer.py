@@ -0,0 +1,181 @@
+"""
+Post Rendering
+
+Pre-renders a blog post at upload time so reads don't have to: sanitized HTML
+with heading anchors, a table of contents, and gzip/brotli encodings of both
+the markdown and the HTML. The API serves these renditions byte-for-byte after
+negotiating Accept / Accept-Encoding.
+
+HTML is rendered with markdown-it in its "js-default" preset, which escapes raw
+HTML and rejects javascript:/vbscript:/data: links, so the output is safe to
+inject without a separate sanitizer pass. Both markdown-it-py and brotli are
+optional; without them the corresponding renditions are simply not produced.
+"""
+
+import gzip
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from markdown_it import MarkdownIt
+except ImportError:  # optional dependency
+    MarkdownIt = None
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+# Rendition suffixes stored next to "<stem>.md"
+HTML_SUFFIX = ".html"
+TOC_SUFFIX = ".toc.json"
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+_md = MarkdownIt("js-default") if MarkdownIt is not None else None
+
+
+def post_stem(md_filename: str) -> str:
+    """'blog-title.md' -> 'blog-title'."""
+    return md_filename[:-3] if md_filename.endswith(".md") else md_filename
+
+
+def _slugify(text: str) -> str:
+    slug = re.sub(r"[^\w\s-]", "", text.lower()).strip()
+    return re.sub(r"[\s_-]+", "-", slug) or "section"
+
+
+def render_html(markdown: str) -> Tuple[Optional[str], List[dict]]:
+    """
+    Render markdown to sanitized HTML and extract its table of contents.
+
+    Args:
+        markdown: Post markdown
+
+    Returns:
+        (html, toc) where toc is [{"level", "title", "id"}] for h2/h3 headings;
+        html is None when markdown-it-py is not installed
+    """
+    if _md is None:
+        return None, []
+
+    tokens = _md.parse(markdown)
+    toc, seen = [], {}
+    for i, token in enumerate(tokens):
+        if token.type != "heading_open":
+            continue
+        title = tokens[i + 1].content
+        slug = _slugify(title)
+        seen[slug] = seen.get(slug, 0) + 1
+        if seen[slug] > 1:
+            slug = f"{slug}-{seen[slug]}"
+        token.attrSet("id", slug)
+        level = int(token.tag[1])
+        if level in (2, 3):
+            toc.append({"level": level, "title": title, "id": slug})
+
+    return _md.renderer.render(tokens, _md.options, {}), toc
+
+
+def encode(body: bytes) -> Dict[str, bytes]:
+    """Precompressed encodings of body, keyed by Content-Encoding token."""
+    encoded = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encoded["br"] = brotli.compress(body, quality=11)
+    return encoded
+
+
+def build_renditions(markdown: str, md_filename: str) -> Dict[str, Tuple[bytes, str]]:
+    """
+    Build every stored rendition of a post.
+
+    Args:
+        markdown: Post markdown
+        md_filename: Markdown filename (e.g., 'blog-title.md')
+
+    Returns:
+        {filename: (bytes, content_type)} for the renditions to store next to
+        the markdown, excluding the markdown itself
+    """
+    stem = post_stem(md_filename)
+    bodies = {md_filename: markdown.encode("utf-8")}
+    renditions = {}
+
+    html, toc = render_html(markdown)
+    if html is not None:
+        bodies[stem + HTML_SUFFIX] = html.encode("utf-8")
+        renditions[stem + HTML_SUFFIX] = (bodies[stem + HTML_SUFFIX], "text/html")
+        renditions[stem + TOC_SUFFIX] = (json.dumps(toc).encode("utf-8"), "application/json")
+
+    for name, body in bodies.items():
+        for encoding, data in encode(body).items():
+            renditions[name + ENCODING_SUFFIXES[encoding]] = (data, "application/octet-stream")
+    return renditions
+
+
+def rendition_names(md_filename: str) -> List[str]:
+    """Every filename build_renditions may produce for a post (for cleanup)."""
+    stem = post_stem(md_filename)
+    names = [stem + HTML_SUFFIX, stem + TOC_SUFFIX]
+    for base in (md_filename, stem + HTML_SUFFIX):
+        names += [base + suffix for suffix in ENCODING_SUFFIXES.values()]
+    return names
+
+
+def _parse_header(value: Optional[str]) -> List[Tuple[str, float]]:
+    """Parse an Accept-style header into [(token, q)]."""
+    items = []
+    for part in (value or "").split(","):
+        fields = [f.strip() for f in part.split(";")]
+        if not fields[0]:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        items.append((fields[0].lower(), q))
+    return items
+
+
+def negotiate_media_type(accept: Optional[str]) -> str:
+    """
+    Pick "text/html" or "text/markdown" for an Accept header.
+
+    Markdown wins ties and wildcards so existing clients keep getting markdown.
+    """
+    scores = {"text/markdown": 0.0, "text/html": 0.0}
+    for token, q in _parse_header(accept or "*/*"):
+        for media_type in scores:
+            if token in (media_type, "text/*", "*/*"):
+                # An exact match outranks a wildcard with the same q
+                scores[media_type] = max(scores[media_type], q + (0.001 if token == media_type else 0))
+    return "text/html" if scores["text/html"] > scores["text/markdown"] else "text/markdown"
+
+
+def negotiate_encoding(accept_encoding: Optional[str], available: List[str]) -> Optional[str]:
+    """
+    Pick the best available Content-Encoding ("br", "gzip") or None for identity.
+
+    Args:
+        accept_encoding: Accept-Encoding request header
+        available: Encodings that have a stored rendition
+    """
+    best, best_q = None, 0.0
+    wildcard_q = None
+    explicit = {}
+    for token, q in _parse_header(accept_encoding):
+        if token == "*":
+            wildcard_q = q
+        else:
+            explicit[token] = q
+    # Prefer brotli over gzip at equal q (smaller payload)
+    for encoding in ("br", "gzip"):
+        if encoding not in available:
+            continue
+        q = explicit.get(encoding, wildcard_q or 0.0)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
@@ -0,0 +1,215 @@
+"""
+Local Pre-Router
+
+Decides obvious routing cases without an LLM call: keyword / temporal-pattern
+rules for clearly evergreen or clearly news-like topics, plus a cache of past
+router decisions keyed by normalized topic. Whenever the LLM router does run,
+its decision is compared with the rule guess so the confidence threshold can
+be tuned from measured precision.
+"""
+
+import json
+import os
+import random
+import re
+import threading
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, List, Optional
+
+import coordination
+import metrics
+
+# Rules: (pattern, mode, weight). Weights are combined per mode with noisy-OR.
+RULES = [
+    # Clearly evergreen
+    (r"^(what|how|why) (is|are|does|do)\b", "closed_book", 0.9),
+    (r"\b(explained|explainer|introduction to|intro to|basics of|fundamentals)\b", "closed_book", 0.85),
+    (r"\b(difference between|vs\.?|versus|compared to)\b", "closed_book", 0.6),
+    (r"\b(how to|tutorial|guide to|beginner'?s?|step by step)\b", "closed_book", 0.7),
+    (r"\b(algorithm|data structure|design pattern|theorem|protocol)s?\b", "closed_book", 0.5),
+    # Clearly news-like
+    (r"\b(this|last|past) (week|month)\b", "open_book", 0.95),
+    (r"\b(today|yesterday|breaking|this morning)\b", "open_book", 0.9),
+    (r"\b(news|roundup|round-up|weekly|recap|headlines)\b", "open_book", 0.85),
+    (r"\b(announced?|announcements?|launch(ed|es)?|released?|funding|acquisitions?)\b", "open_book", 0.6),
+    (r"\b(pricing|price changes?|policy|regulations?|lawsuits?)\b", "open_book", 0.6),
+    (r"\blatest\b", "open_book", 0.5),
+    # Evergreen core with recent examples
+    (r"\b(best|top \d+|state of|trends?|landscape|future of)\b", "hybrid", 0.7),
+    (r"\b(tools|frameworks|libraries|models|platforms|providers)\b", "hybrid", 0.5),
+    (r"\b(19|20)\d{2}\b", "hybrid", 0.5),
+]
+_COMPILED = [(re.compile(p, re.IGNORECASE), mode, w) for p, mode, w in RULES]
+
+MIN_CONFIDENCE = float(os.getenv("PREROUTER_MIN_CONFIDENCE", "0.85"))
+# Fraction of confident rule decisions still sent to the LLM to keep measuring precision
+SHADOW_RATE = float(os.getenv("PREROUTER_SHADOW_RATE", "0.05"))
+CACHE_PATH = os.getenv("PREROUTER_CACHE_PATH", ".prerouter_cache.json")
+CACHE_TTL_DAYS = int(os.getenv("PREROUTER_CACHE_TTL_DAYS", "30"))
+# open_book decisions carry date-specific queries ("... last 7 days", "... <month>"),
+# so they go stale much sooner than the mode itself
+OPEN_BOOK_CACHE_TTL_DAYS = int(os.getenv("PREROUTER_OPEN_BOOK_CACHE_TTL_DAYS", "1"))
+
+# Confidence buckets used for precision-by-threshold reporting
+BUCKETS = [0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95]
+
+
+@dataclass
+class Guess:
+    mode: Optional[str]
+    confidence: float
+    reason: str
+    scores: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def confident(self) -> bool:
+        return self.mode is not None and self.confidence >= MIN_CONFIDENCE
+
+
+def normalize_topic(topic: str) -> str:
+    s = topic.strip().lower()
+    s = re.sub(r"[^a-z0-9 ]+", " ", s)
+    return re.sub(r"\s+", " ", s).strip()
+
+
+def classify(topic: str) -> Guess:
+    """
+    Score a topic against the rules.
+
+    Confidence is the margin between the best and second-best mode, so topics
+    that trigger both evergreen and news rules fall through to the LLM.
+    """
+    miss = {"closed_book": 1.0, "hybrid": 1.0, "open_book": 1.0}
+    matched: List[str] = []
+    for pattern, mode, weight in _COMPILED:
+        m = pattern.search(topic)
+        if m:
+            miss[mode] *= 1 - weight
+            matched.append(f"{mode}:{m.group(0).strip()}")
+
+    scores = {mode: round(1 - p, 4) for mode, p in miss.items()}
+    ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+    (best_mode, best), (_, second) = ranked[0], ranked[1]
+    if best == 0:
+        return Guess(mode=None, confidence=0.0, reason="no rule matched", scores=scores)
+    return Guess(
+        mode=best_mode,
+        confidence=round(best - second, 4),
+        reason="pre-router rules: " + ", ".join(matched),
+        scores=scores,
+    )
+
+
+def rule_decision(topic: str, as_of: str, guess: Guess) -> dict:
+    """Build a RouterDecision-shaped dict from a confident rule guess."""
+    if guess.mode == "closed_book":
+        queries: List[str] = []
+    else:
+        month = as_of[:7]
+        if guess.mode == "open_book":
+            queries = [topic, f"{topic} news last 7 days", f"{topic} {month}"]
+        else:
+            queries = [topic, f"{topic} recent examples", f"{topic} {as_of[:4]}"]
+    return {
+        "needs_research": guess.mode != "closed_book",
+        "mode": guess.mode,
+        "reason": guess.reason,
+        "queries": queries,
+        "max_results_per_query": 3,
+    }
+
+
+def should_shadow() -> bool:
+    return random.random() < SHADOW_RATE
+
+
+# -----------------------------
+# Decision cache
+# -----------------------------
+_lock = threading.Lock()
+_cache: Optional[Dict[str, dict]] = None
+
+
+def _load() -> Dict[str, dict]:
+    global _cache
+    if _cache is None:
+        try:
+            with open(CACHE_PATH, "r", encoding="utf-8") as f:
+                _cache = json.load(f)
+        except (OSError, ValueError):
+            _cache = {}
+    return _cache
+
+
+def _age_days(cached_as_of: str, as_of: str) -> int:
+    try:
+        return abs((date.fromisoformat(as_of[:10]) - date.fromisoformat(cached_as_of[:10])).days)
+    except ValueError:
+        return CACHE_TTL_DAYS + 1
+
+
+def cached_decision(topic: str, as_of: str) -> Optional[dict]:
+    """Return a past decision for the same normalized topic, if still fresh."""
+    if coordination.enabled():
+        # Shared by every worker process; freshness is still judged by as_of
+        entry = coordination.cache_get("prerouter", normalize_topic(topic))
+    else:
+        with _lock:
+            entry = _load().get(normalize_topic(topic))
+    if not entry:
+        return None
+    ttl = OPEN_BOOK_CACHE_TTL_DAYS if entry["decision"].get("mode") == "open_book" else CACHE_TTL_DAYS
+    if _age_days(entry["as_of"], as_of) > ttl:
+        return None
+    return entry["decision"]
+
+
+def store_decision(topic: str, as_of: str, decision: dict) -> None:
+    if coordination.enabled():
+        coordination.cache_set("prerouter", normalize_topic(topic), {"as_of": as_of, "decision": decision})
+        return
+    with _lock:
+        cache = _load()
+        cache[normalize_topic(topic)] = {"as_of": as_of, "decision": decision}
+        try:
+            with open(CACHE_PATH, "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+        except OSError as e:
+            print(f"Error saving pre-router cache: {e}")
+
+
+# -----------------------------
+# Precision tracking
+# -----------------------------
+def record_llm_decision(guess: Guess, llm_mode: str) -> None:
+    """Compare a rule guess with the LLM's decision for the same topic."""
+    if guess.mode is None:
+        metrics.incr("prerouter.no_rule")
+        return
+    agree = 1 if guess.mode == llm_mode else 0
+    metrics.incr("prerouter.compared")
+    metrics.incr("prerouter.agreed", agree)
+    for b in BUCKETS:
+        if guess.confidence >= b:
+            metrics.incr(f"prerouter.compared.ge_{b}")
+            metrics.incr(f"prerouter.agreed.ge_{b}", agree)
+
+
+def precision_report() -> Dict[str, dict]:
+    """
+    Precision of rule decisions against the LLM, per confidence threshold.
+
+    Returns:
+        {"threshold": MIN_CONFIDENCE, "by_threshold": {"0.9": {"compared", "precision"}, ...}}
+    """
+    counters = metrics.snapshot()["counters"]
+    by_threshold = {}
+    for b in BUCKETS:
+        compared = counters.get(f"prerouter.compared.ge_{b}", 0)
+        agreed = counters.get(f"prerouter.agreed.ge_{b}", 0)
+        by_threshold[str(b)] = {
+            "compared": compared,
+            "precision": round(agreed / compared, 4) if compared else None,
+        }
+    return {"threshold": MIN_CONFIDENCE, "by_threshold": by_threshold}
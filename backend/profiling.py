@@ -0,0 +1,310 @@
+"""
+Run Profiling
+
+Opt-in CPU and memory profiling of graph runs, to find where long-running API
+workers spend time and keep memory (accumulated State, fanned-out Send payloads,
+image bytes, LangGraph internals).
+
+- CPU: a background thread samples the stacks of threads currently executing a
+  graph node (sys._current_frames) and counts them per run and per node. The
+  samples are wall-clock, so time blocked on providers shows up as waits.
+- Memory: tracemalloc snapshots at run start and end; the top allocation sites
+  that grew during the run are attached to its record. Each node also records
+  the traced-memory delta across its call and the approximate size of the
+  state update it returned.
+
+Overhead is bounded: profiling only runs while enabled (at startup with
+PROFILING=true, or through the admin endpoint) and switches itself off after
+a time limit, only a share of runs is profiled, stacks are truncated, and
+only the most recent run records are kept.
+"""
+
+import functools
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from pydantic import BaseModel
+
+import metrics
+
+PROFILING = os.getenv("PROFILING", "false").lower() == "true"
+SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "10"))
+RUN_SAMPLE_RATE = float(os.getenv("PROFILE_RUN_SAMPLE_RATE", "1.0"))
+MAX_DURATION_S = float(os.getenv("PROFILE_MAX_DURATION_S", "3600"))
+TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "1"))
+MAX_RECORDS = int(os.getenv("PROFILE_MAX_RECORDS", "20"))
+TOP_N = 15
+_STACK_DEPTH = 24
+
+_lock = threading.Lock()
+_enabled_until: Optional[float] = None  # monotonic deadline while enabled
+_settings = {"sample_interval_ms": SAMPLE_INTERVAL_MS, "run_sample_rate": RUN_SAMPLE_RATE}
+_sampler_stop: Optional[threading.Event] = None  # set to stop the current sampler thread
+_sampler_busy_s = 0.0  # time spent taking samples, for the overhead estimate
+_enabled_at = 0.0
+
+_runs: Dict[str, "_RunProfile"] = {}  # run_id -> profile of a run in progress
+_threads: Dict[int, tuple] = {}  # thread ident -> (run_id, node) while a node runs
+_records: deque = deque(maxlen=MAX_RECORDS)
+
+
+class _NodeProfile:
+    def __init__(self):
+        self.calls = 0
+        self.wall_ms = 0.0
+        self.samples = 0
+        self.functions: Counter = Counter()
+        self.mem_delta_kb = 0.0
+        self.update_kb = 0.0
+
+
+class _RunProfile:
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self.nodes: Dict[str, _NodeProfile] = {}
+        self.snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        self.traced_start = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+
+def enabled() -> bool:
+    with _lock:
+        return _enabled_until is not None and time.monotonic() < _enabled_until
+
+
+def start(
+    duration_s: float = 300,
+    sample_interval_ms: Optional[float] = None,
+    run_sample_rate: Optional[float] = None,
+) -> dict:
+    """
+    Turn profiling on for new runs.
+
+    Args:
+        duration_s: Profiling switches itself off after this long (capped at PROFILE_MAX_DURATION_S)
+        sample_interval_ms: CPU stack sampling interval (at least 1 ms)
+        run_sample_rate: Share of runs to profile (0-1)
+
+    Returns:
+        Current profiling status
+    """
+    global _enabled_until, _sampler_stop, _enabled_at, _sampler_busy_s
+    with _lock:
+        if sample_interval_ms is not None:
+            _settings["sample_interval_ms"] = max(1.0, sample_interval_ms)
+        if run_sample_rate is not None:
+            _settings["run_sample_rate"] = min(1.0, max(0.0, run_sample_rate))
+        if _enabled_until is None:
+            _enabled_at = time.monotonic()
+            _sampler_busy_s = 0.0
+        _enabled_until = time.monotonic() + min(max(duration_s, 1), MAX_DURATION_S)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        if _sampler_stop is None:
+            _sampler_stop = threading.Event()
+            threading.Thread(target=_sample_loop, args=(_sampler_stop,), name="profiler", daemon=True).start()
+    print(f"🔬 Profiling enabled for {min(max(duration_s, 1), MAX_DURATION_S):.0f}s")
+    return status()
+
+
+def stop() -> dict:
+    """Turn profiling off; runs in progress finish without further samples."""
+    global _enabled_until, _sampler_stop
+    with _lock:
+        _enabled_until = None
+        if _sampler_stop is not None:
+            _sampler_stop.set()
+            _sampler_stop = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+    print("🔬 Profiling disabled")
+    return status()
+
+
+def status() -> dict:
+    with _lock:
+        on = _enabled_until is not None and time.monotonic() < _enabled_until
+        elapsed = time.monotonic() - _enabled_at if on else 0.0
+        return {
+            "enabled": on,
+            "remaining_s": round(_enabled_until - time.monotonic(), 1) if on else 0,
+            **_settings,
+            "tracemalloc": tracemalloc.is_tracing(),
+            "runs_in_progress": len(_runs),
+            "records": len(_records),
+            # Share of one core spent sampling stacks
+            "sampler_overhead_pct": round(100 * _sampler_busy_s / elapsed, 3) if elapsed else 0.0,
+        }
+
+
+def records() -> List[dict]:
+    """Recent run profiles, newest first (summaries without stacks)."""
+    with _lock:
+        return [{k: v for k, v in r.items() if k not in ("stacks", "top_allocators")} for r in reversed(_records)]
+
+
+def get_record(run_id: str) -> Optional[dict]:
+    with _lock:
+        for r in _records:
+            if r["run_id"] == run_id:
+                return r
+    return None
+
+
+def _sample_loop(stop_event: threading.Event) -> None:
+    global _sampler_busy_s
+    while not stop_event.wait(_settings["sample_interval_ms"] / 1000):
+        if not enabled():
+            # Time limit reached: switch off (unless profiling was restarted meanwhile)
+            if not stop_event.is_set():
+                stop()
+            return
+        t0 = time.perf_counter()
+        frames = sys._current_frames()
+        with _lock:
+            for ident, (run_id, node) in list(_threads.items()):
+                frame = frames.get(ident)
+                run = _runs.get(run_id)
+                if frame is None or run is None:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < _STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                run.samples += 1
+                run.stacks[";".join(reversed(stack))] += 1
+                node_profile = run.nodes.setdefault(node, _NodeProfile())
+                node_profile.samples += 1
+                node_profile.functions[stack[0]] += 1
+            _sampler_busy_s += time.perf_counter() - t0
+        del frames
+
+
+@contextmanager
+def run(run_id: str):
+    """Profile one graph run (when profiling is on and the run is sampled)."""
+    if not enabled() or random.random() >= _settings["run_sample_rate"]:
+        yield
+        return
+    profile = _RunProfile(run_id)
+    with _lock:
+        _runs[run_id] = profile
+    try:
+        yield
+    finally:
+        with _lock:
+            _runs.pop(run_id, None)
+        record = _finish(profile)
+        with _lock:
+            _records.append(record)
+        metrics.incr("profiling.runs")
+
+
+def _finish(profile: _RunProfile) -> dict:
+    interval = _settings["sample_interval_ms"]
+    record = {
+        "run_id": profile.run_id,
+        "started_at": profile.started_at,
+        "duration_ms": round((time.perf_counter() - profile.start) * 1000, 1),
+        "cpu_samples": profile.samples,
+        "sample_interval_ms": interval,
+        "nodes": {
+            name: {
+                "calls": n.calls,
+                "wall_ms": round(n.wall_ms, 1),
+                "cpu_samples": n.samples,
+                "mem_delta_kb": round(n.mem_delta_kb, 1),
+                "update_kb": round(n.update_kb, 1),
+                "top_functions": n.functions.most_common(5),
+            }
+            for name, n in profile.nodes.items()
+        },
+        "stacks": profile.stacks.most_common(TOP_N * 2),
+    }
+    if profile.snapshot is not None and tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        end = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ])
+        record["memory"] = {
+            "traced_start_kb": round(profile.traced_start / 1024, 1),
+            "traced_end_kb": round(current / 1024, 1),
+            "traced_peak_kb": round(peak / 1024, 1),
+        }
+        record["top_allocators"] = [
+            {
+                "where": str(stat.traceback),
+                "size_diff_kb": round(stat.size_diff / 1024, 1),
+                "size_kb": round(stat.size / 1024, 1),
+                "count_diff": stat.count_diff,
+            }
+            for stat in end.compare_to(profile.snapshot, "lineno")[:TOP_N]
+        ]
+    return record
+
+
+def _approx_size(obj, depth: int = 0) -> int:
+    """Rough deep size of a state update (containers, strings, bytes, pydantic models)."""
+    if depth > 6:
+        return 0
+    if isinstance(obj, (str, bytes, bytearray)):
+        return len(obj)
+    if isinstance(obj, BaseModel):
+        return _approx_size(obj.__dict__, depth + 1)
+    if isinstance(obj, dict):
+        return sum(_approx_size(k, depth + 1) + _approx_size(v, depth + 1) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set)):
+        return sum(_approx_size(v, depth + 1) for v in obj)
+    return sys.getsizeof(obj)
+
+
+def node(name: str, fn: Callable) -> Callable:
+    """Wrap a graph node so its CPU samples, memory and update size are attributed to it."""
+
+    @functools.wraps(fn)
+    def wrapper(state):
+        run_id = state.get("run_id") if isinstance(state, dict) else None
+        with _lock:
+            profile = _runs.get(run_id)
+        if profile is None:
+            return fn(state)
+
+        ident = threading.get_ident()
+        tracing = tracemalloc.is_tracing()
+        mem_before = tracemalloc.get_traced_memory()[0] if tracing else 0
+        start = time.perf_counter()
+        with _lock:
+            _threads[ident] = (run_id, name)
+        try:
+            result = fn(state)
+        finally:
+            with _lock:
+                _threads.pop(ident, None)
+        # Concurrent nodes share the process-wide counter, so the delta is approximate
+        mem_after = tracemalloc.get_traced_memory()[0] if tracing and tracemalloc.is_tracing() else mem_before
+        update_kb = _approx_size(result) / 1024
+        with _lock:
+            node_profile = profile.nodes.setdefault(name, _NodeProfile())
+            node_profile.calls += 1
+            node_profile.wall_ms += (time.perf_counter() - start) * 1000
+            node_profile.mem_delta_kb += (mem_after - mem_before) / 1024
+            node_profile.update_kb += update_kb
+        return result
+
+    return wrapper
+
+
+if PROFILING:
+    start(duration_s=MAX_DURATION_S)
@@ -0,0 +1,397 @@
+"""
+Post Search Index
+
+An inverted index over blog posts, scored with BM25 across title, headings and
+body text (title and heading terms are weighted up). It is kept in two layers:
+
+- A base segment on disk: doc table, term dictionary and postings (doc ids as
+  uint32, weighted term frequencies as uint16), memory-mapped at load so
+  postings are read straight from the page cache.
+- An in-memory delta of posts added or removed since the segment was written,
+  backed by an append-only journal so it survives restarts.
+
+upload_markdown / delete_blog_post update the delta; once the journal grows
+past SEARCH_INDEX_COMPACT_AFTER entries, a background thread merges it into a
+new segment.
+
+Worker processes share the directory: appends and segment swaps happen under
+a file lock, and each process replays entries the others appended (or reloads
+after another process's compaction) before reading or writing.
+"""
+
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import coordination
+import metrics
+
+SEARCH_INDEX_DIR = os.getenv("SEARCH_INDEX_DIR", ".search_index")
+SEARCH_INDEX_COMPACT_AFTER = int(os.getenv("SEARCH_INDEX_COMPACT_AFTER", "256"))
+
+# Integer weights keep weighted term frequencies integral (stored as uint16)
+FIELD_WEIGHTS = {"title": 3, "headings": 2, "body": 1}
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_MAGIC = b"BM25SEG1"
+_HEADER = struct.Struct("<8sQ")  # magic, meta length
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+_URL_RE = re.compile(r"\]\([^)]*\)|https?://\S+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how in into is it its of on or that the their "
+    "this to was were what when which while who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without stopwords or one-letter tokens."""
+    return [t for t in _TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in _STOPWORDS]
+
+
+def analyze(markdown: str) -> Tuple[str, float, Dict[str, int]]:
+    """
+    Split a post into fields and compute its weighted term frequencies.
+
+    Returns:
+        (title, weighted length, {term: weighted tf})
+    """
+    title, headings, body = "", [], []
+    for line in _URL_RE.sub("]", markdown).splitlines():
+        if line.startswith("# ") and not title:
+            title = line[2:].strip()
+        elif line.startswith("#"):
+            headings.append(line.lstrip("#"))
+        else:
+            body.append(line)
+
+    tf: Dict[str, int] = {}
+    length = 0.0
+    for field, text in (("title", title), ("headings", " ".join(headings)), ("body", " ".join(body))):
+        weight = FIELD_WEIGHTS[field]
+        for term, count in Counter(tokenize(text)).items():
+            tf[term] = tf.get(term, 0) + weight * count
+            length += weight * count
+    return title, length, tf
+
+
+class _Segment:
+    """Read-only, memory-mapped base segment."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, meta_len = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a search segment")
+        meta = json.loads(self._mm[_HEADER.size:_HEADER.size + meta_len])
+        self._data = _align(_HEADER.size + meta_len)
+
+        self.docs: List[list] = meta["docs"]  # [filename, title, indexed_at] (no indexed_at in older segments)
+        self.terms: Dict[str, List[int]] = meta["terms"]  # term -> [offset, df]
+        self.doc_len = np.frombuffer(self._mm, np.float32, len(self.docs), self._data)
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        entry = self.terms.get(term)
+        if entry is None:
+            return np.empty(0, np.uint32), np.empty(0, np.uint16)
+        offset, df = entry
+        start = self._data + offset
+        ids = np.frombuffer(self._mm, np.uint32, df, start)
+        tfs = np.frombuffer(self._mm, np.uint16, df, start + 4 * df)
+        return ids, tfs
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def _write_segment(path: str, docs: List[Tuple[str, str, float, float]], postings: Dict[str, List[Tuple[int, int]]]) -> None:
+    """Write a segment file atomically. docs are (filename, title, length, indexed_at)."""
+    doc_len = np.array([d[2] for d in docs], np.float32).tobytes()
+    blobs, terms, offset = [], {}, _align(len(doc_len))
+    for term in sorted(postings):
+        plist = sorted(postings[term])
+        ids = np.array([p[0] for p in plist], np.uint32).tobytes()
+        tfs = np.array([min(p[1], 65535) for p in plist], np.uint16).tobytes()
+        blob = ids + tfs + b"\0" * (len(plist) % 2) * 2  # keep the next term 4-byte aligned
+        terms[term] = [offset, len(plist)]
+        blobs.append(blob)
+        offset += len(blob)
+
+    meta = json.dumps({"docs": [[d[0], d[1], d[3]] for d in docs], "terms": terms}, separators=(",", ":")).encode("utf-8")
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, len(meta)))
+        f.write(meta)
+        f.write(b"\0" * (_align(_HEADER.size + len(meta)) - _HEADER.size - len(meta)))
+        f.write(doc_len)
+        f.write(b"\0" * (_align(len(doc_len)) - len(doc_len)))
+        for blob in blobs:
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class SearchIndex:
+    """BM25 index: memory-mapped base segment plus a journaled in-memory delta."""
+
+    def __init__(self, directory: str = SEARCH_INDEX_DIR):
+        self.directory = directory
+        self.segment_path = os.path.join(directory, "segment.bin")
+        self.journal_path = os.path.join(directory, "journal.jsonl")
+        self._lock = threading.Lock()
+        self._compacting = False
+        os.makedirs(directory, exist_ok=True)
+
+        with self._lock, coordination.file_lock(self.journal_path):
+            open(self.journal_path, "ab").close()
+            self._reload()
+
+    def _generation(self) -> Tuple[int, int]:
+        """Changes whenever a compaction swaps the segment and journal (inodes alone can be reused)."""
+        try:
+            segment_mtime = os.stat(self.segment_path).st_mtime_ns
+        except FileNotFoundError:
+            segment_mtime = 0
+        return os.stat(self.journal_path).st_ino, segment_mtime
+
+    def _reload(self) -> None:
+        """Load the segment and the whole journal from disk. Both locks held."""
+        self._generation_id = self._generation()
+        self._journal_pos = 0
+        self._ops: List[dict] = []
+        self._load(_Segment(self.segment_path) if os.path.exists(self.segment_path) else None)
+        self._catch_up()
+
+    def _catch_up(self) -> None:
+        """Apply journal entries other processes appended since the last read. Both locks held."""
+        if self._generation() != self._generation_id:
+            # Another process compacted: the segment and journal were both replaced
+            self._reload()
+            return
+        if os.path.getsize(self.journal_path) == self._journal_pos:
+            return
+        with open(self.journal_path, "rb") as f:
+            f.seek(self._journal_pos)
+            data = f.read()
+        for line in data.splitlines():
+            if line.strip():
+                op = json.loads(line)
+                self._apply(op)
+                self._ops.append(op)
+        self._journal_pos += len(data)
+
+    def _load(self, base: Optional[_Segment]) -> None:
+        """Install a base segment and replay the journal on top of it."""
+        self._base = base
+        self._base_ids = {doc[0]: i for i, doc in enumerate(base.docs)} if base else {}
+        self._alive = np.ones(len(self._base_ids), bool)
+        self._base_total = float(base.doc_len.sum()) if base else 0.0
+        self._delta: Dict[str, Tuple[str, float, Dict[str, int], float]] = {}  # title, len, tf, indexed_at
+        for op in self._ops:
+            self._apply(op)
+
+    def _apply(self, op: dict) -> None:
+        name = op["name"]
+        idx = self._base_ids.get(name)
+        if idx is not None and self._alive[idx]:
+            self._alive[idx] = False
+            self._base_total -= float(self._base.doc_len[idx])
+        self._delta.pop(name, None)
+        if op["op"] == "add":
+            self._delta[name] = (op["title"], op["len"], op["tf"], op.get("at", 0.0))
+
+    def _record(self, op: dict) -> None:
+        # Every worker process appends to the same journal
+        with self._lock, coordination.file_lock(self.journal_path):
+            self._catch_up()
+            self._apply(op)
+            self._ops.append(op)
+            with open(self.journal_path, "ab") as f:
+                f.write(json.dumps(op, separators=(",", ":")).encode("utf-8") + b"\n")
+                self._journal_pos = f.tell()
+            compact = len(self._ops) >= SEARCH_INDEX_COMPACT_AFTER and not self._compacting
+            if compact:
+                self._compacting = True
+        if compact:
+            threading.Thread(target=self.compact, name="search-compact", daemon=True).start()
+
+    def add(self, filename: str, markdown: str) -> None:
+        """Index (or re-index) a post."""
+        title, length, tf = analyze(markdown)
+        self._record({"op": "add", "name": filename, "title": title, "len": length, "tf": tf, "at": time.time()})
+
+    def remove(self, filename: str) -> None:
+        """Drop a post from the index."""
+        self._record({"op": "remove", "name": filename})
+
+    def _snapshot(self) -> Tuple[int, int]:
+        """Generation and journal length the next segment will cover."""
+        with self._lock, coordination.file_lock(self.journal_path, shared=True):
+            self._catch_up()
+            return self._generation_id, self._journal_pos
+
+    def rebuild(self, posts: Iterable[Tuple[str, str]]) -> None:
+        """Replace the whole index with posts [(filename, markdown)]."""
+        snapshot = self._snapshot()  # updates that land meanwhile are kept
+        indexed_at = time.time()
+        docs, postings = [], {}
+        for filename, markdown in posts:
+            title, length, tf = analyze(markdown)
+            _add_postings(docs, postings, filename, title, length, tf, indexed_at)
+        if not self._install(docs, postings, snapshot):
+            print("🔎 Search index was replaced by another process during the rebuild; keeping theirs")
+
+    def compact(self) -> None:
+        """Merge the journal into a new base segment."""
+        try:
+            with self._lock, coordination.file_lock(self.journal_path, shared=True):
+                self._catch_up()
+                base, alive, delta = self._base, self._alive.copy(), dict(self._delta)
+                snapshot = self._generation_id, self._journal_pos
+
+            docs, postings = [], {}
+            if base is not None:
+                remap = {}
+                for i in np.flatnonzero(alive):
+                    remap[int(i)] = len(docs)
+                    doc = base.docs[i]
+                    docs.append((doc[0], doc[1], float(base.doc_len[i]), doc[2] if len(doc) > 2 else 0.0))
+                for term in base.terms:
+                    ids, tfs = base.postings(term)
+                    kept = [(remap[i], tf) for i, tf in zip(ids.tolist(), tfs.tolist()) if i in remap]
+                    if kept:
+                        postings[term] = kept
+            for filename, (title, length, tf, indexed_at) in delta.items():
+                _add_postings(docs, postings, filename, title, length, tf, indexed_at)
+
+            if self._install(docs, postings, snapshot):
+                metrics.incr("search.compactions")
+        finally:
+            self._compacting = False
+
+    def _install(self, docs: list, postings: dict, snapshot: Tuple[int, int]) -> bool:
+        """
+        Swap in a segment covering the journal up to snapshot, keeping newer entries.
+
+        Returns:
+            False (nothing changed) if another process replaced the segment since the snapshot
+        """
+        generation, journal_pos = snapshot
+        staged = f"{self.segment_path}.{os.getpid()}.new"
+        _write_segment(staged, docs, postings)
+        with self._lock, coordination.file_lock(self.journal_path):
+            if self._generation() != generation:
+                os.remove(staged)
+                self._catch_up()
+                return False
+            with open(self.journal_path, "rb") as f:
+                f.seek(journal_pos)
+                newer = f.read()
+            # The open segment stays readable through its mmap after os.replace. A
+            # crash between the two replaces only replays already-merged entries,
+            # which leaves the same state
+            os.replace(staged, self.segment_path)
+            tmp = self.journal_path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(newer)
+            os.replace(tmp, self.journal_path)
+            self._reload()
+        return True
+
+    def indexed(self) -> Dict[str, float]:
+        """Indexed posts with the time each was indexed (0 when unknown)."""
+        with self._lock, coordination.file_lock(self.journal_path, shared=True):
+            self._catch_up()
+            out = {}
+            if self._base is not None:
+                for i in np.flatnonzero(self._alive):
+                    doc = self._base.docs[i]
+                    out[doc[0]] = doc[2] if len(doc) > 2 else 0.0
+            out.update((name, d[3]) for name, d in self._delta.items())
+            return out
+
+    def __len__(self) -> int:
+        with self._lock, coordination.file_lock(self.journal_path, shared=True):
+            self._catch_up()
+            return int(self._alive.sum()) + len(self._delta)
+
+    def search(self, query: str, limit: int = 10) -> List[dict]:
+        """
+        BM25 search.
+
+        Args:
+            query: Free-text query
+            limit: Maximum number of results
+
+        Returns:
+            [{"filename", "title", "score"}] best first
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock, coordination.file_lock(self.journal_path, shared=True):
+            self._catch_up()
+            base, alive, delta = self._base, self._alive, self._delta
+            n_docs = int(alive.sum()) + len(delta)
+            if not terms or n_docs == 0:
+                return []
+            avgdl = (self._base_total + sum(d[1] for d in delta.values())) / n_docs or 1.0
+
+            base_scores = np.zeros(len(alive), np.float32) if base is not None else None
+            delta_scores: Dict[str, float] = {}
+            for term in terms:
+                ids, tfs = base.postings(term) if base is not None else (np.empty(0, np.uint32), None)
+                delta_hits = [(name, d[1], d[2][term]) for name, d in delta.items() if term in d[2]]
+                df = int(alive[ids].sum()) + len(delta_hits)
+                if df == 0:
+                    continue
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                if len(ids):
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * base.doc_len[ids] / avgdl)
+                    tfs = tfs.astype(np.float32)
+                    base_scores[ids] += idf * tfs * (BM25_K1 + 1) / (tfs + norm)
+                for name, length, tf in delta_hits:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avgdl)
+                    delta_scores[name] = delta_scores.get(name, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+            hits = [(score, name, delta[name][0]) for name, score in delta_scores.items()]
+            if base_scores is not None and len(base_scores):
+                base_scores[~alive] = 0
+                top = np.argpartition(-base_scores, min(limit, len(base_scores) - 1))[:limit]
+                hits += [(float(base_scores[i]), base.docs[i][0], base.docs[i][1]) for i in top if base_scores[i] > 0]
+
+        hits.sort(key=lambda h: h[0], reverse=True)
+        return [{"filename": name, "title": title, "score": round(score, 4)} for score, name, title in hits[:limit]]
+
+
+def _add_postings(
+    docs: list, postings: dict, filename: str, title: str, length: float, tf: Dict[str, int], indexed_at: float
+) -> None:
+    doc_id = len(docs)
+    docs.append((filename, title, length, indexed_at))
+    for term, weight in tf.items():
+        postings.setdefault(term, []).append((doc_id, weight))
+
+
+_index: Optional[SearchIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> SearchIndex:
+    """Process-wide index, loaded on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SearchIndex()
+        return _index
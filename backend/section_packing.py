@@ -0,0 +1,106 @@
+"""
+Packed Section Writing
+
+Every worker request repeats WORKER_SYSTEM, the blog header and the evidence
+list, and costs a request slot against the provider's rate limits. For short
+sections it is cheaper to write several in one request: the tasks are packed
+into groups whose estimated output fits one response, the model marks each
+section with a delimiter line, and the response is split back into
+(task_id, section_md) tuples. A response that doesn't split cleanly is
+rejected so the caller can fall back to one request per task.
+
+Token counts are estimated (about 4 characters per token, about 1.35 tokens per
+word of output); they only need to be good enough to choose a mode.
+"""
+
+import os
+import re
+from typing import Dict, Iterable, List, Optional
+
+# off: one request per task | auto: pack short sections when estimates allow
+WORKER_PACKING = os.getenv("WORKER_PACKING", "off").lower()
+# Sections longer than this are always written on their own
+PACK_MAX_SECTION_WORDS = int(os.getenv("PACK_MAX_SECTION_WORDS", "450"))
+# Estimated output budget of one packed response
+PACK_MAX_OUTPUT_TOKENS = int(os.getenv("PACK_MAX_OUTPUT_TOKENS", "2400"))
+PACK_MAX_TASKS = int(os.getenv("PACK_MAX_TASKS", "4"))
+
+TOKENS_PER_WORD = 1.35
+_CHARS_PER_TOKEN = 4
+
+DELIMITER = "===SECTION {id}==="
+_DELIMITER_RE = re.compile(r"^\s*===\s*SECTION\s+(\d+)\s*===\s*$", re.MULTILINE)
+
+PACKED_INSTRUCTIONS = """You are writing SEVERAL sections of the same post in one response.
+For each section below, in the order given:
+- First output the delimiter line exactly as shown for that section (e.g. ===SECTION 2===).
+- Then output only that section's markdown, starting with "## <Section Title>".
+Do not output anything before the first delimiter or after the last section.
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // _CHARS_PER_TOKEN)
+
+
+def output_tokens(target_words: int) -> int:
+    return int(target_words * TOKENS_PER_WORD)
+
+
+def plan_packs(tasks: Iterable, max_output_tokens: int = PACK_MAX_OUTPUT_TOKENS) -> List[List]:
+    """
+    Group tasks into requests.
+
+    Short tasks (target_words <= PACK_MAX_SECTION_WORDS) are packed greedily, in
+    id order, while the estimated output fits max_output_tokens; long tasks and
+    packs of one stay single requests.
+
+    Args:
+        tasks: Task models (need id and target_words)
+        max_output_tokens: Estimated output budget per packed request
+
+    Returns:
+        Groups of tasks, one request each
+    """
+    groups: List[List] = []
+    pack: List = []
+    pack_tokens = 0
+    for task in sorted(tasks, key=lambda t: t.id):
+        tokens = output_tokens(task.target_words)
+        if task.target_words > PACK_MAX_SECTION_WORDS:
+            groups.append([task])
+            continue
+        if pack and (pack_tokens + tokens > max_output_tokens or len(pack) >= PACK_MAX_TASKS):
+            groups.append(pack)
+            pack, pack_tokens = [], 0
+        pack.append(task)
+        pack_tokens += tokens
+    if pack:
+        groups.append(pack)
+    return groups
+
+
+def parse_packed(text: str, task_ids: List[int]) -> Optional[Dict[int, str]]:
+    """
+    Split a packed response into sections.
+
+    Args:
+        text: Model output
+        task_ids: Ids the response must contain, each exactly once
+
+    Returns:
+        {task_id: section_md}, or None when a section is missing, duplicated,
+        unexpected or empty (the caller then writes the sections one by one)
+    """
+    matches = list(_DELIMITER_RE.finditer(text))
+    ids = [int(m.group(1)) for m in matches]
+    if sorted(ids) != sorted(task_ids):
+        return None
+    sections = {}
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        body = text[match.end():end].strip()
+        if not body.startswith("## "):
+            return None
+        sections[int(match.group(1))] = body
+    return sections
@@ -0,0 +1,180 @@
+"""
+Single-Flight Run Coalescing
+
+Identical concurrent /generate requests share one graph run. The first request
+for a key starts the run; later requests for the same key attach to it, replay
+the events published so far, and then follow the live stream to the final
+result. When the last attached request leaves before the run finishes, the run
+is abandoned so the caller can cancel the work behind it.
+"""
+
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import metrics
+
+_DONE = object()
+
+
+class InFlightRun:
+    """Event history and live subscribers for one shared run."""
+
+    def __init__(self, key: Tuple):
+        self.key = key
+        self.events: List[dict] = []
+        self.done = False
+        self.subscriber_count = 0  # everyone who ever joined (fan-in)
+        self.attached = 0  # requests still following the run
+        self.context: Dict[str, Any] = {}  # caller data, e.g. the graph run_id
+        self._subscribers: List[Tuple[asyncio.Queue, asyncio.AbstractEventLoop]] = []
+        self._lock = threading.Lock()
+
+    def publish(self, event: dict) -> None:
+        """Record an event and fan it out. Safe to call from any thread."""
+        with self._lock:
+            if self.done:
+                return
+            self.events.append(event)
+            subscribers = list(self._subscribers)
+        for queue, loop in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    def finish(self) -> None:
+        with self._lock:
+            if self.done:
+                return
+            self.done = True
+            subscribers = list(self._subscribers)
+        for queue, loop in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, _DONE)
+
+    async def subscribe(
+        self,
+        heartbeat_seconds: Optional[float] = None,
+        coalescable: Optional[Callable[[dict], bool]] = None,
+    ) -> AsyncIterator[Optional[dict]]:
+        """
+        Yield every event of the run, starting with the ones already published.
+
+        Args:
+            heartbeat_seconds: Yield None whenever no event arrived for this long
+            coalescable: Marks progress events that may be collapsed; when a slow
+                consumer falls behind, only the latest queued one is delivered
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            history = list(self.events)
+            done = self.done
+            if not done:
+                self._subscribers.append((queue, loop))
+
+        try:
+            for event in history:
+                yield event
+            if done:
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+
+                batch = [event]
+                while not queue.empty():
+                    batch.append(queue.get_nowait())
+                for event in _coalesce(batch, coalescable):
+                    if event is _DONE:
+                        return
+                    yield event
+        finally:
+            with self._lock:
+                if (queue, loop) in self._subscribers:
+                    self._subscribers.remove((queue, loop))
+
+
+def _coalesce(batch: List[Any], coalescable: Optional[Callable[[dict], bool]]) -> List[Any]:
+    """Drop all but the last coalescable event from a backlog, keeping order."""
+    if coalescable is None or len(batch) < 2:
+        return batch
+    marks = [e is not _DONE and coalescable(e) for e in batch]
+    if marks.count(True) < 2:
+        return batch
+    last = len(marks) - 1 - marks[::-1].index(True)
+    kept = [e for i, e in enumerate(batch) if not marks[i] or i == last]
+    metrics.incr("sse.coalesced_events", len(batch) - len(kept))
+    return kept
+
+
+class SingleFlight:
+    """Registry of in-flight runs keyed by request identity."""
+
+    def __init__(self, name: str = "singleflight", on_abandoned: Optional[Callable[[InFlightRun], Any]] = None):
+        self.name = name
+        self.on_abandoned = on_abandoned
+        self._runs: Dict[Tuple, InFlightRun] = {}
+        self._lock = threading.Lock()
+
+    def join_or_start(self, key: Tuple, start: Callable[[InFlightRun], Any]) -> Tuple[InFlightRun, bool]:
+        """
+        Attach to the run for key, starting it if none is in flight.
+
+        Args:
+            key: Coalescing key
+            start: Called once with the new run; must arrange for run.publish()
+                and for self.complete(run) when the work is over. Callers must
+                call self.leave(run) when they stop following the run.
+
+        Returns:
+            (run, started) where started is True for the request that launched it
+        """
+        with self._lock:
+            run = self._runs.get(key)
+            started = run is None
+            if started:
+                run = InFlightRun(key)
+                self._runs[key] = run
+            run.subscriber_count += 1
+            run.attached += 1
+            fan_in = run.subscriber_count
+
+        if started:
+            metrics.incr(f"{self.name}.runs")
+            start(run)
+        else:
+            metrics.incr(f"{self.name}.joined")  # one full run saved per joiner
+        metrics.incr(f"{self.name}.subscribers")
+        metrics.set_max(f"{self.name}.max_fan_in", fan_in)
+        return run, started
+
+    def leave(self, run: InFlightRun) -> None:
+        """
+        Detach one request. If it was the last one and the run is still going,
+        the run is abandoned: new requests start fresh and on_abandoned is called.
+        """
+        with self._lock:
+            run.attached -= 1
+            abandoned = run.attached <= 0 and not run.done
+            if abandoned and self._runs.get(run.key) is run:
+                del self._runs[run.key]
+        if abandoned:
+            metrics.incr(f"{self.name}.abandoned")
+            run.finish()
+            if self.on_abandoned is not None:
+                self.on_abandoned(run)
+
+    def complete(self, run: InFlightRun) -> None:
+        """Finish a run and stop routing new requests to it."""
+        with self._lock:
+            if self._runs.get(run.key) is run:
+                del self._runs[run.key]
+        run.finish()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": len(self._runs),
+                "attached": sum(r.attached for r in self._runs.values()),
+            }
@@ -0,0 +1,555 @@
+"""
+Static Export
+
+Writes the post archive as static, CDN-ready files so readers don't have to go
+through the API and Supabase:
+
+    posts/<stem>.html        standalone post page
+    posts/<stem>.json        post record: metadata, TOC and markdown
+    pages/<n>.json           index page n; page 0 holds the oldest posts
+    index.json               page count, page size and totals
+    feed.xml, atom.xml, feed.json   RSS 2.0, Atom and JSON Feed (newest posts)
+    sitemap.xml              sitemap index over sitemap-<k>.xml chunks
+    _state/                  exporter bookkeeping (not linked from any page)
+
+Pagination is stable: each post gets a sequence number when it is first
+exported and stays on page seq // STATIC_PAGE_SIZE, so a new post only ever
+changes the newest page and older pages stay cacheable.
+
+upload_markdown and delete_blog_post append to a change log in the bucket.
+An incremental run applies every pending change (there is no cursor: a log
+entry is named before its upload lands, so names need not arrive in order)
+and removes the entries it applied. It rewrites only the files they affect: the post's own files, its index page and sitemap chunk, plus the
+index, feeds and sitemap index (a fixed number of files per change).
+A full rebuild regenerates everything from the bucket and is only needed for
+the first export or after changing the page size or sitemap chunk size.
+"""
+
+import html
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from xml.sax.saxutils import escape as xml_escape
+
+import coordination
+import metrics
+import post_renderer
+import supabase_storage
+
+# dir: write to STATIC_EXPORT_DIR | bucket: upload under site/ in the storage bucket
+STATIC_EXPORT_TARGET = os.getenv("STATIC_EXPORT_TARGET", "dir").lower()
+STATIC_EXPORT_DIR = os.getenv("STATIC_EXPORT_DIR", "static_export")
+BUCKET_PREFIX = "site"
+# Frontend origin (post links) and where the exported files are served from
+SITE_URL = os.getenv("STATIC_SITE_URL", "https://ai-blogger-agent-beryl.vercel.app").rstrip("/")
+EXPORT_URL = os.getenv("STATIC_EXPORT_URL", f"{SITE_URL}/static").rstrip("/")
+SITE_TITLE = os.getenv("STATIC_SITE_TITLE", "AI Blogger")
+PAGE_SIZE = int(os.getenv("STATIC_PAGE_SIZE", "20"))
+FEED_SIZE = int(os.getenv("STATIC_FEED_SIZE", "20"))
+# Posts per sitemap file (the protocol allows up to 50,000)
+SITEMAP_CHUNK = int(os.getenv("STATIC_SITEMAP_CHUNK", "5000"))
+# Apply pending changes periodically in the API process (0 = only on demand)
+STATIC_EXPORT_INTERVAL_S = int(os.getenv("STATIC_EXPORT_INTERVAL_S", "0"))
+
+STATE_NAME = "_state/export.json"
+_PREVIEW_CHARS = 200
+
+_JSON = "application/json"
+_lock = threading.Lock()  # one export at a time per process
+_READ_EXECUTOR = ThreadPoolExecutor(
+    max_workers=supabase_storage.STORAGE_CONCURRENCY, thread_name_prefix="static-export-read"
+)
+
+
+# -----------------------------
+# Targets
+# -----------------------------
+class DirectoryTarget:
+    """Exported files in a local directory (e.g. synced to a CDN or static host)."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def read(self, name: str) -> Optional[bytes]:
+        try:
+            with open(os.path.join(self.root, name), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def write(self, files: Dict[str, Tuple[bytes, str]]) -> None:
+        for name, (data, _) in files.items():
+            path = os.path.join(self.root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Readers never see a half-written file
+            tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+    def remove(self, names: List[str]) -> None:
+        for name in names:
+            try:
+                os.remove(os.path.join(self.root, name))
+            except FileNotFoundError:
+                pass
+
+    def names(self) -> List[str]:
+        found = []
+        for folder, _, files in os.walk(self.root):
+            rel = os.path.relpath(folder, self.root)
+            found += [name if rel == "." else f"{rel}/{name}".replace(os.sep, "/") for name in files]
+        return found
+
+
+class BucketTarget:
+    """Exported files under a prefix of the public storage bucket."""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+
+    def read(self, name: str) -> Optional[bytes]:
+        return supabase_storage.get_object(f"{self.prefix}/{name}")
+
+    def write(self, files: Dict[str, Tuple[bytes, str]]) -> None:
+        urls = supabase_storage.upload_many(
+            (f"{self.prefix}/{name}", data, content_type) for name, (data, content_type) in files.items()
+        )
+        failed = [path for path, url in urls.items() if url is None]
+        if failed:
+            raise RuntimeError(f"Upload of {len(failed)} exported files failed (first: {failed[0]})")
+
+    def remove(self, names: List[str]) -> None:
+        if names:
+            supabase_storage.remove_many(f"{self.prefix}/{name}" for name in names)
+
+    def names(self, folder: str = "") -> List[str]:
+        found = []
+        for entry in supabase_storage.list_all(f"{self.prefix}/{folder}".rstrip("/")):
+            name = f"{folder}/{entry['name']}" if folder else entry["name"]
+            found += self.names(name) if entry.get("id") is None else [name]
+        return found
+
+
+def get_target():
+    return BucketTarget(BUCKET_PREFIX) if STATIC_EXPORT_TARGET == "bucket" else DirectoryTarget(STATIC_EXPORT_DIR)
+
+
+class _Batch:
+    """Writes and removals of one export run; reads see the pending writes."""
+
+    def __init__(self, target):
+        self.target = target
+        self.writes: Dict[str, Tuple[bytes, str]] = {}
+        self.removes = set()
+
+    def read_json(self, name: str) -> Optional[dict]:
+        if name in self.writes:
+            return json.loads(self.writes[name][0])
+        if name in self.removes:
+            return None
+        data = self.target.read(name)
+        return json.loads(data) if data else None
+
+    def write(self, name: str, body: str, content_type: str) -> None:
+        self.removes.discard(name)
+        self.writes[name] = (body.encode("utf-8"), content_type)
+
+    def write_json(self, name: str, obj) -> None:
+        self.write(name, json.dumps(obj, ensure_ascii=False), _JSON)
+
+    def remove(self, name: str) -> None:
+        self.writes.pop(name, None)
+        self.removes.add(name)
+
+    def flush(self) -> None:
+        # The state goes last: after a failure the next run re-applies the same changes
+        state = self.writes.pop(STATE_NAME, None)
+        self.target.write(self.writes)
+        self.target.remove(sorted(self.removes))
+        if state is not None:
+            self.target.write({STATE_NAME: state})
+            self.writes[STATE_NAME] = state
+
+
+# -----------------------------
+# Rendering
+# -----------------------------
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="seconds").replace("+00:00", "Z")
+
+
+def _timestamp(stamp: Optional[str]) -> Optional[float]:
+    if not stamp:
+        return None
+    try:
+        return datetime.fromisoformat(stamp.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def _title(markdown: str, filename: str) -> str:
+    first = markdown.split("\n", 1)[0]
+    if first.startswith("# "):
+        return first[2:].strip()
+    return filename.replace(".md", "").replace("-", " ").title()
+
+
+def _preview(markdown: str) -> str:
+    body = markdown.split("\n", 1)[1] if markdown.startswith("# ") and "\n" in markdown else markdown
+    text = " ".join(body.split())
+    return text[:_PREVIEW_CHARS] + "..." if len(text) > _PREVIEW_CHARS else text
+
+
+def post_url(filename: str) -> str:
+    return f"{SITE_URL}/posts/{filename}"
+
+
+def _page_html(record: dict, body_html: Optional[str], markdown: str) -> str:
+    body = body_html if body_html is not None else f"<pre>{html.escape(markdown)}</pre>"
+    return (
+        "<!doctype html>\n<html lang=\"en\">\n<head>\n<meta charset=\"utf-8\">\n"
+        "<meta name=\"viewport\" content=\"width=device-width, initial-scale=1\">\n"
+        f"<title>{html.escape(record['title'])}</title>\n"
+        f"<meta name=\"description\" content=\"{html.escape(record['preview'])}\">\n"
+        f"<link rel=\"canonical\" href=\"{html.escape(record['url'])}\">\n"
+        f"<link rel=\"alternate\" type=\"application/rss+xml\" title=\"{html.escape(SITE_TITLE)}\" "
+        f"href=\"{EXPORT_URL}/feed.xml\">\n"
+        f"</head>\n<body>\n<article>\n{body}</article>\n</body>\n</html>\n"
+    )
+
+
+def _write_post(batch: _Batch, filename: str, markdown: str, seq: int, created_at: float, updated_at: float) -> dict:
+    """Write a post's page and record; returns its index entry."""
+    body_html, toc = post_renderer.render_html(markdown)
+    entry = {
+        "filename": filename,
+        "title": _title(markdown, filename),
+        "created_at": created_at,
+        "updated_at": updated_at,
+        "preview": _preview(markdown),
+        "seq": seq,
+        "url": post_url(filename),
+    }
+    stem = post_renderer.post_stem(filename)
+    batch.write(f"posts/{stem}.html", _page_html(entry, body_html, markdown), "text/html; charset=utf-8")
+    batch.write_json(f"posts/{stem}.json", {**entry, "page": seq // PAGE_SIZE, "toc": toc, "markdown": markdown})
+    return entry
+
+
+def _remove_post(batch: _Batch, filename: str) -> None:
+    stem = post_renderer.post_stem(filename)
+    batch.remove(f"posts/{stem}.html")
+    batch.remove(f"posts/{stem}.json")
+
+
+def _write_page(batch: _Batch, page: int, entries: List[dict]) -> None:
+    batch.write_json(f"pages/{page}.json", {
+        "page": page,
+        "page_size": PAGE_SIZE,
+        "posts": sorted(entries, key=lambda e: e["seq"]),
+    })
+
+
+def _write_sitemap_chunk(batch: _Batch, chunk: int, lastmod: Dict[str, float]) -> None:
+    batch.write_json(f"_state/sitemap-{chunk}.json", lastmod)
+    urls = "".join(
+        f"<url><loc>{xml_escape(post_url(name))}</loc><lastmod>{_iso(ts)[:10]}</lastmod></url>\n"
+        for name, ts in sorted(lastmod.items())
+    )
+    batch.write(
+        f"sitemap-{chunk}.xml",
+        "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n"
+        f"<urlset xmlns=\"http://www.sitemaps.org/schemas/sitemap/0.9\">\n{urls}</urlset>\n",
+        "application/xml",
+    )
+
+
+def _newest_entries(batch: _Batch, state: dict) -> List[dict]:
+    """Newest FEED_SIZE entries, read from the newest pages down."""
+    entries: List[dict] = []
+    page = (state["next_seq"] - 1) // PAGE_SIZE
+    while page >= 0 and len(entries) < FEED_SIZE:
+        data = batch.read_json(f"pages/{page}.json") or {"posts": []}
+        entries += sorted(data["posts"], key=lambda e: e["seq"], reverse=True)
+        page -= 1
+    return entries[:FEED_SIZE]
+
+
+def _write_feeds(batch: _Batch, entries: List[dict]) -> None:
+    updated = max((e["updated_at"] for e in entries), default=time.time())
+    title = xml_escape(SITE_TITLE)
+
+    items = "".join(
+        f"<item><title>{xml_escape(e['title'])}</title><link>{xml_escape(e['url'])}</link>"
+        f"<guid isPermaLink=\"true\">{xml_escape(e['url'])}</guid>"
+        f"<pubDate>{format_datetime(datetime.fromtimestamp(e['created_at'], timezone.utc))}</pubDate>"
+        f"<description>{xml_escape(e['preview'])}</description></item>\n"
+        for e in entries
+    )
+    batch.write(
+        "feed.xml",
+        "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n"
+        "<rss version=\"2.0\" xmlns:atom=\"http://www.w3.org/2005/Atom\"><channel>\n"
+        f"<title>{title}</title><link>{xml_escape(SITE_URL)}</link><description>{title}</description>\n"
+        f"<atom:link href=\"{xml_escape(EXPORT_URL)}/feed.xml\" rel=\"self\" type=\"application/rss+xml\"/>\n"
+        f"<lastBuildDate>{format_datetime(datetime.fromtimestamp(updated, timezone.utc))}</lastBuildDate>\n"
+        f"{items}</channel></rss>\n",
+        "application/rss+xml",
+    )
+
+    atom_entries = "".join(
+        f"<entry><title>{xml_escape(e['title'])}</title><link href=\"{xml_escape(e['url'])}\"/>"
+        f"<id>{xml_escape(e['url'])}</id><published>{_iso(e['created_at'])}</published>"
+        f"<updated>{_iso(e['updated_at'])}</updated><summary>{xml_escape(e['preview'])}</summary></entry>\n"
+        for e in entries
+    )
+    batch.write(
+        "atom.xml",
+        "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<feed xmlns=\"http://www.w3.org/2005/Atom\">\n"
+        f"<title>{title}</title><id>{xml_escape(SITE_URL)}/</id><updated>{_iso(updated)}</updated>\n"
+        f"<link href=\"{xml_escape(SITE_URL)}\"/><link href=\"{xml_escape(EXPORT_URL)}/atom.xml\" rel=\"self\"/>\n"
+        f"{atom_entries}</feed>\n",
+        "application/atom+xml",
+    )
+
+    batch.write_json("feed.json", {
+        "version": "https://jsonfeed.org/version/1.1",
+        "title": SITE_TITLE,
+        "home_page_url": SITE_URL,
+        "feed_url": f"{EXPORT_URL}/feed.json",
+        "items": [
+            {
+                "id": e["url"],
+                "url": e["url"],
+                "title": e["title"],
+                "summary": e["preview"],
+                "date_published": _iso(e["created_at"]),
+                "date_modified": _iso(e["updated_at"]),
+            }
+            for e in entries
+        ],
+    })
+
+
+def _write_index(batch: _Batch, state: dict) -> None:
+    pages = (state["next_seq"] + PAGE_SIZE - 1) // PAGE_SIZE
+    batch.write_json("index.json", {
+        "page_size": PAGE_SIZE,
+        "pages": pages,
+        "newest_page": max(pages - 1, 0),
+        "total": state["total"],
+        "updated_at": state["updated_at"],
+        "feeds": {"rss": "feed.xml", "atom": "atom.xml", "json": "feed.json"},
+    })
+    sitemaps = "".join(
+        f"<sitemap><loc>{xml_escape(EXPORT_URL)}/sitemap-{chunk}.xml</loc><lastmod>{_iso(ts)[:10]}</lastmod></sitemap>\n"
+        for chunk, ts in sorted(state["sitemap_lastmod"].items(), key=lambda kv: int(kv[0]))
+    )
+    batch.write(
+        "sitemap.xml",
+        "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n"
+        f"<sitemapindex xmlns=\"http://www.sitemaps.org/schemas/sitemap/0.9\">\n{sitemaps}</sitemapindex>\n",
+        "application/xml",
+    )
+
+
+def _finish(batch: _Batch, state: dict, stale: Iterable[str] = ()) -> None:
+    """Write the index, feeds, sitemap index and state, remove stale files and flush."""
+    state["updated_at"] = time.time()
+    _write_index(batch, state)
+    _write_feeds(batch, _newest_entries(batch, state))
+    batch.write_json(STATE_NAME, state)
+    for name in set(stale) - set(batch.writes):
+        batch.remove(name)
+    batch.flush()
+
+
+# -----------------------------
+# Export runs
+# -----------------------------
+def _rebuild_full(target) -> dict:
+    # The listing below covers these; later ones are applied by the next incremental run
+    changes = supabase_storage.list_changes()
+    files = [e for e in supabase_storage.list_all("markdown") if e.get("name", "").endswith(".md")]
+    files.sort(key=lambda e: (_timestamp(e.get("created_at")) or 0, e["name"]))
+    contents = list(_READ_EXECUTOR.map(supabase_storage.get_blog_post, [f["name"] for f in files]))
+
+    batch = _Batch(target)
+    pages: Dict[int, List[dict]] = {}
+    chunks: Dict[int, Dict[str, float]] = {}
+    seq = 0
+    for file, markdown in zip(files, contents):
+        if markdown is None:
+            print(f"Static export: skipping unreadable post {file['name']}")
+            continue
+        created = _timestamp(file.get("created_at")) or time.time()
+        updated = _timestamp(file.get("updated_at")) or created
+        entry = _write_post(batch, file["name"], markdown, seq, created, updated)
+        pages.setdefault(seq // PAGE_SIZE, []).append(entry)
+        chunks.setdefault(seq // SITEMAP_CHUNK, {})[file["name"]] = updated
+        seq += 1
+
+    for page, entries in pages.items():
+        _write_page(batch, page, entries)
+    for chunk, lastmod in chunks.items():
+        _write_sitemap_chunk(batch, chunk, lastmod)
+    state = {
+        "page_size": PAGE_SIZE,
+        "sitemap_chunk": SITEMAP_CHUNK,
+        "next_seq": seq,
+        "total": seq,
+        "sitemap_lastmod": {str(k): max(v.values()) for k, v in chunks.items()},
+    }
+    # Everything not rewritten belongs to posts and pages that no longer exist
+    _finish(batch, state, stale=target.names())
+    if changes:
+        supabase_storage.remove_many(f"{supabase_storage.CHANGES_FOLDER}/{c['name']}" for c in changes)
+    return {"mode": "full", "changes": len(changes), "posts_written": seq, "posts_removed": 0,
+            "files_written": len(batch.writes), "files_removed": len(batch.removes)}
+
+
+def _apply_changes(target, state: dict) -> dict:
+    # Applying a change twice is harmless, so every listed one is applied
+    changes = supabase_storage.list_changes()
+    if not changes:
+        return {"mode": "incremental", "changes": 0, "posts_written": 0, "posts_removed": 0,
+                "files_written": 0, "files_removed": 0}
+
+    # Only the last change per post matters
+    latest: Dict[str, dict] = {}
+    for change in changes:
+        latest.pop(change["post"], None)
+        latest[change["post"]] = change
+
+    batch = _Batch(target)
+    pages: Dict[int, Dict[str, dict]] = {}
+    chunks: Dict[int, Dict[str, float]] = {}
+
+    def page_entries(page: int) -> Dict[str, dict]:
+        if page not in pages:
+            data = batch.read_json(f"pages/{page}.json") or {"posts": []}
+            pages[page] = {e["filename"]: e for e in data["posts"]}
+        return pages[page]
+
+    def chunk_lastmod(chunk: int) -> Dict[str, float]:
+        if chunk not in chunks:
+            chunks[chunk] = batch.read_json(f"_state/sitemap-{chunk}.json") or {}
+        return chunks[chunk]
+
+    puts = [c for c in latest.values() if c["op"] == "put"]
+    contents = dict(zip(
+        [c["post"] for c in puts], _READ_EXECUTOR.map(supabase_storage.get_blog_post, [c["post"] for c in puts])
+    ))
+    unreadable = [name for name in contents if contents[name] is None]
+    if unreadable:
+        # A post that is no longer in the bucket was deleted after its put (its delete
+        # change may not be listed yet): apply it as a delete. One that is still there
+        # failed to download; keep the log so the next run retries
+        stored = {f["name"] for f in supabase_storage.list_all("markdown")}
+        failed = [name for name in unreadable if name in stored]
+        if failed:
+            raise RuntimeError(f"Could not read {', '.join(failed)}; export stopped before applying it")
+        metrics.incr("static_export.missing_puts", len(unreadable))
+
+    written = removed = 0
+    for filename, change in latest.items():
+        record = batch.read_json(f"posts/{post_renderer.post_stem(filename)}.json")
+        if change["op"] == "delete" or contents.get(filename) is None:
+            if record is None:
+                continue
+            _remove_post(batch, filename)
+            page_entries(record["seq"] // PAGE_SIZE).pop(filename, None)
+            chunk_lastmod(record["seq"] // SITEMAP_CHUNK).pop(filename, None)
+            state["total"] -= 1
+            removed += 1
+            continue
+
+        if record is None:
+            seq, created = state["next_seq"], change["at"]
+            state["next_seq"] += 1
+            state["total"] += 1
+        else:
+            seq, created = record["seq"], record["created_at"]
+        entry = _write_post(batch, filename, contents[filename], seq, created, change["at"])
+        page_entries(seq // PAGE_SIZE)[filename] = entry
+        chunk_lastmod(seq // SITEMAP_CHUNK)[filename] = change["at"]
+        written += 1
+
+    for page, entries in pages.items():
+        _write_page(batch, page, list(entries.values()))
+    for chunk, lastmod in chunks.items():
+        _write_sitemap_chunk(batch, chunk, lastmod)
+        state["sitemap_lastmod"][str(chunk)] = max(lastmod.values(), default=time.time())
+    state.pop("cursor", None)  # written by earlier versions
+    _finish(batch, state)
+    supabase_storage.remove_many(f"{supabase_storage.CHANGES_FOLDER}/{c['name']}" for c in changes)
+    return {"mode": "incremental", "changes": len(changes), "posts_written": written, "posts_removed": removed,
+            "files_written": len(batch.writes), "files_removed": len(batch.removes)}
+
+
+def export(full: bool = False, target=None) -> dict:
+    """
+    Bring the static export up to date.
+
+    Args:
+        full: Rebuild every file instead of applying pending changes (done
+            automatically when there is no previous export or its page size
+            or sitemap chunk size differs)
+        target: DirectoryTarget or BucketTarget (default from STATIC_EXPORT_TARGET)
+
+    Returns:
+        {"mode", "changes", "posts_written", "posts_removed", "files_written",
+         "files_removed", "duration_ms"}
+    """
+    target = target or get_target()
+    if not _lock.acquire(blocking=False):
+        raise RuntimeError("A static export is already running")
+    lease = None
+    try:
+        # One exporter across worker processes (no-op unless COORDINATION=sqlite)
+        lease, _ = coordination.claim("static_export", uuid.uuid4().hex)
+        if lease is None:
+            raise RuntimeError("A static export is already running in another worker")
+        start = time.perf_counter()
+        state = None if full else _Batch(target).read_json(STATE_NAME)
+        if state is None or state.get("page_size") != PAGE_SIZE or state.get("sitemap_chunk") != SITEMAP_CHUNK:
+            report = _rebuild_full(target)
+        else:
+            report = _apply_changes(target, state)
+        report["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+        metrics.incr(f"static_export.{report['mode']}_runs")
+        metrics.incr("static_export.files_written", report["files_written"])
+        metrics.observe_ms(f"static_export.{report['mode']}_ms", report["duration_ms"])
+        if report["changes"] or report["mode"] == "full":
+            print(
+                f"📦 Static export ({report['mode']}): {report['posts_written']} posts written, "
+                f"{report['posts_removed']} removed, {report['files_written']} files in {report['duration_ms']:.0f} ms"
+            )
+        return report
+    finally:
+        if lease is not None:
+            lease.release()
+        _lock.release()
+
+
+def _periodic() -> None:
+    while True:
+        time.sleep(STATIC_EXPORT_INTERVAL_S)
+        try:
+            export()
+        except Exception as e:
+            print(f"Static export failed: {e}")
+
+
+def start_periodic() -> None:
+    """Start the background exporter when STATIC_EXPORT_INTERVAL_S is set."""
+    if STATIC_EXPORT_INTERVAL_S > 0:
+        threading.Thread(target=_periodic, name="static-export", daemon=True).start()
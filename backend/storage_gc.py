@@ -0,0 +1,144 @@
+"""
+Storage Garbage Collection
+
+Mark-and-sweep over the bucket's images/ folder. Mark collects every image a
+published post references (from its manifest, or from its markdown for posts
+uploaded before manifests); sweep removes the remaining images in batched
+remove requests. Variants the markdown doesn't link (other widths and formats)
+are kept along with the image they were encoded from.
+
+Images newer than STORAGE_GC_GRACE_S are never swept: a run uploads its images
+before the markdown that references them, so a young unreferenced image may
+belong to a run still in flight.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional, Set
+
+import image_optimizer
+import metrics
+import supabase_storage
+
+STORAGE_GC_GRACE_S = int(os.getenv("STORAGE_GC_GRACE_S", "3600"))
+# Run the collector periodically in the API process (0 = only on demand)
+STORAGE_GC_INTERVAL_S = int(os.getenv("STORAGE_GC_INTERVAL_S", "0"))
+
+_lock = threading.Lock()  # one collection at a time per process
+
+
+def _age_s(entry: dict, now: float) -> Optional[float]:
+    stamp = entry.get("updated_at") or entry.get("created_at")
+    if not stamp:
+        return None
+    try:
+        return now - datetime.fromisoformat(stamp.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def mark(posts: List[dict]) -> Set[str]:
+    """Bucket paths of every image referenced by the given posts (markdown folder entries)."""
+    referenced: Set[str] = set()
+    for post in posts:
+        manifest = supabase_storage.get_manifest(post["name"])
+        if manifest is not None:
+            referenced.update(manifest.get("images", []))
+            continue
+        content = supabase_storage.get_blog_post(post["name"])
+        if content is None:
+            # Unreadable post: keep everything rather than sweep images it may use
+            raise RuntimeError(f"Could not read {post['name']}; aborting collection")
+        referenced.update(supabase_storage.referenced_images(content))
+    return referenced
+
+
+def list_images(folder: str = "images") -> List[dict]:
+    """Every object under folder (recursively), as {path, size, age_s}."""
+    now = time.time()
+    objects = []
+    for entry in supabase_storage.list_all(folder):
+        path = f"{folder}/{entry['name']}"
+        if entry.get("id") is None:
+            objects.extend(list_images(path))
+            continue
+        objects.append({
+            "path": path,
+            "size": (entry.get("metadata") or {}).get("size", 0),
+            "age_s": _age_s(entry, now),
+        })
+    return objects
+
+
+def collect(dry_run: bool = False) -> dict:
+    """
+    Remove images no published post references.
+
+    Args:
+        dry_run: Only report what would be removed
+
+    Returns:
+        {"dry_run", "posts_marked", "images_scanned", "referenced", "orphaned", "skipped_recent",
+         "removed", "reclaimed_bytes", "reclaimable_bytes", "remove_requests", "requests_saved",
+         "duration_ms"}
+    """
+    if not _lock.acquire(blocking=False):
+        raise RuntimeError("A storage collection is already running")
+    try:
+        start = time.perf_counter()
+        # list_all raises on errors (list_blog_posts would return [] and sweep everything)
+        posts = [e for e in supabase_storage.list_all("markdown") if e.get("name", "").endswith(".md")]
+        referenced = mark(posts)
+        images = list_images()
+        sources = {image_optimizer.source_stem(path) for path in referenced}
+        orphans = [img for img in images if image_optimizer.source_stem(img["path"]) not in sources]
+        sweep = [img for img in orphans if img["age_s"] is not None and img["age_s"] >= STORAGE_GC_GRACE_S]
+
+        requests = 0
+        if sweep and not dry_run:
+            requests = supabase_storage.remove_many(img["path"] for img in sweep)
+        reclaimed = sum(img["size"] for img in sweep)
+
+        report = {
+            "dry_run": dry_run,
+            "posts_marked": len(posts),
+            "images_scanned": len(images),
+            "referenced": len(referenced),
+            "orphaned": len(orphans),
+            "skipped_recent": len(orphans) - len(sweep),
+            "removed": 0 if dry_run else len(sweep),
+            "reclaimed_bytes": 0 if dry_run else reclaimed,
+            "reclaimable_bytes": reclaimed,
+            # One batched request instead of one per object
+            "remove_requests": requests,
+            "requests_saved": 0 if dry_run else len(sweep) - requests,
+            "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+        if not dry_run:
+            metrics.incr("storage_gc.runs")
+            metrics.incr("storage_gc.removed", len(sweep))
+            metrics.incr("storage_gc.reclaimed_bytes", reclaimed)
+        print(
+            f"🧹 Storage GC{' (dry run)' if dry_run else ''}: {len(sweep)} orphaned images, "
+            f"{reclaimed / 1024:.1f} KB {'reclaimable' if dry_run else 'reclaimed'}"
+        )
+        return report
+    finally:
+        _lock.release()
+
+
+def _periodic() -> None:
+    while True:
+        time.sleep(STORAGE_GC_INTERVAL_S)
+        try:
+            collect()
+        except Exception as e:
+            print(f"Storage GC failed: {e}")
+
+
+def start_periodic() -> None:
+    """Start the background collector when STORAGE_GC_INTERVAL_S is set."""
+    if STORAGE_GC_INTERVAL_S > 0:
+        threading.Thread(target=_periodic, name="storage-gc", daemon=True).start()
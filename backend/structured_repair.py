@@ -0,0 +1,227 @@
+"""
+Structured Output Repair
+
+The planner schemas are strict (exact list lengths, short strings, strict
+types), and the 8B model often misses them only slightly. Instead of failing
+or re-asking the LLM, near-miss outputs are repaired deterministically:
+unknown keys dropped, types coerced, long strings truncated, long lists trimmed,
+plus model-specific fixes (padding, renumbering) supplied by the caller. Only
+outputs that still don't validate are re-asked, with the failed output and the
+validation errors appended so the model corrects its answer instead of
+repeating it.
+"""
+
+import json
+import time
+import typing
+from typing import Any, Callable, Optional, Type
+
+from annotated_types import MaxLen, MinLen
+from langchain_core.messages import AIMessage, HumanMessage
+from pydantic import BaseModel, ValidationError
+
+import metrics
+
+
+def _unwrap_optional(annotation):
+    if typing.get_origin(annotation) is typing.Union:
+        args = [a for a in typing.get_args(annotation) if a is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return annotation
+
+
+def _length_bounds(field) -> tuple:
+    lo = hi = None
+    for m in field.metadata:
+        if isinstance(m, MinLen):
+            lo = m.min_length
+        elif isinstance(m, MaxLen):
+            hi = m.max_length
+    return lo, hi
+
+
+def _coerce(annotation, value: Any) -> Any:
+    annotation = _unwrap_optional(annotation)
+    origin = typing.get_origin(annotation)
+
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return repair(annotation, value) if isinstance(value, dict) else value
+    if origin in (list, typing.List):
+        (item_type,) = typing.get_args(annotation) or (Any,)
+        if isinstance(value, str):
+            value = [value]
+        if isinstance(value, list):
+            return [_coerce(item_type, v) for v in value]
+        return value
+    if origin is typing.Literal:
+        choices = typing.get_args(annotation)
+        if isinstance(value, str) and value not in choices:
+            normalized = value.strip().lower().replace(" ", "_").replace("-", "_")
+            for choice in choices:
+                if normalized == str(choice):
+                    return choice
+        return value
+    if annotation is bool:
+        if isinstance(value, str) and value.strip().lower() in ("true", "false"):
+            return value.strip().lower() == "true"
+        if isinstance(value, int) and value in (0, 1):
+            return bool(value)
+        return value
+    if annotation is int:
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+            return int(value.strip())
+        return value
+    if annotation is str:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+        return value
+    return value
+
+
+def repair(model_cls: Type[BaseModel], data: dict) -> dict:
+    """
+    Deterministically fix a raw dict so it is more likely to validate as model_cls.
+
+    Drops unknown keys, coerces scalar types, truncates strings over max_length,
+    trims lists over max_length, and recurses into nested models. Lists that are
+    too short are left alone (padding is model-specific; see the post hooks).
+    """
+    fixed = {}
+    for name, field in model_cls.model_fields.items():
+        if name not in data:
+            continue
+        value = _coerce(field.annotation, data[name])
+        lo, hi = _length_bounds(field)
+        if hi is not None and isinstance(value, (str, list)) and len(value) > hi:
+            value = value[:hi].rstrip() if isinstance(value, str) else value[:hi]
+        fixed[name] = value
+    if model_cls.model_config.get("extra") != "forbid":
+        fixed.update({k: v for k, v in data.items() if k not in model_cls.model_fields})
+    return fixed
+
+
+def _raw_args(message) -> Optional[dict]:
+    """Tool-call arguments (or JSON content) from the raw AIMessage."""
+    tool_calls = getattr(message, "tool_calls", None) or []
+    if tool_calls:
+        return tool_calls[0].get("args")
+    try:
+        parsed = json.loads(getattr(message, "content", "") or "")
+        return parsed if isinstance(parsed, dict) else None
+    except ValueError:
+        return None
+
+
+def _failed_generation(error: Exception) -> Optional[dict]:
+    """Arguments from a provider-side tool-use failure (Groq's `failed_generation`)."""
+    body = getattr(error, "body", None)
+    if isinstance(body, dict):
+        generation = (body.get("error") or body).get("failed_generation")
+    else:
+        generation = None
+    if not generation:
+        return None
+    try:
+        parsed = json.loads(generation) if isinstance(generation, str) else generation
+    except ValueError:
+        return None
+    if isinstance(parsed, list) and parsed:
+        parsed = parsed[0]
+    if isinstance(parsed, dict) and "arguments" in parsed:
+        parsed = parsed["arguments"]
+        if isinstance(parsed, str):
+            try:
+                parsed = json.loads(parsed)
+            except ValueError:
+                return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+def _error_summary(error: Exception, limit: int = 10) -> str:
+    if isinstance(error, ValidationError):
+        lines = [
+            f"- {'.'.join(str(p) for p in e['loc']) or '(root)'}: {e['msg']}"
+            for e in error.errors()[:limit]
+        ]
+        return "\n".join(lines)
+    return f"- {str(error)[:500]}"
+
+
+def _correction_turn(model_cls: Type[BaseModel], raw_args: Optional[dict], error: Optional[Exception]) -> list:
+    """The failed output and what was wrong with it, as messages to append before a re-ask."""
+    turn = []
+    if raw_args is not None:
+        turn.append(AIMessage(content=json.dumps(raw_args, ensure_ascii=False)))
+    problems = _error_summary(error) if error is not None else "- the output could not be parsed"
+    turn.append(HumanMessage(content=(
+        f"That {model_cls.__name__} output was invalid:\n{problems}\n\n"
+        "Return the complete corrected output, fixing every problem above."
+    )))
+    return turn
+
+
+def repair_and_validate(
+    model_cls: Type[BaseModel],
+    data: dict,
+    post: Optional[Callable[[dict], dict]] = None,
+) -> BaseModel:
+    """Repair a raw dict, apply the caller's model-specific fixes, and validate."""
+    fixed = repair(model_cls, data)
+    if post is not None:
+        fixed = post(fixed)
+    return model_cls.model_validate(fixed)
+
+
+def invoke(
+    llm,
+    model_cls: Type[BaseModel],
+    messages: list,
+    post: Optional[Callable[[dict], dict]] = None,
+) -> BaseModel:
+    """
+    Structured LLM call with local repair before any re-ask.
+
+    Args:
+        llm: Chat model (or fallback chain) supporting with_structured_output
+        model_cls: Target schema
+        messages: Prompt messages
+        post: Model-specific fixes applied to the repaired dict (padding, renumbering)
+
+    Returns:
+        A validated model_cls instance
+    """
+    name = model_cls.__name__
+    raw_args = None
+    error: Optional[Exception] = None
+    try:
+        out = llm.with_structured_output(model_cls, include_raw=True).invoke(messages)
+        parsed = out.get("parsed")
+        if parsed is not None:
+            metrics.incr(f"structured.{name}.valid")
+            # Valid outputs still get the model-specific normalization (e.g. task ids)
+            return model_cls.model_validate(post(parsed.model_dump())) if post else parsed
+        raw_args = _raw_args(out.get("raw"))
+        error = out.get("parsing_error")
+    except Exception as e:
+        raw_args = _failed_generation(e)
+        if raw_args is None:
+            raise
+        error = e
+
+    if raw_args is not None:
+        start = time.perf_counter()
+        try:
+            result = repair_and_validate(model_cls, raw_args, post)
+            metrics.incr(f"structured.{name}.repaired")
+            metrics.observe_ms(f"structured.{name}.repair_ms", (time.perf_counter() - start) * 1000)
+            return result
+        except ValidationError as e:
+            error = e
+
+    metrics.incr(f"structured.{name}.reasked")
+    return llm.with_structured_output(model_cls).invoke(
+        messages + _correction_turn(model_cls, raw_args, error)
+    )
@@ -6,12 +6,23 @@ blog posts (markdown files) and images.
 """
 
 import os
-from typing import List, Dict, Optional, Tuple
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Dict, Optional, Set, Tuple
 from datetime import datetime
+from urllib.parse import quote, unquote
 from supabase import create_client, Client
 from pathlib import Path
 from dotenv import load_dotenv
 
+import image_optimizer
+import metrics
+import post_renderer
+import search_index
+import topic_index
+
 # Load environment variables
 load_dotenv()
 
@@ -25,58 +36,294 @@ if not SUPABASE_URL or not SUPABASE_KEY:
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# Run artifacts live next to each post so sections can be regenerated individually
+ARTIFACTS_SUFFIX = ".artifacts.json"
+# The manifest links a post to every object it owns (renditions, artifacts, images)
+MANIFEST_SUFFIX = ".manifest.json"
+
+# One object per publish/delete, consumed by the static exporter
+CHANGES_FOLDER = "changes"
+
+# Uploads of one post (variants, renditions, manifest) run concurrently
+STORAGE_CONCURRENCY = int(os.getenv("STORAGE_CONCURRENCY", "8"))
+_LIST_PAGE_SIZE = 1000
+# Storage API cap on paths per remove request
+REMOVE_BATCH_SIZE = 1000
+
+_UPLOAD_EXECUTOR = ThreadPoolExecutor(max_workers=STORAGE_CONCURRENCY, thread_name_prefix="storage-upload")
+_PUBLIC_PREFIX = f"{SUPABASE_URL.rstrip('/')}/storage/v1/object/public/{SUPABASE_BUCKET}/"
+_CHANGE_RE = re.compile(r"^(\d{20})-(put|delete)-(.+)$")
+_IMAGE_URL_RE = re.compile(re.escape(_PUBLIC_PREFIX) + r"(images/[^)\s?\"']+)")
+
+
+def public_url(path: str) -> str:
+    """Public URL of a bucket object, built locally (same format as get_public_url)."""
+    return _PUBLIC_PREFIX + quote(path)
+
+
+def referenced_images(markdown: str) -> Set[str]:
+    """Bucket paths of the images a post's markdown links to (e.g. 'images/post/image_1-w768.webp')."""
+    return {unquote(m.group(1)) for m in _IMAGE_URL_RE.finditer(markdown)}
+
+
+def _upload(path: str, data: bytes, content_type: str) -> str:
+    supabase.storage.from_(SUPABASE_BUCKET).upload(
+        path=path,
+        file=data,
+        file_options={"content-type": content_type, "upsert": "true"}
+    )
+    metrics.incr("storage.uploads")
+    return public_url(path)
+
+
+def upload_many(files: Iterable[Tuple[str, bytes, str]]) -> Dict[str, Optional[str]]:
+    """
+    Upload several objects concurrently.
+    
+    Args:
+        files: (path, data, content_type) tuples
+    
+    Returns:
+        {path: public URL}, with None for uploads that failed (errors are printed)
+    """
+    files = list(files)
+    futures = [_UPLOAD_EXECUTOR.submit(_upload, *f) for f in files]
+    urls: Dict[str, Optional[str]] = {}
+    for (path, _, _), future in zip(files, futures):
+        try:
+            urls[path] = future.result()
+        except Exception as e:
+            print(f"Error uploading {path}: {e}")
+            urls[path] = None
+    return urls
+
+
+def remove_many(paths: Iterable[str]) -> int:
+    """
+    Remove objects with as few requests as possible.
+    
+    Args:
+        paths: Bucket paths to remove
+    
+    Returns:
+        Number of remove requests made
+    """
+    paths = sorted(set(paths))
+    requests = 0
+    for i in range(0, len(paths), REMOVE_BATCH_SIZE):
+        supabase.storage.from_(SUPABASE_BUCKET).remove(paths[i:i + REMOVE_BATCH_SIZE])
+        requests += 1
+    metrics.incr("storage.removed", len(paths))
+    metrics.incr("storage.remove_requests", requests)
+    metrics.incr("storage.requests_saved", len(paths) - requests)
+    return requests
+
 
-def upload_image(image_bytes: bytes, filename: str) -> str:
+def list_all(folder: str) -> List[dict]:
+    """
+    List every entry of a folder, following pagination (the API returns 100 by default).
+    
+    Args:
+        folder: Folder path (e.g., 'markdown')
+    
+    Returns:
+        Storage entries; sub-folders have no "id"
+    """
+    entries: List[dict] = []
+    offset = 0
+    while True:
+        page = supabase.storage.from_(SUPABASE_BUCKET).list(
+            folder, {"limit": _LIST_PAGE_SIZE, "offset": offset, "sortBy": {"column": "name", "order": "asc"}}
+        )
+        entries.extend(page)
+        if len(page) < _LIST_PAGE_SIZE:
+            return entries
+        offset += _LIST_PAGE_SIZE
+
+
+def upload_image(image_bytes: bytes, filename: str, content_type: str = "image/png") -> str:
     """
     Upload an image to Supabase Storage.
     
     Args:
         image_bytes: Image data as bytes
         filename: Name of the image file (e.g., 'image_1.png')
+        content_type: MIME type of the image (e.g., 'image/webp')
     
     Returns:
         Public URL of the uploaded image
     """
-    path = f"images/{filename}"
+    return _upload(f"images/{filename}", image_bytes, content_type)
+
+
+def upload_images(images: List[Tuple[str, bytes, str]]) -> Dict[str, Optional[str]]:
+    """
+    Upload several images concurrently.
     
-    # Upload to Supabase Storage
-    supabase.storage.from_(SUPABASE_BUCKET).upload(
-        path=path,
-        file=image_bytes,
-        file_options={"content-type": "image/png", "upsert": "true"}
-    )
+    Args:
+        images: (filename, image_bytes, content_type) tuples; filenames may include a folder
     
-    # Get public URL
-    public_url = supabase.storage.from_(SUPABASE_BUCKET).get_public_url(path)
-    return public_url
+    Returns:
+        {filename: public URL}, with None for uploads that failed
+    """
+    urls = upload_many((f"images/{name}", data, content_type) for name, data, content_type in images)
+    return {name: urls[f"images/{name}"] for name, _, _ in images}
 
 
-def upload_markdown(content: str, filename: str) -> str:
+def remove_images(folder: str, filenames: Iterable[str]) -> int:
     """
-    Upload a markdown file to Supabase Storage.
+    Remove source images, and every variant encoded from them, from one post's image folder.
+    
+    Args:
+        folder: The post's folder under images/ (its stem)
+        filenames: Source image filenames (e.g., 'image_1.png')
+    
+    Returns:
+        Number of objects removed
+    """
+    stems = {f"{folder}/{os.path.splitext(name)[0]}" for name in filenames}
+    if not stems:
+        return 0
+    paths = [
+        f"images/{folder}/{e['name']}" for e in list_all(f"images/{folder}")
+        if e.get("id") is not None and image_optimizer.source_stem(f"{folder}/{e['name']}") in stems
+    ]
+    if paths:
+        remove_many(paths)
+    return len(paths)
+
+
+def upload_markdown(content: str, filename: str, artifacts: Optional[dict] = None) -> str:
+    """
+    Upload a markdown file to Supabase Storage, with its renditions and manifest.
+    
+    The markdown, pre-rendered renditions, run artifacts and manifest go up
+    concurrently as one batch.
     
     Args:
         content: Markdown content as string
         filename: Name of the markdown file (e.g., 'blog-title.md')
+        artifacts: Run artifacts to store next to the post (see get_artifacts)
     
     Returns:
         Public URL of the uploaded markdown file
     """
     path = f"markdown/{filename}"
+    files = [(path, content.encode('utf-8'), "text/markdown")]
     
-    # Convert string to bytes
-    content_bytes = content.encode('utf-8')
+    # Store pre-rendered HTML, TOC and compressed variants next to the markdown
+    try:
+        files.extend(
+            (f"markdown/{name}", data, content_type)
+            for name, (data, content_type) in post_renderer.build_renditions(content, filename).items()
+        )
+    except Exception as e:
+        print(f"Error rendering {filename}: {e}")
+    if artifacts is not None:
+        files.append((f"markdown/{artifacts_name(filename)}", json.dumps(artifacts).encode("utf-8"), "application/json"))
     
-    # Upload to Supabase Storage
-    supabase.storage.from_(SUPABASE_BUCKET).upload(
-        path=path,
-        file=content_bytes,
-        file_options={"content-type": "text/markdown", "upsert": "true"}
-    )
+    manifest = {
+        "post": filename,
+        "files": sorted([p for p, _, _ in files] + [f"markdown/{manifest_name(filename)}"]),
+        "images": sorted(referenced_images(content)),
+        "updated_at": datetime.now().isoformat(),
+    }
+    files.append((f"markdown/{manifest_name(filename)}", json.dumps(manifest).encode("utf-8"), "application/json"))
+    
+    urls = upload_many(files)
+    if urls[path] is None:
+        raise RuntimeError(f"Upload of {filename} failed")
+    log_change("put", filename)
     
-    # Get public URL
-    public_url = supabase.storage.from_(SUPABASE_BUCKET).get_public_url(path)
-    return public_url
+    try:
+        search_index.get_index().add(filename, content)
+    except Exception as e:
+        print(f"Error indexing {filename}: {e}")
+    
+    return urls[path]
+
+
+def log_change(op: str, filename: str) -> None:
+    """
+    Record a publish or delete in the change log (errors are printed).
+    
+    The operation and post are encoded in the object name, which sorts by
+    time, so reading the log needs only a listing.
+    
+    Args:
+        op: "put" or "delete"
+        filename: Name of the post's markdown file
+    """
+    name = f"{time.time_ns():020d}-{op}-{filename}"
+    try:
+        _upload(f"{CHANGES_FOLDER}/{name}", b"{}", "application/json")
+    except Exception as e:
+        print(f"Error logging {op} of {filename}: {e}")
+
+
+def list_changes() -> List[dict]:
+    """
+    Pending change log entries, oldest first.
+    
+    Returns:
+        [{"name", "op", "post", "at"}] where at is the change time (epoch seconds)
+    """
+    changes = []
+    for entry in list_all(CHANGES_FOLDER):
+        m = _CHANGE_RE.match(entry.get("name", ""))
+        if m:  # skips placeholders and sub-folders
+            changes.append({"name": m.group(0), "op": m.group(2), "post": m.group(3), "at": int(m.group(1)) / 1e9})
+    return sorted(changes, key=lambda c: c["name"])
+
+
+def artifacts_name(filename: str) -> str:
+    """Name of the run artifacts file stored next to a post (e.g. 'blog-title.artifacts.json')."""
+    return f"{post_renderer.post_stem(filename)}{ARTIFACTS_SUFFIX}"
+
+
+def manifest_name(filename: str) -> str:
+    """Name of the manifest stored next to a post (e.g. 'blog-title.manifest.json')."""
+    return f"{post_renderer.post_stem(filename)}{MANIFEST_SUFFIX}"
+
+
+def get_manifest(filename: str) -> Optional[dict]:
+    """
+    Retrieve a post's manifest.
+    
+    Args:
+        filename: Name of the post's markdown file
+    
+    Returns:
+        {"post", "files", "images", "updated_at"}, or None for posts uploaded before manifests
+    """
+    data = get_post_file(manifest_name(filename))
+    if data is None:
+        return None
+    try:
+        return json.loads(data)
+    except ValueError as e:
+        print(f"Error reading manifest for {filename}: {e}")
+        return None
+
+
+def get_artifacts(filename: str) -> Optional[dict]:
+    """
+    Retrieve the run artifacts stored for a post.
+    
+    Args:
+        filename: Name of the post's markdown file
+    
+    Returns:
+        Artifacts dict, or None for posts generated before artifacts were stored
+    """
+    data = get_post_file(artifacts_name(filename))
+    if data is None:
+        return None
+    try:
+        return json.loads(data)
+    except ValueError as e:
+        print(f"Error reading artifacts for {filename}: {e}")
+        return None
 
 
 def list_blog_posts() -> List[Dict[str, any]]:
@@ -88,7 +335,7 @@ def list_blog_posts() -> List[Dict[str, any]]:
     """
     try:
         # List all files in the markdown folder
-        files = supabase.storage.from_(SUPABASE_BUCKET).list("markdown")
+        files = list_all("markdown")
         
         blog_posts = []
         for file in files:
@@ -130,6 +377,35 @@ def get_blog_post(filename: str) -> Optional[str]:
         return None
 
 
+def get_post_file(name: str) -> Optional[bytes]:
+    """
+    Retrieve a stored post file (markdown or rendition) as raw bytes.
+    
+    Args:
+        name: Filename in the markdown folder (e.g., 'blog-title.html.br')
+    
+    Returns:
+        File bytes, or None if not found
+    """
+    return get_object(f"markdown/{name}")
+
+
+def get_object(path: str) -> Optional[bytes]:
+    """
+    Retrieve any bucket object as raw bytes.
+    
+    Args:
+        path: Bucket path (e.g., 'site/index.json')
+    
+    Returns:
+        Object bytes, or None if not found
+    """
+    try:
+        return supabase.storage.from_(SUPABASE_BUCKET).download(path)
+    except Exception:
+        return None
+
+
 def get_public_url(path: str) -> str:
     """
     Get public URL for a file in Supabase Storage.
@@ -140,7 +416,7 @@ def get_public_url(path: str) -> str:
     Returns:
         Public URL of the file
     """
-    return supabase.storage.from_(SUPABASE_BUCKET).get_public_url(path)
+    return public_url(path)
 
 
 def delete_blog_post(filename: str) -> bool:
@@ -154,8 +430,19 @@ def delete_blog_post(filename: str) -> bool:
         True if successful, False otherwise
     """
     try:
-        path = f"markdown/{filename}"
-        supabase.storage.from_(SUPABASE_BUCKET).remove([path])
+        names = [filename, *post_renderer.rendition_names(filename), artifacts_name(filename), manifest_name(filename)]
+        paths = {f"markdown/{name}" for name in names}
+        manifest = get_manifest(filename)
+        if manifest is not None:
+            paths.update(manifest.get("files", []))
+        # The post's own image folder, with or without a manifest (legacy shared
+        # image names outside it are left to the GC)
+        folder = f"images/{post_renderer.post_stem(filename)}"
+        paths.update(f"{folder}/{e['name']}" for e in list_all(folder) if e.get("id") is not None)
+        remove_many(paths)
+        log_change("delete", filename)
+        search_index.get_index().remove(filename)
+        topic_index.remove(filename)
         return True
     except Exception as e:
         print(f"Error deleting blog post {filename}: {e}")
@@ -0,0 +1,277 @@
+"""
+Topic Similarity Index
+
+Finds archived posts whose topic or blog title is close to a new topic, so a
+reworded request can reuse or refresh an existing post instead of paying for a
+full run. Similarity is estimated locally with MinHash over character 3-grams
+of the normalized words (order-insensitive, tolerant of plurals and small
+rewordings), with LSH banding so lookups only compare a few candidates.
+
+Each archived entry keeps the plan, the evidence URLs it was written from and
+the post filename, which is what a refresh needs to regenerate only the
+sections new research affects.
+
+The index file is shared by every worker process: writers reload it and
+rewrite it under a file lock, and readers reload it whenever it has changed
+on disk.
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, List, Optional, Set, Tuple
+
+import coordination
+import metrics
+
+# off: no lookups | report: look up and count hits only | reuse: return a fresh
+# match as-is (stale ones are refreshed) | refresh: always refresh the match
+POLICY = os.getenv("TOPIC_MATCH_POLICY", "report").lower()
+THRESHOLD = float(os.getenv("TOPIC_MATCH_THRESHOLD", "0.75"))
+# A "reuse" match older than this (by as_of) is refreshed instead
+REUSE_MAX_AGE_DAYS = int(os.getenv("TOPIC_REUSE_MAX_AGE_DAYS", "30"))
+INDEX_PATH = os.getenv("TOPIC_INDEX_PATH", ".topic_index.json")
+
+NUM_PERM = 64
+BANDS = 16  # 4 rows per band: a 0.75-similar pair shares a band with p > 0.99
+_ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 61) - 1
+_rng = random.Random(1)  # fixed seed: signatures must be stable across restarts
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+# Similarity buckets used for hit-rate-by-threshold reporting
+BUCKETS = [0.5, 0.6, 0.7, 0.75, 0.8, 0.9, 0.95]
+
+_STOPWORDS = {
+    "a", "an", "and", "are", "about", "for", "from", "guide", "how", "in", "into", "is",
+    "of", "on", "or", "the", "to", "what", "why", "with", "does", "do", "your", "you",
+    "it", "its", "they", "them", "this", "that", "these", "those", "explained", "introduction",
+}
+
+
+def _words(text: str) -> List[str]:
+    words = []
+    for w in re.findall(r"[a-z0-9]+", text.lower()):
+        if w in _STOPWORDS:
+            continue
+        if len(w) > 3 and w.endswith("s") and not w.endswith("ss"):
+            w = w[:-1]
+        words.append(w)
+    return words
+
+
+def shingles(text: str) -> Set[str]:
+    """Character 3-grams of each normalized word, with word-boundary padding."""
+    out = set()
+    for w in _words(text):
+        padded = f" {w} "
+        out.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return out
+
+
+def signature(text: str) -> List[int]:
+    """MinHash signature of the text's shingles."""
+    hashes = [
+        int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+        for s in shingles(text)
+    ]
+    if not hashes:
+        return [_PRIME] * NUM_PERM
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMS]
+
+
+def similarity(sig_a: List[int], sig_b: List[int]) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def _bands(sig: List[int]) -> List[Tuple[int, ...]]:
+    return [(i, *sig[i * _ROWS:(i + 1) * _ROWS]) for i in range(BANDS)]
+
+
+@dataclass
+class Match:
+    entry: dict  # {filename, topic, blog_title, as_of, plan, evidence_urls, ...}
+    similarity: float
+    action: str  # "report", "reuse" or "refresh"
+
+
+_lock = threading.Lock()
+_entries: Optional[Dict[str, dict]] = None  # filename -> entry
+_buckets: Dict[Tuple[int, ...], Set[str]] = {}
+_stamp: Optional[Tuple[int, int, int]] = None  # INDEX_PATH (inode, size, mtime) as loaded
+
+
+def _file_stamp() -> Optional[Tuple[int, int, int]]:
+    try:
+        st = os.stat(INDEX_PATH)
+    except OSError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def _load() -> Dict[str, dict]:
+    """The entries, reloaded when another process has rewritten the file. _lock held."""
+    global _entries, _stamp
+    stamp = _file_stamp()
+    if _entries is None or stamp != _stamp:
+        try:
+            with open(INDEX_PATH, "r", encoding="utf-8") as f:
+                _entries = json.load(f)
+        except (OSError, ValueError):
+            _entries = {}
+        _stamp = stamp
+        _buckets.clear()
+        for filename, entry in _entries.items():
+            _index(filename, entry)
+    return _entries
+
+
+def _index(filename: str, entry: dict) -> None:
+    for sig in (entry["topic_sig"], entry["title_sig"]):
+        for band in _bands(sig):
+            _buckets.setdefault(band, set()).add(filename)
+
+
+def _unindex(filename: str, entry: dict) -> None:
+    for sig in (entry["topic_sig"], entry["title_sig"]):
+        for band in _bands(sig):
+            _buckets.get(band, set()).discard(filename)
+
+
+def _save() -> None:
+    # Write a temp file and swap it in: a crash or a concurrent reader never
+    # sees a truncated index (which _load would treat as empty)
+    global _stamp
+    tmp = f"{INDEX_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(_entries, f)
+        os.replace(tmp, INDEX_PATH)
+        _stamp = _file_stamp()
+    except OSError as e:
+        print(f"Error saving topic index: {e}")
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def _age_days(entry_as_of: str, as_of: str) -> int:
+    try:
+        return abs((date.fromisoformat(as_of[:10]) - date.fromisoformat(entry_as_of[:10])).days)
+    except ValueError:
+        return REUSE_MAX_AGE_DAYS + 1
+
+
+def find_match(topic: str, as_of: str) -> Optional[Match]:
+    """
+    Find the closest archived post for a topic.
+
+    Args:
+        topic: Requested topic
+        as_of: Request date (ISO), used for the reuse age limit
+
+    Returns:
+        The best match at or above THRESHOLD with the action the policy picks
+        for it, or None (also when the policy is "off")
+    """
+    if POLICY == "off":
+        return None
+    sig = signature(topic)
+    with _lock:
+        entries = _load()
+        candidates = set()
+        for band in _bands(sig):
+            candidates |= _buckets.get(band, set())
+        scored = [
+            (max(similarity(sig, entries[f]["topic_sig"]), similarity(sig, entries[f]["title_sig"])), f)
+            for f in candidates if f in entries
+        ]
+
+    metrics.incr("topic_match.lookups")
+    best_score, best = max(scored, default=(0.0, None))
+    for b in BUCKETS:
+        if best_score >= b:
+            metrics.incr(f"topic_match.hits.ge_{b}")
+    if best is None or best_score < THRESHOLD:
+        return None
+
+    entry = entries[best]
+    if POLICY == "reuse" and _age_days(entry["as_of"], as_of) <= REUSE_MAX_AGE_DAYS:
+        action = "reuse"
+    elif POLICY in ("reuse", "refresh"):
+        action = "refresh"
+    else:
+        action = "report"
+    metrics.incr("topic_match.hits")
+    metrics.incr(f"topic_match.{action}")
+    return Match(entry=entry, similarity=round(best_score, 4), action=action)
+
+
+def record(topic: str, blog_title: str, filename: str, as_of: str, plan: dict, evidence_urls: List[str]) -> None:
+    """Add or replace the archive entry for a published post."""
+    entry = {
+        "filename": filename,
+        "topic": topic,
+        "blog_title": blog_title,
+        "as_of": as_of,
+        "plan": plan,
+        "evidence_urls": evidence_urls,
+        "topic_sig": signature(topic),
+        "title_sig": signature(blog_title),
+    }
+    # Reload and rewrite under the file lock so concurrent writers in other
+    # processes don't overwrite each other's entries
+    with _lock, coordination.file_lock(INDEX_PATH):
+        entries = _load()
+        if filename in entries:
+            _unindex(filename, entries[filename])
+        entries[filename] = entry
+        _index(filename, entry)
+        _save()
+
+
+def remove(filename: str) -> None:
+    """Forget a deleted post."""
+    with _lock, coordination.file_lock(INDEX_PATH):
+        entries = _load()
+        entry = entries.pop(filename, None)
+        if entry is not None:
+            _unindex(filename, entry)
+            _save()
+
+
+def hit_report() -> Dict[str, object]:
+    """
+    Match rates per similarity threshold, to tune TOPIC_MATCH_THRESHOLD.
+
+    Returns:
+        {"policy", "threshold", "lookups", "hits", "reused", "refreshed",
+         "by_threshold": {"0.8": {"hits", "hit_rate"}, ...}}
+    """
+    counters = metrics.snapshot()["counters"]
+    lookups = counters.get("topic_match.lookups", 0)
+    by_threshold = {}
+    for b in BUCKETS:
+        hits = counters.get(f"topic_match.hits.ge_{b}", 0)
+        by_threshold[str(b)] = {"hits": hits, "hit_rate": round(hits / lookups, 4) if lookups else None}
+    with _lock:
+        archived = len(_load())
+    return {
+        "policy": POLICY,
+        "threshold": THRESHOLD,
+        "archived": archived,
+        "lookups": lookups,
+        "hits": counters.get("topic_match.hits", 0),
+        "reused": counters.get("topic_match.reuse", 0),
+        "refreshed": counters.get("topic_match.refresh", 0),
+        "sections_reused": counters.get("topic_match.sections_reused", 0),
+        "sections_regenerated": counters.get("topic_match.sections_regenerated", 0),
+        "by_threshold": by_threshold,
+    }